@@ -23,6 +23,7 @@ Requires the config file gnss_data.cfg (in the running folder)
 Options:
 --purge_locks: deletes any locked files from repository and database
 --no_parallel: runs without parallelizing the execution
+--batch_size: processes the repository in batches of files of the same station
 """
 
 import os
@@ -55,11 +56,26 @@ from pgamit import pyPPP
 from pgamit import pyProducts
 
 repository_data_in = ''
+batch_pbar = None
+# seconds to wait for the advisory lock of a new station
+LOCK_TIMEOUT = 120
 cnn = dbConnection.Cnn('gnss_data.cfg')
 
 
 def insert_station_w_lock(cnn, StationCode, filename,
                           lat, lon, h, x, y, z, otl):
+    # serialize the creation of new stations with the same code using an advisory lock (other ArchiveService
+    # instances might be trying to add the same station). The locks table is only updated as a record of the files
+    # waiting for station metadata
+    with cnn.advisory_lock('???', StationCode, timeout=LOCK_TIMEOUT):
+        insert_station(cnn, StationCode, filename, lat, lon, h, x, y, z, otl)
+
+    # the new station has to be seen by the next spatial checks of this process
+    pyPPP.StationIndex.invalidate()
+
+
+def insert_station(cnn, StationCode, filename,
+                   lat, lon, h, x, y, z, otl):
     rs = cnn.query(
         """SELECT "NetworkCode" FROM
         (SELECT *, 2*asin(sqrt(sin((radians(%.8f)-radians(lat))/2)^2 +
@@ -82,21 +98,23 @@ def insert_station_w_lock(cnn, StationCode, filename,
         #  that no data should be added to this station
         # until a NetworkCode is assigned.
 
-        # check if network code exists
-        NetworkCode = '???'
-        index = 0
-        while cnn.query(
-            'SELECT * FROM stations '
-            'WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\''
-                % (NetworkCode, StationCode)).ntuples() != 0:
-
-            NetworkCode = hex(index).replace('0x', '').rjust(3, '?')
-            index += 1
-            if index > 255:
-                # FATAL ERROR! the networkCode exceed FF
-                raise Exception("While looking for a temporary network code, "
-                                "?ff was reached! Cannot continue executing pyArchiveService. "
-                                "Please free some temporary network codes.")
+        # check if network code exists: get all the temporary network codes used by this station in one query
+        # candidates are ???, ??0, ??1, ... ?fe
+        used = set(r['NetworkCode'] for r in cnn.query(
+            'SELECT "NetworkCode" FROM stations '
+            'WHERE "NetworkCode" LIKE \'?%%\' AND "StationCode" = \'%s\''
+            % StationCode).dictresult())
+
+        candidates = ['???'] + [hex(index).replace('0x', '').rjust(3, '?') for index in range(255)]
+        free = [code for code in candidates if code not in used]
+
+        if not free:
+            # FATAL ERROR! the networkCode exceed FF
+            raise Exception("While looking for a temporary network code, "
+                            "?ff was reached! Cannot continue executing pyArchiveService. "
+                            "Please free some temporary network codes.")
+
+        NetworkCode = free[0]
 
         # @todo optimize changing the query for EXISTS / LIMIT 1?
         rs = cnn.query(
@@ -203,13 +221,37 @@ def callback_handle(job):
             #  (misidentifying IGM1 for IGM0, for example).
             # This logic assumes that stations within
             #  100 m do not have the same name!
-            insert_station_w_lock(
-                cnn, StationCode, filename, lat, lon, h, x, y, z, otl)
+            try:
+                insert_station_w_lock(
+                    cnn, StationCode, filename, lat, lon, h, x, y, z, otl)
+            except dbConnection.dbErrLockTimeout as e:
+                log_job_error('Could not insert new station %s (%s): %s' % (StationCode, filename, str(e)))
 
     elif job.exception:
         log_job_error(job.exception)
 
 
+def callback_handle_batch(job):
+    # one job per batch: report each file as if it had been processed by its own job
+    batch = job.args[0]
+
+    if job.result is not None:
+        for result in job.result:
+            callback_handle(BatchJobResult(result))
+    elif job.exception:
+        callback_handle(job)
+
+    if batch_pbar is not None:
+        batch_pbar.update(len(batch))
+
+
+class BatchJobResult(object):
+    # minimal job-like object to pass the result of each file in a batch to callback_handle
+    def __init__(self, result):
+        self.result    = result
+        self.exception = None
+
+
 def check_rinex_timespan_int(rinex, stn):
 
     # how many seconds difference between
@@ -339,16 +381,55 @@ def verify_rinex_multiday(cnn, rinexinfo, Config):
     return False
 
 
-def process_crinex_file(crinez, filename, data_rejected, data_retry):
+def process_crinex_batch(batch, data_rejected, data_retry):
+    """
+    process a batch of CRINEZ files (grouped by station in main) reusing a single database connection, config
+    and archive structure. The events produced while processing the batch are inserted in a single transaction
+    (the rinex records are still inserted one by one, as each file is archived).
+    Returns a list with the (out_message, new_station) tuple of each file, same as process_crinex_file
+    """
+    try:
+        cnn = dbConnection.Cnn("gnss_data.cfg")
+        Config = pyOptions.ReadOptions("gnss_data.cfg")
+        archive = pyArchiveStruct.RinexStruct(cnn)
+
+    except Exception:
+        return [(traceback.format_exc() +
+                 ' while opening the database to process file %s node %s'
+                 % (crinez, platform.node()), None) for crinez, _ in batch]
+
+    results = []
+    cnn.buffer_events()
+    try:
+        for crinez, filename in batch:
+            results.append(process_crinex_file(crinez, filename, data_rejected, data_retry,
+                                               cnn, Config, archive))
+    finally:
+        try:
+            cnn.flush_events()
+        except dbConnection.DatabaseError:
+            # the files were already processed: report the error without losing the results of the batch
+            results.append((traceback.format_exc() + ' while saving the events of the batch in node %s'
+                            % platform.node(), None))
+        cnn.close()
+
+    return results
+
+
+def process_crinex_file(crinez, filename, data_rejected, data_retry, cnn=None, Config=None, archive=None):
+    # cnn, Config and archive can be passed by process_crinex_batch to reuse them between files
+    # only close the connection if it was opened here
+    close_cnn = cnn is None
 
     # create a uuid temporary folder in case we cannot read
     #  the year and doy from the file (and gets rejected)
     reject_folder = os.path.join(data_rejected, str(uuid.uuid4()))
 
     try:
-        cnn = dbConnection.Cnn("gnss_data.cfg")
-        Config = pyOptions.ReadOptions("gnss_data.cfg")
-        archive = pyArchiveStruct.RinexStruct(cnn)
+        if cnn is None:
+            cnn = dbConnection.Cnn("gnss_data.cfg")
+            Config = pyOptions.ReadOptions("gnss_data.cfg")
+            archive = pyArchiveStruct.RinexStruct(cnn)
         # apply local configuration (path to repo) in the executing node
         crinez = os.path.join(Config.repository_data_in, crinez)
 
@@ -357,6 +438,10 @@ def process_crinex_file(crinez, filename, data_rejected, data_retry):
                 ' while opening the database to process file %s node %s'
                 % (crinez, platform.node()), None)
 
+    def close():
+        if close_cnn:
+            cnn.close()
+
     # assume a default networkcode
     NetworkCode = 'rnx'
     try:
@@ -372,7 +457,7 @@ def process_crinex_file(crinez, filename, data_rejected, data_retry):
             EventType='error')
         error_handle(cnn, event, crinez, reject_folder,
                      filename, no_db_log=True)
-        cnn.close()
+        close()
         return event['Description'], None
 
     def fill_event(ev, desc=None):
@@ -392,14 +477,18 @@ def process_crinex_file(crinez, filename, data_rejected, data_retry):
 
     try:
         # main try except block
+        # DDG: before any heavy work (gfzrnx, PPP) ReadRinex checks if the
+        #  content of the file is already in the archive. Same file coming
+        #  from a different source or from a download backfill
         # type: pyRinex.ReadRinex
-        with pyRinex.ReadRinex(NetworkCode, StationCode, crinez) as rinexinfo:
+        with pyRinex.ReadRinex(NetworkCode, StationCode, crinez,
+                               duplicates=archive.get_rinex_by_fingerprint) as rinexinfo:
 
             # STOP! see if rinexinfo is a multiday rinex file
             if not verify_rinex_multiday(cnn, rinexinfo, Config):
                 # was a multiday rinex. verify_rinex_date_multiday
                 #  took care of it
-                cnn.close()
+                close()
                 return None, None
 
             # DDG: we don't use otl coefficients because
@@ -572,13 +661,21 @@ def process_crinex_file(crinez, filename, data_rejected, data_retry):
                     # this will be removed by user so that the file
                     # gets reprocessed once all the metadata is ready
                     cnn.insert('locks', filename=os.path.relpath(crinez, Config.repository_data_in))
-                    cnn.close()
+                    close()
                     return None, [StationCode,
                                   (ppp.x, ppp.y, ppp.z),
                                   coeff,
                                   (ppp.lat[0], ppp.lon[0], ppp.h[0]),
                                   crinez]
 
+    except pyRinex.pyRinexExceptionDuplicate as e:
+        os.remove(crinez)
+
+        fill_event(e.event, ' CRINEZ deleted from data_in.')
+        e.event['NetworkCode'] = e.match[0]['NetworkCode']
+
+        cnn.insert_event(e.event)
+
     except (pyRinex.pyRinexExceptionBadFile,
             pyRinex.pyRinexExceptionSingleEpoch,
             pyRinex.pyRinexExceptionNoAutoCoord) as e:
@@ -686,14 +783,34 @@ def process_crinex_file(crinez, filename, data_rejected, data_retry):
 
         error_handle(cnn, event, crinez, retry_folder,
                      filename, no_db_log=True)
-        cnn.close()
+        close()
 
         return event['Description'], None
 
-    cnn.close()
+    close()
     return None, None
 
 
+def make_batches(files_list, batch_size):
+    # group the files by station (files of the same station are usually in the same folder) and split each group
+    # in batches of up to batch_size files sorted by name (i.e. by date)
+    stations = {}
+    for path, file in files_list:
+        try:
+            key = pyRinexName.RinexNameFormat(file).StationCode.lower()
+        except pyRinexName.RinexNameException:
+            # will be rejected by process_crinex_file
+            key = ''
+        stations.setdefault(key, []).append((path, file))
+
+    batches = []
+    for key in sorted(stations):
+        files = sorted(stations[key], key=lambda f: f[1])
+        batches += [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+
+    return batches
+
+
 def remove_empty_folders(folder):
     # Listing the files
     for dirpath, _, files in os.walk(folder, topdown=False):
@@ -898,6 +1015,7 @@ def main():
     #  to use inside callback_handle
     global cnn
     global repository_data_in
+    global batch_pbar
 
     # bind to the repository directory
     parser = argparse.ArgumentParser(description='Archive operations Main Program')
@@ -914,6 +1032,12 @@ def main():
     parser.add_argument('-np', '--noparallel', action='store_true',
                         help="Execute command without parallelization.")
 
+    parser.add_argument('-batch', '--batch_size', type=int, default=0, metavar='{max_files}',
+                        help="Process the repository in batches of up to max_files files of the same station per "
+                             "job. Each batch reuses a single database connection and inserts its events in a "
+                             "single transaction. Recommended to process large backlogs. Default is 0 (one file "
+                             "per job).")
+
     add_version_argument(parser)
 
     args = parser.parse_args()
@@ -954,15 +1078,12 @@ def main():
         if not os.path.isdir(path):
             os.makedirs(path)
 
-    # delete any locks with a NetworkCode != '?%'
+    # delete any locks with a NetworkCode != '?%' (already taken care of)
     cnn.query('DELETE FROM locks WHERE "NetworkCode" NOT LIKE \'?%\'')
-    # get the locks to avoid reprocessing files
-    #  that had no metadata in the database
-    locks = cnn.query('SELECT * FROM locks').dictresult()
 
     if args.purge_locks:
         # first, delete all associated files
-        for lock in tqdm(locks, ncols=160, unit='crz',
+        for lock in tqdm(cnn.query('SELECT filename FROM locks').dictresult(), ncols=160, unit='crz',
                          desc='%-30s' % ' >> Purging locks', disable=None):
             file_try_remove(os.path.join(Config.repository_data_in,
                                          lock['filename']))
@@ -972,15 +1093,16 @@ def main():
         cnn.query('delete from stations where "NetworkCode" like \'?%\'')
         # purge the networks
         cnn.query('delete from networks where "NetworkCode" like \'?%\'')
-        # purge the locks already taken care of (just in case)
-        cnn.query('delete from locks where "NetworkCode" not like \'?%\'')
-        # get the locks to avoid reprocessing files
-        # that had no metadata in the database
-        locks = cnn.query('SELECT * FROM locks').dictresult()
+
+    # get the locks to avoid reprocessing files
+    #  that had no metadata in the database
+    locks = cnn.query('SELECT filename FROM locks').dictresult()
 
     # look for data in the data_in_retry and move it to data_in
 
     archive = pyArchiveStruct.RinexStruct(cnn)
+    # make sure the rinex table has the Fingerprint column
+    archive.db_checks()
 
     pbar = tqdm(desc='%-30s' % ' >> Scanning data_in_retry',
                 ncols=160, unit='crz', disable=None)
@@ -1047,10 +1169,25 @@ def main():
                 insert_data, verify_rinex_multiday, file_append,
                 file_try_remove, file_open)
 
+    if args.batch_size > 0:
+        # the progress bar is updated per file by callback_handle_batch
+        batch_pbar = pbar
+        batches = make_batches(files_list, args.batch_size)
+        tqdm.write(" -- Processing in %i batches of up to %i files" % (len(batches), args.batch_size))
+
+        function = process_crinex_batch
+        depfuncs += (process_crinex_file,)
+        callback = callback_handle_batch
+        pbar = None
+    else:
+        batches = None
+        function = process_crinex_file
+        callback = callback_handle
+
     # import modules
-    JobServer.create_cluster(process_crinex_file,
+    JobServer.create_cluster(function,
                              depfuncs,
-                             callback_handle,
+                             callback,
                              pbar,
                              modules=('pgamit.pyRinex',
                                       'pgamit.pyArchiveStruct',
@@ -1063,11 +1200,18 @@ def main():
                                       'datetime', 'numpy', 'traceback',
                                       'platform'))
 
-    for file_to_process, sfile in files_list:
-        JobServer.submit(file_to_process, sfile, data_reject, data_in_retry)
+    if batches is not None:
+        for batch in batches:
+            JobServer.submit(batch, data_reject, data_in_retry)
+    else:
+        for file_to_process, sfile in files_list:
+            JobServer.submit(file_to_process, sfile, data_reject, data_in_retry)
 
     JobServer.wait()
 
+    if batches is not None:
+        pbar = batch_pbar
+
     pbar.close()
 
     JobServer.close_cluster()
@@ -17,9 +17,11 @@ import ftplib
 import glob
 import re
 import hashlib
+import heapq
 # py
 import os
 import queue
+import random
 import shutil
 import socket
 import subprocess
@@ -30,6 +32,7 @@ import traceback
 # @todo py3.8:
 # from typing import Literal
 from abc import ABC, abstractmethod
+from array import array
 from datetime import datetime
 from typing import Any, Dict, List, NamedTuple, Optional
 
@@ -42,6 +45,7 @@ from tqdm import tqdm
 # app
 from pgamit import (Utils, dbConnection, pyArchiveStruct, pyJobServer,
                     pyOptions, pyRinex, pyRinexName, pyStationInfo)
+from pgamit.proto_download import LISTING_TTL, ListingCache
 from pgamit.pyDate import Date
 from pgamit.pyRinexName import path_replace_tags
 from pgamit.Utils import (dir_try_remove, file_try_remove, fqdn_parse,
@@ -51,6 +55,12 @@ SERVER_REFRESH_INTERVAL = 2   # in seconds
 SERVER_CONNECTION_TIMEOUT = 20  # in seconds
 SERVER_RECONNECTION_INTERVAL = 3   # in seconds
 SERVER_MAX_RECONNECTIONS = 8
+SERVER_MAX_BACKOFF = 120  # in seconds
+SERVER_SESSIONS = 2  # persistent connections per server
+MAX_DOWNLOADS = 32   # concurrent downloads, all servers together
+
+CONNECTION_STOPPED = 'Connection STOPPED'
+NOT_LISTED = 'File not in remote listing'
 
 DEBUG = True
 
@@ -163,12 +173,14 @@ class Msg:
     # Messages from downloaders:
     class DOWNLOAD_RESULT(NamedTuple):
         server_id: int
+        session: int
         elapsed_time: int
         size: int
         error: Optional[str]
 
     class CLIENT_STOPPED(NamedTuple):
         server_id: int
+        session: int
 
     # Messages from dispy job manager:
     class PROCESS_RESULT(NamedTuple):
@@ -303,89 +315,53 @@ is not possible because we want to maximize fetching parallelism. So
 an arbitrarily sized queue is needed, but it can be too memory expensive
 for multi-year / multi-stations fetches. A way to store the queue compactly
 in memory is needed.
-FIFO order is not required, so use an unordered collection.'''
+FIFO order is not required, but the most recent days are the most wanted ones
+in a backfill, so the files are handed out by date, most recent first. Within
+a date the order does not matter: each date keeps a packed array of
+(station, source) pairs.'''
 
 # FileDescriptor limits
 MAX_DATE_MJD = 2 ** 32
+MAX_IDX = 2 ** 32
 
 
 class FilesBag:
-    class Dates:
-        CHUNK_SIZE = 4096
-
-        def __init__(self):
-            self.chunks = []
-            self.last_chunk_len = 0
-            # always keep a chunk to optimize 0/1 oscillation case
-            self._first_chunk = np.empty(self.CHUNK_SIZE, dtype=np.uint32)
-
-        def push(self, date_mjd: int):
-            if not self.chunks or self.last_chunk_len == self.CHUNK_SIZE:
-                chunk = self._first_chunk if not self.chunks else \
-                        np.empty(self.CHUNK_SIZE, dtype=np.uint32)
-                self.chunks.append(chunk)
-                self.last_chunk_len = 0
-            else:
-                chunk = self.chunks[-1]
-            chunk[self.last_chunk_len] = date_mjd
-            self.last_chunk_len += 1
-
-        def pop(self):
-            date_mjd = self.chunks[-1][self.last_chunk_len - 1]
-            if self.last_chunk_len == 1:
-                self.chunks.pop()
-                self.last_chunk_len = self.CHUNK_SIZE if len(
-                    self.chunks) else 0
-            else:
-                self.last_chunk_len -= 1
-            return date_mjd
-
-        def is_empty(self):
-            return len(self.chunks) <= 1 and self.last_chunk_len == 0
-
-        def __len__(self):
-            if not len(self.chunks):
-                return 0
-            return ((len(self.chunks) - 1)
-                    * self.CHUNK_SIZE
-                    + self.last_chunk_len)
-
     def __init__(self):
-        self.stations = {}  # stn_idx -> { src_idx : FilesBag.Dates }
+        self.dates = {}  # date_mjd -> array('Q') of stn_idx << 32 | src_idx
+        self.heap = []   # -date_mjd for each key of self.dates
         self.qty = 0
-        self.nonempty_keys = set()
 
     def push(self, f: FileDescriptor):
         assert 0 <= f.date_mjd < MAX_DATE_MJD
+        assert 0 <= f.stn_idx < MAX_IDX and 0 <= f.src_idx < MAX_IDX
 
-        stn = self.stations.get(f.stn_idx, None)
-        if stn is None:
-            self.stations[f.stn_idx] = stn = {}
-
-        dates = stn.get(f.src_idx, None)
-        if dates is None:
-            stn[f.src_idx] = dates = FilesBag.Dates()
+        files = self.dates.get(f.date_mjd, None)
+        if files is None:
+            self.dates[f.date_mjd] = files = array('Q')
+            heapq.heappush(self.heap, -f.date_mjd)
 
-        dates.push(f.date_mjd)
-        # for faster retrieval:
-        self.nonempty_keys.add((f.stn_idx, f.src_idx))
+        files.append(f.stn_idx << 32 | f.src_idx)
         self.qty += 1
 
     def pop(self) -> FileDescriptor:
         if not self.qty:
             raise Exception("Empty FilesBag")
 
-        (stn_idx, src_idx) = next(iter(self.nonempty_keys))
-        dates = self.stations[stn_idx][src_idx]
-        date_mjd = dates.pop()
-        if dates.is_empty():
-            # don't delete, optimize for 1/0 oscillation case
-            self.nonempty_keys.remove((stn_idx, src_idx))
+        date_mjd = -self.heap[0]
+        files = self.dates[date_mjd]
+        key = files.pop()
+        if not files:
+            heapq.heappop(self.heap)
+            del self.dates[date_mjd]
         self.qty -= 1
-        return FileDescriptor(stn_idx=stn_idx,
-                              src_idx=src_idx,
+        return FileDescriptor(stn_idx=key >> 32,
+                              src_idx=key & (MAX_IDX - 1),
                               date_mjd=date_mjd)
 
+    def peek_date(self) -> Optional[int]:
+        """ date of the file that pop() would return """
+        return -self.heap[0] if self.heap else None
+
     def __len__(self):
         return self.qty
 
@@ -403,8 +379,9 @@ def thread_queue_all_files(cnn, drange, stations, msg_outbox):
     stations_items = tuple(stations.items())
 
     # iterate in (date, stations) order instead of (station, date) to maximize
-    # parallelism between different station servers.
-    for date_mjd in drange:
+    # parallelism between different station servers. Most recent days first,
+    # they are the most wanted ones.
+    for date_mjd in drange[::-1]:
         date = Date(mjd=date_mjd)
         for (stn_idx, stn) in stations_items:
             f = FileDescriptor(stn_idx=stn_idx, date_mjd=date_mjd, src_idx=0)
@@ -526,6 +503,153 @@ class JobsManager:
                     tqdm.write('%s Queued Process format=%r: %s'
                                % (f.desc, f.source.format, f.url))
 
+###############################################################################
+# Download Scheduler
+###############################################################################
+# Every server gets a pool of persistent sessions (one Client thread each),
+# opened on demand. The files waiting for a session are handed out most recent
+# dates first, keeping at most `sessions` transfers per server and
+# `max_downloads` transfers overall.
+
+
+class ServerPool:
+    src: Source
+    clients: List['Client']
+    files_current: Dict[int, File]  # session -> File
+    files_pending: FilesBag
+    sessions_stopped: set
+
+    def __init__(self, src: Source, sessions: int,
+                 on_download_result, on_client_stopped,
+                 listings: Optional[ListingCache] = None):
+        self.src = src
+        self.sessions = sessions
+        self.listings = listings
+        self.on_download_result = on_download_result
+        self.on_client_stopped = on_client_stopped
+
+        self.clients = []
+        self.files_current = {}
+        self.files_pending = FilesBag()
+        self.sessions_stopped = set()
+
+    @property
+    def stopped(self):
+        # Once a session is lost no more sessions are opened: the server is
+        # either down or limiting the connections. So the pool is stopped
+        # when the sessions it has are.
+        return (bool(self.sessions_stopped)
+                and len(self.sessions_stopped) == len(self.clients))
+
+    def _idle_session(self) -> Optional['Client']:
+        for client in self.clients:
+            if (client.session not in self.files_current
+                    and client.session not in self.sessions_stopped):
+                return client
+        return None
+
+    def _can_open(self):
+        return len(self.clients) < self.sessions and not self.sessions_stopped
+
+    def has_room(self):
+        return self._idle_session() is not None or self._can_open()
+
+    def start(self, f: File):
+        client = self._idle_session()
+        if not client:
+            host, port = fqdn_parse(self.src.fqdn)
+            client = Client(self.on_download_result, self.on_client_stopped,
+                            self.src.server_id,
+                            self.src.protocol.upper(), host, port,
+                            self.src.username, self.src.password,
+                            session=len(self.clients),
+                            listings=self.listings)
+            self.clients.append(client)
+            client.start_thread()
+
+        client.set_next_download(f.urlpath_file, f.abspath_down_file)
+        self.files_current[client.session] = f
+
+    def finish(self):
+        for client in self.clients:
+            client.finish()
+
+
+class DownloadScheduler:
+    def __init__(self, stations: Dict[int, Station],
+                 on_download_result, on_client_stopped,
+                 sessions: int = SERVER_SESSIONS,
+                 max_downloads: int = MAX_DOWNLOADS,
+                 listings_path: Optional[str] = None,
+                 listings_ttl: float = LISTING_TTL):
+        self.stations = stations
+        self.on_download_result = on_download_result
+        self.on_client_stopped = on_client_stopped
+        self.sessions = sessions
+        self.max_downloads = max_downloads
+        self.listings_path = listings_path
+        self.listings_ttl = listings_ttl
+
+        self.servers: Dict[int, ServerPool] = {}  # server_id -> ServerPool
+        self.downloads = 0
+
+    def server(self, src: Source) -> ServerPool:
+        server = self.servers.get(src.server_id, None)
+        if not server:
+            # the files of every station and date in the same remote
+            # directory are resolved with a single listing
+            listings = ListingCache(source_host_desc(src),
+                                    self.listings_path, self.listings_ttl)
+            server = ServerPool(src, self.sessions,
+                                self.on_download_result,
+                                self.on_client_stopped,
+                                listings)
+            self.servers[src.server_id] = server
+        return server
+
+    def queue(self, f: File):
+        self.server(f.source).files_pending.push(f.to_descriptor())
+        self.dispatch()
+
+    def dispatch(self):
+        while self.downloads < self.max_downloads:
+            # the most recent pending date among the servers with room
+            best = None
+            for server in self.servers.values():
+                date_mjd = server.files_pending.peek_date()
+                if (date_mjd is not None
+                        and (best is None
+                             or date_mjd > best.files_pending.peek_date())
+                        and server.has_room()):
+                    best = server
+            if best is None:
+                return
+
+            fd = best.files_pending.pop()
+            best.start(File.from_descriptor(self.stations, fd))
+            self.downloads += 1
+
+    def download_finished(self, server_id: int, session: int) -> File:
+        self.downloads -= 1
+        return self.servers[server_id].files_current.pop(session)
+
+    def session_stopped(self, server_id: int,
+                        session: int) -> List[FileDescriptor]:
+        """ returns the files that were waiting for a server that is now
+        stopped (they have to go to their next source) """
+        server = self.servers[server_id]
+        server.sessions_stopped.add(session)
+        files = []
+        if server.stopped:
+            while not server.files_pending.is_empty():
+                files.append(server.files_pending.pop())
+        return files
+
+    def finish(self):
+        for server in self.servers.values():
+            server.finish()
+
+
 ###############################################################################
 # Download coordinator
 ###############################################################################
@@ -537,31 +661,24 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
                                jobs_manager: JobsManager,
                                abspath_repository_dir: str,
                                stnlist: List[Any],
-                               drange):
-
-    class Server:
-        files_pending: FilesBag
-        file_current: Optional[File]
-        client: Client
-        stopped: bool
-
-        def __init__(self, client):
-            self.client = client
-            self.files_pending = FilesBag()
-            self.file_current = None
-            self.stopped = False
+                               drange,
+                               sessions: int = SERVER_SESSIONS,
+                               max_downloads: int = MAX_DOWNLOADS,
+                               listings_path: Optional[str] = None,
+                               listings_ttl: float = LISTING_TTL):
 
     msg_inbox: queue.Queue[Msg] = queue.Queue(8192)
     # Limit memory usage / overall backpressure
     stations: Dict[int, Station] = {}  # station_idx -> Station
-    servers: Dict[int, Server] = {}  # server_id -> Server
 
     files_pending_qty = 0
 
-    def on_download_result(server_id: int, error: Optional[str],
+    def on_download_result(server_id: int, session: int,
+                           error: Optional[str],
                            elapsed_time=0, size=0, timeout=None):
         try:
             msg_inbox.put(Msg.DOWNLOAD_RESULT(server_id=server_id,
+                                              session=session,
                                               elapsed_time=elapsed_time,
                                               size=size,
                                               error=error),
@@ -574,8 +691,16 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
         msg_inbox.put(Msg.PROCESS_RESULT(file=file,
                                          error=error))
 
-    def on_client_stopped(server_id: int):
-        msg_inbox.put(Msg.CLIENT_STOPPED(server_id=server_id))
+    def on_client_stopped(server_id: int, session: int):
+        msg_inbox.put(Msg.CLIENT_STOPPED(server_id=server_id,
+                                         session=session))
+
+    scheduler = DownloadScheduler(stations,
+                                  on_download_result, on_client_stopped,
+                                  sessions, max_downloads,
+                                  listings_path, listings_ttl)
+    servers = scheduler.servers
+    ListingCache.purge(listings_path, listings_ttl)
 
     class stats:
         ok = 0
@@ -599,7 +724,7 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
         for s in servers.values():
             if s.stopped:
                 s_stopped += 1
-            elif s.file_current:
+            elif s.files_current:
                 s_downloading += 1
             else:
                 s_idle += 1
@@ -608,8 +733,8 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
             files="[db_no_info=%d db_exists=%d not_found=%d process_ok=%d process_error=%d ok=%d]"
                   % (stats.db_no_info, stats.db_exists, stats.not_found,
                      stats.process_ok, stats.process_error, stats.ok),
-            servers="[active=%d idle=%d stopped=%d]"
-                    % (s_downloading, s_idle, s_stopped))
+            servers="[active=%d idle=%d stopped=%d downloads=%d]"
+                    % (s_downloading, s_idle, s_stopped, scheduler.downloads))
         pbar.update()
         # print("files_pending_qty=%d" % files_pending_qty)
 
@@ -618,30 +743,15 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
 
         stn = stations[stn_idx]
         if src_idx < len(stn.sources):
-            src = stn.sources[src_idx]
-            server = servers.get(src.server_id, None)
-            if not server:
-                host, port = fqdn_parse(src.fqdn)
-
-                client = Client(on_download_result, on_client_stopped,
-                                src.server_id,
-                                src.protocol.upper(), host, port,
-                                src.username, src.password)
-                server = Server(client)
-                servers[src.server_id] = server
-                client.start_thread()
-
             f = File.from_params(stations,
                                  stn_idx=stn_idx,
                                  date_mjd=date_mjd,
                                  src_idx=src_idx)
 
-            if server.file_current:
-                server.files_pending.push(f)
+            if scheduler.server(f.source).stopped:
+                download_error(f, CONNECTION_STOPPED)
             else:
-                server.client.set_next_download(f.urlpath_file,
-                                                f.abspath_down_file)
-                server.file_current = f
+                scheduler.queue(f)
 
         else:
             # Sources exhausted
@@ -655,6 +765,11 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
     def queue_download_next_source(f: FileDescriptor):
         queue_download(f.stn_idx, f.date_mjd, f.src_idx + 1)
 
+    def download_error(f: File, error: str):
+        tqdm.write('%s Download Error! %s %s: %s'
+                   % (f.desc, f.src_desc, f.url, error))
+        queue_download_next_source(f)
+
     #  1- Query DB for stations + source sinfo
 
     with tqdm(desc=' >> Querying Stations',
@@ -743,10 +858,14 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
                 file_finished(f, 'FILE IGNORED: File exists in DB')
 
             elif isinstance(msg, Msg.CLIENT_STOPPED):
-                server = servers[msg.server_id]
-                tqdm.write('[SERVER-%03d] WARNING: CONNECTION STOPPED (%s)' %
-                           (msg.server_id, server.client.proto.desc()))
-                server.stopped = True
+                tqdm.write('[SERVER-%03d/%d] WARNING: CONNECTION STOPPED (%s)' %
+                           (msg.server_id, msg.session,
+                            source_host_desc(servers[msg.server_id].src)))
+
+                for fd in scheduler.session_stopped(msg.server_id,
+                                                    msg.session):
+                    download_error(File.from_descriptor(stations, fd),
+                                   CONNECTION_STOPPED)
 
                 # for (stn_idx, stn) in stations.items():
                 #     for src in stn.sources:
@@ -757,14 +876,14 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
                 #         stations_stopped.add(stn_idx)
 
             elif isinstance(msg, Msg.DOWNLOAD_RESULT):
-                server = servers[msg.server_id]
-                f = server.file_current
-                server.file_current = None
-
-                if msg.error:
-                    tqdm.write('%s Download Error! %s %s: %s'
-                               % (f.desc, f.src_desc, f.url, msg.error))
-                    queue_download_next_source(f)
+                f = scheduler.download_finished(msg.server_id, msg.session)
+
+                if (msg.error == CONNECTION_STOPPED
+                        and not servers[msg.server_id].stopped):
+                    # the other sessions to the server are still working
+                    scheduler.queue(f)
+                elif msg.error:
+                    download_error(f, msg.error)
                 else:
                     postfix = ("size=%dkB time=%ds speed=%dkB/s %s %s"
                                % (msg.size//1024, msg.elapsed_time,
@@ -779,10 +898,8 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
                         stats.ok += 1
                         file_finished(f, 'DOWNLOAD OK: %s' % postfix)
 
-                # Pop next file for same server
-                if not server.files_pending.is_empty():
-                    fd = server.files_pending.pop()
-                    queue_download(fd.stn_idx, fd.date_mjd, fd.src_idx)
+                # Hand the free session to the next file
+                scheduler.dispatch()
 
             elif isinstance(msg, Msg.PROCESS_RESULT):
                 f = File.from_descriptor(stations, msg.file)
@@ -803,8 +920,7 @@ def download_all_stations_data(cnn: dbConnection.Cnn,
     tqdm.write('-'*70)
     tqdm.write('Finished all Downloads and Processing')
 
-    for server in servers.values():
-        server.client.finish()
+    scheduler.finish()
 
     for stn in stations.values():
         # This will keep the dest_dir if files are present in it:
@@ -824,6 +940,7 @@ def process_file(abspath_scripts_dir: str,
     abspath_down_dir, fname_down = os.path.split(abspath_down_file)
 
     abspath_tmp_dir = None
+    cnn = None
     try:
         abspath_tmp_dir = tempfile.mkdtemp(
             suffix='.tmp', prefix=os.path.join(abspath_down_dir, 'process.'))
@@ -885,7 +1002,18 @@ def process_file(abspath_scripts_dir: str,
                 shutil.move(file, new_file)
                 file = new_file
 
-            rinex = pyRinex.ReadRinex('???', StationCode, file)
+            # DDG: skip files whose content is already in the archive (e.g.
+            #      download backfills) before running any heavy work
+            if cnn is None:
+                cnn = dbConnection.Cnn('gnss_data.cfg')
+                archive = pyArchiveStruct.RinexStruct(cnn)
+
+            try:
+                rinex = pyRinex.ReadRinex('???', StationCode, file,
+                                          duplicates=archive.get_rinex_by_fingerprint)
+            except pyRinex.pyRinexExceptionDuplicate:
+                continue
+
             # compress rinex and output it to abspath_down_dir
             # DDG: apply the naming convention before moving the file
             #      this solves uppercase to lowercase, wrong date, etc
@@ -893,6 +1021,8 @@ def process_file(abspath_scripts_dir: str,
             rinex.compress_local_copyto(abspath_down_dir)
 
     finally:
+        if cnn is not None:
+            cnn.close()
         if abspath_tmp_dir:
             dir_try_remove(abspath_tmp_dir, recursive=True)
         file_try_remove(abspath_down_file)
@@ -919,6 +1049,15 @@ class IProtocol(ABC):
                    self.username + "@" if self.username else '',
                    self.fqdn))
 
+    @staticmethod
+    def backoff(attempt: int):
+        """ seconds to wait before retry #attempt (1, 2, ...). Grows
+        exponentially, with some jitter so that the sessions to the same
+        server do not retry in lockstep """
+        delay = min(SERVER_RECONNECTION_INTERVAL * 2 ** (attempt - 1),
+                    SERVER_MAX_BACKOFF)
+        return delay * random.uniform(0.5, 1)
+
     @abstractmethod
     def connect(self):
         pass
@@ -1209,7 +1348,7 @@ class ProtocolHTTP(IProtocol):
                                     'array'
                                 ]
                                 self.session.cookies.set("challenge_token", csn_hash_token(token_parts))
-                            time.sleep(3)
+                            time.sleep(self.backoff(attempt + 1))
                         else:
                             raise Exception(error)
                     else:
@@ -1248,6 +1387,7 @@ class Client:
         abspath_down_file: str
 
     server_id: int
+    session: int
     proto: IProtocol
     cond: threading.Condition
     state: str  # Literal['STARTED', 'STOP_PENDING', 'STOPPED',
@@ -1257,12 +1397,16 @@ class Client:
     def __init__(self,
                  on_download_result, on_client_stopped,
                  server_id: int,
-                 protocol, host, port, username, password):
+                 protocol, host, port, username, password,
+                 session: int = 0,
+                 listings: Optional[ListingCache] = None):
 
         self.on_download_result = on_download_result
         self.on_client_stopped = on_client_stopped
 
         self.server_id = server_id
+        self.session = session
+        self.listings = listings
         self.cond = threading.Condition()
         self.state = 'STARTED'
         self.next_download = None
@@ -1304,7 +1448,7 @@ class Client:
                 self.cond.notify()
 
     def _client_thread(self):
-        prefix = '[SERVER-%03d]' % self.server_id
+        prefix = '[SERVER-%03d/%d]' % (self.server_id, self.session)
         conn_retries = 0
         connected = False
 
@@ -1357,8 +1501,15 @@ class Client:
                         t_start = time.time()
                         error = None
                         try:
-                            error = self.proto.download(f.urlpath_file,
-                                                        f.abspath_down_file)
+                            if (self.listings is not None
+                                    and self.listings.available(
+                                        self.proto.list_dir,
+                                        f.urlpath_file) is False):
+                                # known to be missing, don't ask the server
+                                error = NOT_LISTED
+                            else:
+                                error = self.proto.download(
+                                    f.urlpath_file, f.abspath_down_file)
                             t_elapsed = time.time() - t_start
                             if not error:
                                 size = os.path.getsize(f.abspath_down_file)
@@ -1383,7 +1534,7 @@ class Client:
                             self.next_download = None
 
                         while not self.on_download_result(
-                                self.server_id,
+                                self.server_id, self.session,
                                 None if not error else error,
                                 t_elapsed, size,
                                 timeout=SERVER_REFRESH_INTERVAL):
@@ -1400,14 +1551,14 @@ class Client:
 
                     if conn_retries < SERVER_MAX_RECONNECTIONS:
                         try_proto_disconnect()
-                        time.sleep(SERVER_RECONNECTION_INTERVAL)
+                        time.sleep(self.proto.backoff(conn_retries))
                         continue
                     else:
                         return
         finally:
             tqdm.write("%s STOPPING connection to: %s"
                        % (prefix, self.proto.desc()))
-            self.on_client_stopped(self.server_id)
+            self.on_client_stopped(self.server_id, self.session)
 
             try_proto_disconnect()
 
@@ -1427,8 +1578,8 @@ class Client:
                 if f:
                     # We want to log the complete tries for all the files,
                     #  so they are discarded here just like before.
-                    self.on_download_result(self.server_id,
-                                            "Connection STOPPED")
+                    self.on_download_result(self.server_id, self.session,
+                                            CONNECTION_STOPPED)
                     with self.cond:
                         self.next_download = None
                 elif state == 'FINISH_PENDING':
@@ -1471,6 +1622,18 @@ def main():
     parser.add_argument('-np', '--noparallel', action='store_true',
                         help="Execute command without parallelization.")
 
+    parser.add_argument('-sessions', '--sessions', nargs=1, metavar='{n}',
+                        type=int, default=[SERVER_SESSIONS],
+                        help='''Number of persistent connections (and
+                             concurrent downloads) to open to each server.
+                             Default: %d''' % SERVER_SESSIONS)
+
+    parser.add_argument('-max', '--max_downloads', nargs=1, metavar='{n}',
+                        type=int, default=[MAX_DOWNLOADS],
+                        help='''Maximum number of concurrent downloads,
+                             all servers together. Default: %d'''
+                             % MAX_DOWNLOADS)
+
     add_version_argument(parser)
 
     try:
@@ -1522,6 +1685,9 @@ def main():
         if db_migrate_if_needed(cnn):
             tqdm.write(" ** DB MIGRATED TO NEW VERSION ** ")
 
+        # process_file looks up the rinex fingerprints to skip files we already have
+        pyArchiveStruct.RinexStruct(cnn).db_checks()
+
         # Cluster Job Server
         job_server = pyJobServer.JobServer(Config, check_atx=False,
                                            check_executables=False,
@@ -1532,7 +1698,14 @@ def main():
         depfuncs = (dir_try_remove, file_try_remove)
         depmodules = ('tempfile', 'shutil', 'os', 'subprocess', 'glob',
                       # app
-                      'pgamit.pyRinex', 'pgamit.pyRinexName')
+                      'pgamit.pyRinex', 'pgamit.pyRinexName',
+                      'pgamit.dbConnection', 'pgamit.pyArchiveStruct')
+
+        # remote directory listings are kept here between runs
+        listings_path = Config.options.get('listings_cache')
+        if listings_path:
+            listings_path = os.path.expandvars(listings_path)
+        listings_ttl = float(Config.options.get('listings_ttl')) * 3600
 
         jobs_mgr = JobsManager(job_server, Config.format_scripts_path)
         job_server.create_cluster(process_file,  # called in remote node
@@ -1544,7 +1717,10 @@ def main():
         try:
             download_all_stations_data(cnn, jobs_mgr,
                                        Config.repository_data_in,
-                                       stnlist, drange)
+                                       stnlist, drange,
+                                       max(args.sessions[0], 1),
+                                       max(args.max_downloads[0], 1),
+                                       listings_path, listings_ttl)
             job_server.wait()
         finally:
             job_server.close_cluster()
@@ -9,87 +9,46 @@ and gradients)
 """
 
 import argparse
-import os
 
 # app
 from pgamit import pyOptions
 from pgamit import dbConnection
 from pgamit import pyDate
 from pgamit import snxParse
-from pgamit.Utils import (process_date, process_stnlist, file_open, add_version_argument)
+from pgamit.Utils import (process_date, process_stnlist, get_norm_year_str, add_version_argument)
 
 
-def replace_in_sinex(sinex, observations, unknowns, new_val):
-
-    new_unknowns = \
-""" NUMBER OF UNKNOWNS%22i
- NUMBER OF DEGREES OF FREEDOM%12i
- PHASE MEASUREMENTS SIGMA          0.0025
+# statistics that glbtosnx does not report
+SINEX_STATISTICS = \
+""" PHASE MEASUREMENTS SIGMA          0.0025
  SAMPLING INTERVAL (SECONDS)           30
-""" % (new_val, observations - new_val)
+"""
 
-    sinex_path = os.path.basename(os.path.splitext(sinex)[0]) + '_MOD.snx'
-    with file_open(sinex_path, 'w') as nsnx:
-        with file_open(sinex, 'r') as osnx:
-            for line in osnx:
-                if ' NUMBER OF UNKNOWNS%22i' % unknowns in line:
-                    # empty means local directory! LA RE PU...
-                    nsnx.write(new_unknowns)
-                else:
-                    nsnx.write(line)
 
-    # rename file
-    os.remove(sinex)
-    os.renames(sinex_path, sinex)
+def sinex_span(sinex):
+    """
+    first and last day of the solution in the SINEX header (%=SNX line)
+    """
+    with snxParse.open_sinex(sinex) as f:
+        header = f.readline().split()
 
+    epochs = [[int(e) for e in epoch.split(':')] for epoch in header[5:7]]
+    start, end = [pyDate.Date(year=int(get_norm_year_str(yy)), doy=doy) for yy, doy, _ in epochs]
 
-def add_domes(sinex, stations):
+    # a solution that ends at 00:00:00 does not include the last day
+    if epochs[1][2] == 0 and start < end:
+        end = end - 1
 
-    for stn in stations:
-        if stn['dome'] is not None:
-            # " BATF  A ---------"
-            os.system("sed -i 's/ %s  A ---------/ %s  A %s/g' %s"
-                      % (stn['StationCode'].upper(),
-                         stn['StationCode'].upper(), stn['dome'], sinex))
+    return start, end
 
 
 def process_sinex(cnn, project, dates, sinex):
-
-    # parse the SINEX to get the station list
-    snx = snxParse.snxFileParser(sinex)
-    snx.parse()
-
-    stnlist = ('\'' + '\',\''.join(snx.stationDict.keys()) + '\'').lower()
-
-    # insert the statistical data
-
-    zg = cnn.query_float('SELECT count("Year")*2 as ss FROM gamit_soln '
-                         'WHERE "Project" = \'%s\' AND "FYear" BETWEEN %.4f AND %.4f AND "StationCode" IN (%s) '
-                         'GROUP BY "Year", "DOY"'
-                         % (project, dates[0].first_epoch('fyear'), dates[1].last_epoch('fyear'), stnlist))
-
-    zg = sum(s[0] for s in zg)
-
-    zd = cnn.query_float('SELECT count("ZTD") + %i as implicit FROM gamit_ztd '
-                         'WHERE "Date" BETWEEN \'%s\' AND \'%s\' '
-                         % (zg, dates[0].first_epoch(), dates[1].last_epoch()))
-
-    zd = zd[0][0]
-
-    print(' >> Adding NUMBER OF UNKNOWNS: %i (previous value: %i)' % (zd, snx.unknowns))
-
-    replace_in_sinex(sinex, snx.observations, snx.unknowns, snx.unknowns + zg + zd)
-
-    rs = cnn.query('SELECT "NetworkCode", "StationCode", dome FROM stations '
-                   'WHERE "StationCode" IN (%s) '
-                   'ORDER BY "NetworkCode", "StationCode"'
-                   % stnlist)
-
-    stations = rs.dictresult()
-
-    print(' >> Adding DOMES')
-    # add domes
-    add_domes(sinex, stations)
+    """
+    add the missing unknowns and the DOMES numbers to a list of SINEX files
+    :param dates: date range used for all the files or None to use the span of each file (see sinex_span)
+    """
+    snxParse.update_sinex(cnn, project, [(snx, dates if dates else sinex_span(snx)) for snx in sinex],
+                          SINEX_STATISTICS)
 
 
 def main():
@@ -99,12 +58,17 @@ def main():
     parser.add_argument('project', type=str, nargs=1, metavar='{project name}',
                         help="Specify the project name used to process the GAMIT solutions in Parallel.GAMIT.")
 
-    parser.add_argument('sinex', type=str, nargs=1, metavar='{project name}',
-                        help="SINEX file to update.")
+    parser.add_argument('sinex', type=str, nargs='+', metavar='{sinex file}',
+                        help="SINEX file(s) to update. Several files (e.g. a week or a year of daily solutions) are "
+                             "processed in parallel.")
 
     parser.add_argument('-d', '--date_filter', nargs='+', metavar='date',
                         help='Date range filter can be specified in yyyy/mm/dd yyyy_doy  wwww-d format')
 
+    parser.add_argument('-hd', '--header_dates', action='store_true',
+                        help='Use the span of the solution in the header of each SINEX file as the date range '
+                             '(ignores --date_filter).')
+
     add_version_argument(parser)
 
     args = parser.parse_args()
@@ -119,10 +83,10 @@ def main():
     except ValueError as e:
         parser.error(str(e))
 
-    sinex   = args.sinex[0]
+    sinex   = args.sinex
     project = args.project[0]
 
-    process_sinex(cnn, project, dates, sinex)
+    process_sinex(cnn, project, None if args.header_dates else dates, sinex)
 
     # generate REP file
 
@@ -131,9 +131,14 @@ def import_harpos(filename):
     if header:
         pattern = re.compile('S\s+\w+.\w+\s+[-]?\d+.\d+\s+[-]?\d+.\d+\s+[-]?\d+.\d+\s+[-]?\d+.\d+\s+[-]?\d+.\d+\s+[-]?\d+.\d+')
 
+        records = []
         for line in otl:
             if pattern.match(line):
-                load_harpos(header, otl[otl.index(line) - 2:otl.index(line)+13])
+                records.append(load_harpos(header, otl[otl.index(line) - 2:otl.index(line)+13]))
+
+        # DDG: update all the stations with a single statement
+        cnn = dbConnection.Cnn("gnss_data.cfg")
+        cnn.update_many('stations', records, ('NetworkCode', 'StationCode'))
 
     else:
         print(' >> Could not find a valid header')
@@ -151,8 +156,12 @@ def process_blq(filename):
 
         for stn in blq_otl:
             print(' >> Updating OTL for %s.%s' % (stn['NetworkCode'], stn['StationCode']))
-            cnn.update('stations', {'Harpos_coeff_otl': stn['otl']},
-                       NetworkCode=stn['NetworkCode'], StationCode=stn['StationCode'])
+
+        # DDG: update all the stations with a single statement
+        cnn.update_many('stations', [{'NetworkCode'     : stn['NetworkCode'],
+                                      'StationCode'     : stn['StationCode'],
+                                      'Harpos_coeff_otl': stn['otl']} for stn in blq_otl],
+                        ('NetworkCode', 'StationCode'))
 
     except Utils.UtilsException as e:
         print(str(e))
@@ -160,8 +169,6 @@ def process_blq(filename):
 
 def load_harpos(header, otl):
 
-    cnn = dbConnection.Cnn("gnss_data.cfg")
-
     # begin removing the network code from the OTL
     NetStn = re.findall('S\s+(\w+.\w+)\s+', ''.join(otl))
 
@@ -170,8 +177,8 @@ def load_harpos(header, otl):
     OTL = (''.join(header) + ''.join(otl)).replace(NetStn[0], StationCode + '    ') + 'HARPOS Format version of 2002.12.12'
 
     print(' >> updating %s.%s' % (NetworkCode, StationCode))
-    cnn.query('UPDATE stations SET "Harpos_coeff_otl" = \'%s\' WHERE "NetworkCode" = \'%s\' AND '
-              '"StationCode" = \'%s\'' % (OTL, NetworkCode, StationCode))
+
+    return {'NetworkCode': NetworkCode, 'StationCode': StationCode, 'Harpos_coeff_otl': OTL}
 
 
 if __name__ == '__main__':
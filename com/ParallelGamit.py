@@ -14,6 +14,7 @@ import glob
 import logging
 import time
 import threading
+import queue
 from datetime import datetime
 import random
 import string
@@ -44,6 +45,13 @@ from pgamit.Utils import (process_date,
                           stationID,
                           add_version_argument)
 
+# number of threads preparing (Network + GamitSession.initialize) the dates ahead of the GAMIT execution
+PREPARE_WORKERS = 4
+# number of prepared dates that can wait in the queue to be submitted
+PREPARE_QUEUE   = 8
+# number of sessions that can overtake a session in the job queue (largest sessions are submitted first)
+REORDER_WINDOW  = 20
+
 
 def prYellow(skk):
     if os.fstat(0) == os.fstat(1):
@@ -66,6 +74,139 @@ def prGreen(skk):
         return skk
 
 
+class SessionCost(object):
+    """
+    Expected run time of a GAMIT session, used by the JobServer to execute the largest sessions first. If the subnet
+    of the project has been processed before (gamit_stats), the average run time of the subnet is used. Otherwise,
+    the cost is estimated from the number of stations, systems and the size of the RINEX files, converted to run time
+    using the ratio observed in the sessions that do have a history.
+    """
+
+    def __init__(self, cnn):
+        self.cnn      = cnn
+        self.runtimes = {}
+        self.ratios   = []
+
+    def history(self, project):
+        if project not in self.runtimes:
+            # the run time of a session is the sum of the run times of its systems
+            rs = self.cnn.query_float('SELECT subnet, avg(runtime) AS runtime FROM '
+                                      '(SELECT subnet, sum(execution_time) AS runtime FROM gamit_stats '
+                                      'WHERE "Project" = \'%s\' GROUP BY subnet, "Year", "DOY") AS s '
+                                      'GROUP BY subnet' % project, as_dict=True)
+
+            self.runtimes[project] = {int(r['subnet']): float(r['runtime']) for r in rs if r['runtime'] is not None}
+
+        return self.runtimes[project]
+
+    @staticmethod
+    def size(GamitSession):
+        rinex    = GamitSession.params['rinex']
+        rinex_mb = sum(os.path.getsize(r['source']) for r in rinex if os.path.isfile(r['source'])) / 1e6
+
+        return len(GamitSession.GamitOpts['systems']) * (len(rinex) + rinex_mb)
+
+    def __call__(self, GamitSession):
+        size    = self.size(GamitSession)
+        runtime = self.history(GamitSession.NetName).get(GamitSession.subnet if GamitSession.subnet else 0)
+
+        if runtime is not None:
+            if size > 0:
+                self.ratios.append(runtime / size)
+            return runtime
+        else:
+            return size * (sorted(self.ratios)[len(self.ratios) // 2] if self.ratios else 1.)
+
+
+class SessionPipeline(object):
+    """
+    Producer side of ExecuteGamit: builds the Network of each date and initializes its GAMIT sessions in a pool of
+    background threads. Prepared dates go into a bounded queue that is consumed by iterating over the object, so that
+    GAMIT starts running on the first date while the next ones are still being prepared. When the queue is full the
+    workers block, so the preparation never gets too far ahead of the execution. Each worker has its own database
+    connection
+    """
+    def __init__(self, GamitConfig, stations, check_stations, ignore_missing, dates,
+                 workers=PREPARE_WORKERS, queue_size=PREPARE_QUEUE):
+
+        self.GamitConfig    = GamitConfig
+        self.stations       = stations
+        self.check_stations = check_stations
+        self.ignore_missing = ignore_missing
+
+        self.dates    = queue.Queue()
+        self.prepared = queue.Queue(maxsize=queue_size)
+
+        for date in dates:
+            self.dates.put(date)
+
+        # in check mode Network adds the check stations to the StationCollection, use a single worker
+        self.workers = 1 if len(check_stations) else max(1, min(workers, len(dates)))
+
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        cnn = None
+        try:
+            cnn     = dbConnection.Cnn('gnss_data.cfg')
+            archive = pyArchiveStruct.RinexStruct(cnn)
+
+            while True:
+                try:
+                    date = self.dates.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.prepared.put((date, self.prepare(cnn, archive, date), None))
+
+        except Exception as e:
+            # pass the exception to the consumer
+            self.prepared.put((None, None, e))
+        finally:
+            if cnn is not None:
+                cnn.close()
+            # tell the consumer this worker is done
+            self.prepared.put(None)
+
+    def prepare(self, cnn, archive, date):
+
+        # make the dir for these sessions
+        # this avoids a racing condition when starting each process
+        pwd = self.GamitConfig.gamitopt['solutions_dir'].rstrip('/') + '/' + date.yyyy() + '/' + date.ddd()
+
+        os.makedirs(pwd, exist_ok=True)
+
+        net_object = Network(cnn, archive, self.GamitConfig, self.stations, date, self.check_stations,
+                             self.ignore_missing)
+
+        # Network outputs the sessions to be processed
+        # initialize them if they are not ready
+        tqdm.write(' -- %s %i GAMIT sessions to submit (%i already processed)'
+                   % (print_datetime(),
+                      len([sess for sess in net_object.sessions if not sess.ready]),
+                      len([sess for sess in net_object.sessions if     sess.ready])))
+
+        for GamitSession in net_object.sessions:
+            if not GamitSession.ready:
+                GamitSession.initialize()
+
+        return net_object.sessions
+
+    def __iter__(self):
+        # yield (date, sessions) as they become ready
+        finished = 0
+        while finished < self.workers:
+            item = self.prepared.get()
+
+            if item is None:
+                finished += 1
+            elif item[2] is not None:
+                raise item[2]
+            else:
+                yield item[0], item[1]
+
+
 class DbAlive(object):
     def __init__(self, cnn, increment):
         self.next_t    = time.time()
@@ -415,6 +556,13 @@ def main():
     else:
         check_stations = StationCollection()
 
+    # evaluate the APRs of every station for the whole processing range in one go
+    print(' >> Computing APRs for the processing dates, please wait...')
+    for collection in (stations, check_stations):
+        collection.precompute_apr(dates,
+                                  float(GamitConfig.gamitopt['sigma_floor_h']),
+                                  float(GamitConfig.gamitopt['sigma_floor_v']))
+
     dry_run = False if args.dry_run is None else args.dry_run
 
     if not dry_run and not len(check_stations):
@@ -723,68 +871,65 @@ def ExecuteGamit(cnn, JobServer, GamitConfig, stations, check_stations, ignore_m
     tqdm.write(' >> %s Creating GAMIT session instances and executing GAMIT, please wait...' % print_datetime())
 
     sessions = []
-    archive = pyArchiveStruct.RinexStruct(cnn)  # type: pyArchiveStruct.RinexStruct
-
-    for date in tqdm(dates, ncols=80, disable=None):
-
-        # make the dir for these sessions
-        # this avoids a racing condition when starting each process
-        pwd = GamitConfig.gamitopt['solutions_dir'].rstrip('/') + '/' + date.yyyy() + '/' + date.ddd()
-
-        if not os.path.exists(pwd):
-            os.makedirs(pwd)
-
-        net_object = Network(cnn, archive, GamitConfig, stations, date, check_stations, ignore_missing)
-
-        sessions += net_object.sessions
-
-        # Network outputs the sessions to be processed
-        # submit them if they are not ready
-        tqdm.write(' -- %s %i GAMIT sessions to submit (%i already processed)'
-                   % (print_datetime(),
-                      len([sess for sess in net_object.sessions if not sess.ready]),
-                      len([sess for sess in net_object.sessions if     sess.ready])))
 
-    pbar = tqdm(total=len(sessions), disable=None, desc=' >> GAMIT sessions completion', ncols=100)
+    # the total is updated as the dates are prepared
+    pbar = tqdm(total=0, disable=None, desc=' >> GAMIT sessions completion', ncols=100)
     # create the cluster for the run
-    JobServer.create_cluster(run_gamit_session, (pyGamitTask.GamitTask,), gamit_callback, pbar, modules=modules)
-
-    for GamitSession in sessions:
-        if not GamitSession.ready:
-            # do not submit the task if the session is ready!
-            # tqdm.write(' >> %s Init' % (datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            GamitSession.initialize()
-            # tqdm.write(' >> %s Done Init' % (datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            task = pyGamitTask.GamitTask(GamitSession.remote_pwd, GamitSession.params, GamitSession.solution_pwd)
-            # tqdm.write(' >> %s Done task' % (datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            JobServer.submit(task, task.params['DirName'], task.date.year, task.date.doy, dry_run)
-
-            msg = 'Submitting for processing'
-        else:
-            msg = 'Session already processed'
-            pbar.update()
-
-        tqdm.write(' -- %s %s %s %s%03i -> %s' % (print_datetime(),
-                                                  GamitSession.NetName,
-                                                  GamitSession.date.yyyyddd(),
-                                                  GamitSession.org,
-                                                  GamitSession.subnet if GamitSession.subnet is not None else 0, 
-                                                  msg))
+    JobServer.create_cluster(run_gamit_session, (pyGamitTask.GamitTask,), gamit_callback, pbar, modules=modules,
+                             reorder_window=REORDER_WINDOW)
 
-    if create_kml:
-        # generate a KML of the sessions
-        generate_kml(dates, sessions, GamitConfig)
-
-    tqdm.write(' -- %s Done initializing and submitting GAMIT sessions' % print_datetime())
+    session_cost = SessionCost(cnn)
 
     # DDG: because of problems with keeping the database connection open (in some platforms), we invoke a class
     # that just performs a select on the database
     timer = DbAlive(cnn, 120)
-    JobServer.wait()
-    pbar.close()
-    timer.stop()
 
-    JobServer.close_cluster()
+    try:
+        # sessions are prepared in the background and submitted as soon as there are free CPUs in the cluster
+        for date, date_sessions in SessionPipeline(GamitConfig, stations, check_stations, ignore_missing, dates):
+
+            sessions += date_sessions
+            pbar.total += len(date_sessions)
+            pbar.refresh()
+
+            for GamitSession in date_sessions:
+                if not GamitSession.ready:
+                    # do not submit the task if the session is ready!
+                    # back-pressure: keep one job per CPU in the cluster plus the reorder window in the cost queue
+                    JobServer.wait_free_cpus(overcommit=REORDER_WINDOW)
+
+                    task = pyGamitTask.GamitTask(GamitSession.remote_pwd, GamitSession.params,
+                                                 GamitSession.solution_pwd)
+                    # sessions of the same day share orbits, tables and products: send them to the same nodes when
+                    # possible
+                    JobServer.submit(task, task.params['DirName'], task.date.year, task.date.doy, dry_run,
+                                     affinity=task.date, cost=session_cost(GamitSession))
+
+                    msg = 'Submitting for processing'
+                else:
+                    msg = 'Session already processed'
+                    pbar.update()
+
+                tqdm.write(' -- %s %s %s %s%03i -> %s' % (print_datetime(),
+                                                          GamitSession.NetName,
+                                                          GamitSession.date.yyyyddd(),
+                                                          GamitSession.org,
+                                                          GamitSession.subnet
+                                                          if GamitSession.subnet is not None else 0,
+                                                          msg))
+
+        if create_kml:
+            # generate a KML of the sessions
+            generate_kml(dates, sessions, GamitConfig)
+
+        tqdm.write(' -- %s Done initializing and submitting GAMIT sessions' % print_datetime())
+
+        JobServer.wait()
+    finally:
+        # do not leave the keep alive timer, the progress bar and the cluster behind if the preparation fails
+        pbar.close()
+        timer.stop()
+        JobServer.close_cluster()
 
     return sessions
 
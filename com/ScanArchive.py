@@ -56,6 +56,19 @@ error_message = False
 
 ERRORS_LOG = 'errors_pyScanArchive.log'
 
+# DDG: maximum number of RINEX files (of the same day) sent to a node in each PPP job and number of PPP instances that
+# each job runs at the same time
+PPP_BATCH_SIZE    = 50
+PPP_BATCH_THREADS = 2
+# number of stations per OTL job (grdtab runs in a single production folder for the whole chunk)
+OTL_CHUNK_SIZE    = 100
+
+# modules needed by the functions of the persistent pool (scan_rinex, process_otl and process_ppp)
+POOL_MODULES = ('pgamit.dbConnection', 'pgamit.pyDate', 'pgamit.pyRinex', 'pgamit.pyArchiveStruct', 'pgamit.pyOTL',
+                'pgamit.pyPPP', 'pgamit.pyStationInfo', 'pgamit.pyProducts', 'pgamit.pyOptions', 'pgamit.pyEvents',
+                'pgamit.Utils', 'pgamit.pyRinexName', 'pgamit.pyJobServer', 'numpy', 'shutil', 'platform', 'datetime',
+                'traceback', 'os')
+
 
 class Encoder(json.JSONEncoder):
     def default(self, o):
@@ -78,20 +91,24 @@ class callback_class():
         self.pbar.update(1)
 
 
-def callback_handle(job):
+def log_unhandled_error(msg):
     global error_message
 
-    if job.result is not None or job.exception:
-        error_message = True
-        msg           = job.result if job.result else job.exception
+    error_message = True
 
-        tqdm.write(' -- There were unhandled errors during this batch. '
-                   'Please check %s for details' % ERRORS_LOG)
-        file_append(ERRORS_LOG,
-                    'ON ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + 
-                    ' an unhandled error occurred:\n' +
-                    msg + '\n' + 
-                    'END OF ERROR =================== \n\n')
+    tqdm.write(' -- There were unhandled errors during this batch. '
+               'Please check %s for details' % ERRORS_LOG)
+    file_append(ERRORS_LOG,
+                'ON ' + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + 
+                ' an unhandled error occurred:\n' +
+                msg + '\n' + 
+                'END OF ERROR =================== \n\n')
+
+
+def callback_handle(job):
+
+    if job.result is not None or job.exception:
+        log_unhandled_error(job.result if job.result else job.exception)
 
 
 def verify_rinex_date_multiday(cnn, date, rinexinfo, Config):
@@ -158,9 +175,9 @@ def verify_rinex_date_multiday(cnn, date, rinexinfo, Config):
 def try_insert(NetworkCode, StationCode, year, doy, rinex):
 
     try:
-        # try to open a connection to the database
-        cnn    = dbConnection.Cnn("gnss_data.cfg")
-        Config = pyOptions.ReadOptions("gnss_data.cfg")
+        # connection to the database and configuration kept by the worker between jobs
+        cnn    = pyJobServer.worker_cnn()
+        Config = pyJobServer.worker_config()
 
         # get the rejection directory ready
         data_reject = os.path.join(Config.repository_data_reject, 'bad_rinex/%i/%03i' % (year, doy))
@@ -263,7 +280,7 @@ def try_insert(NetworkCode, StationCode, year, doy, rinex):
                                         % (rinex, NetworkCode, StationCode, str(year), str(doy), platform.node())
 
 
-def obtain_otl(NetworkCode, StationCode):
+def obtain_coordinate(NetworkCode, StationCode):
 
     errors = ''
     x = []
@@ -273,8 +290,8 @@ def obtain_otl(NetworkCode, StationCode):
     stn_id = "%s.%s" % (NetworkCode, StationCode)
 
     try:
-        cnn    = dbConnection.Cnn("gnss_data.cfg")
-        Config = pyOptions.ReadOptions("gnss_data.cfg")
+        cnn    = pyJobServer.worker_cnn()
+        Config = pyJobServer.worker_config()
 
         pyArchive = pyArchiveStruct.RinexStruct(cnn)
 
@@ -375,24 +392,21 @@ def obtain_otl(NetworkCode, StationCode):
 
             lat, lon, h = ecef2lla([x,y,z])
 
-            # calculate the otl parameters if the auto_coord returned a valid position
+            # DDG: the otl parameters are calculated by obtain_otl (in chunks of stations) once the coordinates of
+            # all the stations are available
             errors = errors + 'Mean -> %s: %.3f %.3f %.3f\n' % (stn_id, x, y, z)
 
-            otl   = pyOTL.OceanLoading(StationCode, 
-                                       Config.options['grdtab'], 
-                                       Config.options['otlgrid'])
-            coeff = otl.calculate_otl_coeff(x=x, y=y, z=z)
-
             # update record in the database
             cnn.query('UPDATE stations SET "auto_x" = %.3f, "auto_y" = %.3f, "auto_z" = %.3f, '
-                      '"lat" = %.8f, "lon" = %.8f, "height" = %.3f, '
-                      '"Harpos_coeff_otl" = \'%s\' '
+                      '"lat" = %.8f, "lon" = %.8f, "height" = %.3f '
                       'WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\''
-                      % (x, y, z, 
-                         lat[0], lon[0], h[0], 
-                         coeff, 
+                      % (x, y, z,
+                         lat[0], lon[0], h[0],
                          NetworkCode, StationCode))
 
+            # the station moved (or got its first coordinate): rebuild the index of the spatial checks
+            pyPPP.StationIndex.invalidate()
+
         else:
             outmsg = 'Could not obtain a coordinate/otl coefficients for ' + NetworkCode + ' ' + StationCode + \
                      ' after 20 tries. Maybe there where few valid RINEX files or could not find an ephemeris file. ' \
@@ -400,20 +414,48 @@ def obtain_otl(NetworkCode, StationCode):
 
             return outmsg
 
-    except pyOTL.pyOTLException as e:
-
-        return "Error while calculating OTL for %s: %s\n" % (stn_id, str(e)) + \
-               'Debug info and errors follow: \n' + errors
-
     except:
         # print 'problem!' + traceback.format_exc()
-        outmsg = traceback.format_exc() + ' processing otl: %s using node %s\n' \
+        outmsg = traceback.format_exc() + ' processing coordinate: %s using node %s\n' \
                                           % (stn_id, platform.node()) \
                                           + 'Debug info and errors follow: \n' + errors
 
         return outmsg
 
 
+def obtain_otl(stations):
+    # calculate the OTL coefficients of a chunk of stations. The coefficients are returned to the parent process,
+    # which saves the coefficients of all the stations with a single statement
+    try:
+        Config = pyJobServer.worker_config()
+
+        coefficients, errors = pyOTL.calculate_otl_coeffs(stations,
+                                                          Config.options['grdtab'],
+                                                          Config.options['otlgrid'])
+
+        return {'otl': coefficients, 'errors': errors}
+
+    except:
+        return traceback.format_exc() + ' processing otl of %i stations using node %s' \
+                                        % (len(stations), platform.node())
+
+
+def fingerprint_rinex(NetworkCode, StationCode, Filename, rinex):
+    # fill the fingerprint of a file archived before the Fingerprint column existed
+    try:
+        cnn = pyJobServer.worker_cnn()
+
+        fingerprint = pyRinex.fingerprint(rinex)
+
+        if fingerprint:
+            cnn.update('rinex', {'Fingerprint': fingerprint},
+                       NetworkCode=NetworkCode, StationCode=StationCode, Filename=Filename)
+
+    except:
+        return traceback.format_exc() + ' fingerprinting rinex: %s (%s.%s) using node %s' \
+                                        % (rinex, NetworkCode, StationCode, platform.node())
+
+
 def insert_stninfo(NetworkCode, StationCode, stninfofile):
 
     errors = []
@@ -477,130 +519,210 @@ def remove_from_archive(cnn, record, Rinex, Config):
     cnn.insert_event(event)
 
 
-def execute_ppp(record, rinex_path, h_tolerance):
+def ppp_exception_event(cnn, e, record):
+    e.event['StationCode'] = record['StationCode']
+    e.event['NetworkCode'] = record['NetworkCode']
+    e.event['Year']        = int(record['ObservationYear'])
+    e.event['DOY']         = int(record['ObservationDOY'])
+
+    cnn.insert_event(e.event)
+
 
+def prepare_ppp(cnn, Config, record, rinex_path, stn, stninfo_records, h_tolerance):
+    """
+    read the RINEX file and set up its PPP run. Uses the database connection: not to be called from several threads.
+    Returns (Rinex, RunPPP) or None if the file was removed from the archive
+    """
     NetworkCode = record['NetworkCode']
     StationCode = record['StationCode']
-    year        = record['ObservationYear']
-    doy         = record['ObservationDOY']
 
+    # RINEX FILE TO BE PROCESSED
+    Rinex = pyRinex.ReadRinex(NetworkCode, StationCode, rinex_path)
     try:
-        # try to open a connection to the database
-        cnn = dbConnection.Cnn("gnss_data.cfg")
+        if not verify_rinex_date_multiday(cnn, Rinex.date, Rinex, Config):
+            # the file is a multiday file. These files are not supposed to be in the archive, but, due to a bug
+            # in ScanArchive (now fixed - 2017-10-26) some multiday files are still in the rinex table
+            # the file is moved out of the archive (into the retry folder and the rinex record is deleted
+            event = pyEvents.Event(EventType   = 'warn',
+                                   Description = 'RINEX record in database belonged to a multiday file. '
+                                                 'The record has been removed from the database. '
+                                                 'See previous associated event.',
+                                   StationCode = StationCode,
+                                   NetworkCode = NetworkCode,
+                                   Year        = int(Rinex.date.year),
+                                   DOY         = int(Rinex.date.doy))
+            cnn.insert_event(event)
+
+            cnn.begin_transac()
+            where_obs = ('"NetworkCode" = \'%s\' AND "StationCode" = \'%s\' ' \
+                         'AND "Year" = %i AND "DOY" = %i' % (record['NetworkCode'],
+                                                             record['StationCode'],
+                                                             record['ObservationYear'],
+                                                             record['ObservationDOY']))
+            cnn.query('DELETE FROM gamit_soln WHERE %s' % where_obs)
+            cnn.query('DELETE FROM ppp_soln WHERE %s'   % where_obs)
+            cnn.query('DELETE FROM rinex WHERE %s AND "Filename" = \'%s\'' % (where_obs, record['Filename']))
+            cnn.commit_transac()
+
+            Rinex.cleanup()
+            return None
+
+        stninfo = pyStationInfo.StationInfo(cnn, NetworkCode, StationCode, Rinex.date, h_tolerance=h_tolerance,
+                                            records=stninfo_records)
+
+        Rinex.normalize_header(stninfo,
+                               x = stn['auto_x'],
+                               y = stn['auto_y'],
+                               z = stn['auto_z'])
+
+        # DDG: no more sp3altrn
+        ppp = pyPPP.RunPPP(Rinex,
+                           stn['Harpos_coeff_otl'],
+                           Config.options,
+                           Config.sp3types, (),
+                           stninfo.to_dharp(stninfo.currentrecord).AntennaHeight,
+                           hash = stninfo.currentrecord.hash)
+    except:
+        Rinex.cleanup()
+        raise
 
-        Config = pyOptions.ReadOptions("gnss_data.cfg")
+    return Rinex, ppp
 
-    except:
-        return traceback.format_exc() + ' processing rinex: %s %s %s using node %s' \
-                   % (stationID(record), str(year), str(doy), platform.node())
 
-    # create a temp folder in production to put the orbit in
-    # we need to check the RF of the orbit to see if we have this solution in the DB
+def execute_ppp_batch(batch, h_tolerance, threads):
+    """
+    run PPP on a batch of RINEX files of the same day: batch is a list of (rinex record, rinex path). The ppp_soln,
+    stations and stationinfo records are loaded with one query each, the PPP instances run in a local pool of threads
+    (sharing the products of the day, see pyPPP.PPPWorkspace) and the solutions are inserted in a single statement
+    """
+    # imported here: the function is sent to the nodes without the globals of this script
+    from concurrent.futures import ThreadPoolExecutor
+
+    year = batch[0][0]['ObservationYear']
+    doy  = batch[0][0]['ObservationDOY']
+
     try:
+        # connection to the database and configuration kept by the worker between jobs
+        cnn    = pyJobServer.worker_cnn()
+        Config = pyJobServer.worker_config()
+
+    except:
+        return traceback.format_exc() + ' processing rinex batch: %s %s using node %s' \
+                   % (str(year), str(doy), platform.node())
 
-        # check to see if record exists for this file in ppp_soln
+    errors = []
+
+    def error(record):
+        errors.append(traceback.format_exc() + ' processing rinex: %s %s %s using node %s'
+                      % (Utils.stationID(record), str(year), str(doy), platform.node()))
+
+    # DDG: events are inserted in a single statement when the batch is done
+    cnn.buffer_events()
+    try:
         # DDG: now read the frame from the config file
         frame, _ = Utils.determine_frame(Config.options['frames'], pyDate.Date(year=year, doy=doy))
 
-        ppp_soln = cnn.query('SELECT * FROM ppp_soln WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\' AND '
-                             '"Year" = %s AND "DOY" = %s AND "ReferenceFrame" = \'%s\''
-                             % (NetworkCode, StationCode, year, doy, frame))
-
-        if ppp_soln.ntuples() == 0:
-
-            # load the stations record to get the OTL params
-            rs_stn = cnn.query('SELECT * FROM stations WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\''
-                               % (NetworkCode, StationCode))
-            stn = rs_stn.dictresult()
-
-            # RINEX FILE TO BE PROCESSED
-            with pyRinex.ReadRinex(NetworkCode, StationCode, rinex_path) as Rinex:
-
-                if not verify_rinex_date_multiday(cnn, Rinex.date, Rinex, Config):
-                    # the file is a multiday file. These files are not supposed to be in the archive, but, due to a bug
-                    # in ScanArchive (now fixed - 2017-10-26) some multiday files are still in the rinex table
-                    # the file is moved out of the archive (into the retry folder and the rinex record is deleted
-                    event = pyEvents.Event(EventType   = 'warn',
-                                           Description = 'RINEX record in database belonged to a multiday file. '
-                                                         'The record has been removed from the database. '
-                                                         'See previous associated event.',
-                                           StationCode = StationCode,
-                                           NetworkCode = NetworkCode,
-                                           Year        = int(Rinex.date.year),
-                                           DOY         = int(Rinex.date.doy))
-                    cnn.insert_event(event)
-
-                    cnn.begin_transac()
-                    where_obs = ('"NetworkCode" = \'%s\' AND "StationCode" = \'%s\' ' \
-                                 'AND "Year" = %i AND "DOY" = %i' % (record['NetworkCode'],
-                                                                     record['StationCode'], 
-                                                                     record['ObservationYear'],
-                                                                     record['ObservationDOY']))
-                    cnn.query('DELETE FROM gamit_soln WHERE %s' % where_obs)
-                    cnn.query('DELETE FROM ppp_soln WHERE %s'   % where_obs)
-                    cnn.query('DELETE FROM rinex WHERE %s AND "Filename" = \'%s\'' % (where_obs, record['Filename']))
-                    cnn.commit_transac()
-                    cnn.close()
-                    return
-
-                stninfo = pyStationInfo.StationInfo(cnn, NetworkCode, StationCode, Rinex.date, h_tolerance=h_tolerance)
-
-                Rinex.normalize_header(stninfo, 
-                                       x = stn[0]['auto_x'], 
-                                       y = stn[0]['auto_y'], 
-                                       z = stn[0]['auto_z'])
-
-                # DDG: no more sp3altrn
-                with pyPPP.RunPPP(Rinex,
-                                  stn[0]['Harpos_coeff_otl'],
-                                  Config.options,
-                                  Config.sp3types, (),
-                                  stninfo.to_dharp(stninfo.currentrecord).AntennaHeight,
-                                  hash = stninfo.currentrecord.hash) as ppp:
-                    ppp.exec_ppp()
-
-                    # verify that the solution is from the station it claims to be
-                    Result, match, _ = ppp.verify_spatial_coherence(cnn, StationCode)
-
-                    if Result and (match[0]['NetworkCode'] == NetworkCode and
-                                   match[0]['StationCode'] == StationCode):
-                        # the match agrees with the station-day that we THINK we are processing
-                        # this check should not be necessary if the rinex went through Archive Service, since we
-                        # already match rinex vs station
-                        # but it's still here to prevent that a rinex imported by ScanArchive (which assumes the
-                        # rinex files belong to the network/station of the folder) doesn't get into the PPP table
-                        # if it's not of the station it claims to be.
-
-                        # insert record in DB
-                        cnn.insert('ppp_soln', **ppp.record)
-                        # DDG: Eric's request to generate a date of PPP solution
-                        event = pyEvents.Event(Description = 'A new PPP solution was created for frame ' + ppp.frame,
-                                               NetworkCode = NetworkCode,
-                                               StationCode = StationCode,
-                                               Year        = int(year),
-                                               DOY         = int(doy))
-                        cnn.insert_event(event)
-                    else:
-                        remove_from_archive(cnn, record, Rinex, Config)
+        in_list = ', '.join('(\'%s\', \'%s\')' % key
+                            for key in {(record['NetworkCode'], record['StationCode']) for record, _ in batch})
+
+        # stations that already have a solution for this day (e.g. processed by a previous batch)
+        ppp_soln = {(r['NetworkCode'], r['StationCode']) for r in
+                    cnn.query('SELECT "NetworkCode", "StationCode" FROM ppp_soln WHERE "Year" = %s AND "DOY" = %s '
+                              'AND "ReferenceFrame" = \'%s\' AND ("NetworkCode", "StationCode") IN (%s)'
+                              % (year, doy, frame, in_list)).dictresult()}
+
+        # load the stations records to get the OTL params
+        stations = {(r['NetworkCode'], r['StationCode']): r for r in
+                    cnn.query('SELECT * FROM stations WHERE ("NetworkCode", "StationCode") IN (%s)'
+                              % in_list).dictresult()}
+
+        stninfo = {}
+        for r in cnn.query('SELECT * FROM stationinfo WHERE ("NetworkCode", "StationCode") IN (%s) '
+                           'ORDER BY "NetworkCode", "StationCode", "DateStart"' % in_list).dictresult():
+            stninfo.setdefault((r['NetworkCode'], r['StationCode']), []).append(r)
+
+        # set up the runs (uses the database connection)
+        runs = []
+        for record, rinex_path in batch:
+            key = (record['NetworkCode'], record['StationCode'])
+            if key in ppp_soln:
+                continue
+            try:
+                run = prepare_ppp(cnn, Config, record, rinex_path, stations.get(key), stninfo.get(key, []),
+                                  h_tolerance)
+                if run is not None:
+                    runs.append((record,) + run)
+
+            except (pyRinex.pyRinexException,
+                    pyRinex.pyRinexExceptionBadFile,
+                    pyRinex.pyRinexExceptionSingleEpoch,
+                    pyPPP.pyRunPPPException,
+                    pyStationInfo.pyStationInfoException) as e:
+                ppp_exception_event(cnn, e, record)
+            except:
+                error(record)
 
-    except (pyRinex.pyRinexException,
-            pyRinex.pyRinexExceptionBadFile,
-            pyRinex.pyRinexExceptionSingleEpoch,
-            pyPPP.pyRunPPPException,
-            pyStationInfo.pyStationInfoException) as e:
+        # PPP is an external process: the instances can run from threads
+        with ThreadPoolExecutor(max(1, threads)) as executor:
+            futures = [executor.submit(ppp.exec_ppp) for _, _, ppp in runs]
 
-        e.event['StationCode'] = StationCode
-        e.event['NetworkCode'] = NetworkCode
-        e.event['Year']        = int(year)
-        e.event['DOY']         = int(doy)
+        rows = []
+        for (record, Rinex, ppp), future in zip(runs, futures):
+            try:
+                future.result()
+
+                # verify that the solution is from the station it claims to be
+                Result, match, _ = ppp.verify_spatial_coherence(cnn, record['StationCode'])
+
+                if Result and (match[0]['NetworkCode'] == record['NetworkCode'] and
+                               match[0]['StationCode'] == record['StationCode']):
+                    # the match agrees with the station-day that we THINK we are processing
+                    # this check should not be necessary if the rinex went through Archive Service, since we
+                    # already match rinex vs station
+                    # but it's still here to prevent that a rinex imported by ScanArchive (which assumes the
+                    # rinex files belong to the network/station of the folder) doesn't get into the PPP table
+                    # if it's not of the station it claims to be.
+                    rows.append(ppp.record)
+                    # DDG: Eric's request to generate a date of PPP solution
+                    event = pyEvents.Event(Description = 'A new PPP solution was created for frame ' + ppp.frame,
+                                           NetworkCode = record['NetworkCode'],
+                                           StationCode = record['StationCode'],
+                                           Year        = int(year),
+                                           DOY         = int(doy))
+                    cnn.insert_event(event)
+                else:
+                    remove_from_archive(cnn, record, Rinex, Config)
+
+            except (pyRinex.pyRinexException,
+                    pyRinex.pyRinexExceptionBadFile,
+                    pyRinex.pyRinexExceptionSingleEpoch,
+                    pyPPP.pyRunPPPException,
+                    pyStationInfo.pyStationInfoException) as e:
+                ppp_exception_event(cnn, e, record)
+            except:
+                error(record)
+            finally:
+                ppp.cleanup()
+                Rinex.cleanup()
 
-        cnn.insert_event(e.event)
-        cnn.close()
+        # insert the solutions in the DB
+        try:
+            cnn.insert_many('ppp_soln', rows)
+        except dbConnection.dbErrInsert:
+            # a solution was inserted by another process in the meantime, insert the rest one by one
+            for row in rows:
+                try:
+                    cnn.insert('ppp_soln', **row)
+                except dbConnection.dbErrInsert:
+                    pass
 
     except:
-        cnn.close()
-        return (traceback.format_exc() + ' processing rinex: %s.%s %s %s using node %s' %
-                (NetworkCode, StationCode, str(year), str(doy), platform.node()))
+        errors.append(traceback.format_exc() + ' processing rinex batch: %s %s using node %s'
+                      % (str(year), str(doy), platform.node()))
+    finally:
+        cnn.flush_events()
+
+    return '\n'.join(errors) if errors else None
 
 
 def post_scan_rinex_job(cnn, Archive, rinex_file, rinexpath, master_list, JobServer, ignore):
@@ -641,9 +763,10 @@ def scan_rinex(cnn, JobServer, pyArchive, archive_path, master_list, ignore):
 
     depfuncs = (verify_rinex_date_multiday,)
     modules  = ('pgamit.dbConnection', 'pgamit.pyDate', 'pgamit.pyRinex', 'shutil', 'platform', 'datetime',
-                'traceback', 'pgamit.pyOptions', 'pgamit.pyEvents', 'pgamit.Utils', 'os', 'pgamit.pyRinexName')
+                'traceback', 'pgamit.pyOptions', 'pgamit.pyEvents', 'pgamit.Utils', 'os', 'pgamit.pyRinexName',
+                'pgamit.pyJobServer')
 
-    JobServer.create_cluster(try_insert, dependencies=depfuncs, modules=modules, callback=callback_handle)
+    JobServer.create_cluster(try_insert, depfuncs, modules=modules, callback=callback_handle)
 
     ignore = (ignore[0] == 1)
 
@@ -672,25 +795,43 @@ def scan_rinex(cnn, JobServer, pyArchive, archive_path, master_list, ignore):
     pbar.close()
 
 
-def process_otl(cnn, JobServer, master_list):
+class otl_callback_class:
+    """
+    collects the OTL coefficients returned by the obtain_otl jobs
+    """
+    def __init__(self):
+        self.coefficients = []
+
+    def callbackfunc(self, job):
+        if isinstance(job.result, dict):
+            self.coefficients += job.result['otl']
+
+            for error in job.result['errors']:
+                log_unhandled_error(error)
+        else:
+            callback_handle(job)
+
+
+def process_otl(cnn, JobServer, master_list, chunk_size=OTL_CHUNK_SIZE):
 
     print("")
     print(" >> Calculating coordinates and OTL for new stations...")
 
     master_list = [stationID(item) for item in master_list]
+    in_list     = '\',\''.join(master_list)
 
     records = cnn.query('SELECT "NetworkCode", "StationCode" FROM stations '
-                        'WHERE auto_x is null OR auto_y is null OR auto_z is null OR "Harpos_coeff_otl" is null '
+                        'WHERE (auto_x is null OR auto_y is null OR auto_z is null) '
                         'AND "NetworkCode" not like \'?%\' '
-                        'AND "NetworkCode" || \'.\' || "StationCode" IN (\'' + '\',\''.join(master_list) + '\')').dictresult()
+                        'AND "NetworkCode" || \'.\' || "StationCode" IN (\'' + in_list + '\')').dictresult()
 
     pbar = tqdm(total=len(records), ncols=80, disable=None)
 
     depfuncs = (ecef2lla,)
     modules  = ('pgamit.dbConnection', 'pgamit.pyRinex', 'pgamit.pyArchiveStruct', 'pgamit.pyOTL', 'pgamit.pyPPP',
-                'numpy', 'platform', 'pgamit.pyProducts', 'traceback', 'pgamit.pyOptions')
+                'numpy', 'platform', 'pgamit.pyProducts', 'traceback', 'pgamit.pyOptions', 'pgamit.pyJobServer')
 
-    JobServer.create_cluster(obtain_otl, depfuncs, callback_handle, progress_bar=pbar, modules=modules)
+    JobServer.create_cluster(obtain_coordinate, depfuncs, callback_handle, progress_bar=pbar, modules=modules)
 
     for record in records:
         JobServer.submit(record['NetworkCode'],
@@ -700,6 +841,68 @@ def process_otl(cnn, JobServer, master_list):
 
     pbar.close()
 
+    # DDG: run grdtab in chunks of stations (one production folder and job per chunk) and save the coefficients of all
+    # the stations with a single statement
+    stations = cnn.query('SELECT "NetworkCode", "StationCode", auto_x, auto_y, auto_z FROM stations '
+                         'WHERE "Harpos_coeff_otl" is null AND auto_x is not null '
+                         'AND auto_y is not null AND auto_z is not null '
+                         'AND "NetworkCode" not like \'?%\' '
+                         'AND "NetworkCode" || \'.\' || "StationCode" IN (\'' + in_list + '\')').dictresult()
+
+    chunks = [stations[i:i + chunk_size] for i in range(0, len(stations), chunk_size)]
+
+    pbar     = tqdm(total=len(chunks), ncols=80, disable=None)
+    callback = otl_callback_class()
+
+    JobServer.create_cluster(obtain_otl, callback=callback.callbackfunc, progress_bar=pbar, modules=modules)
+
+    for chunk in chunks:
+        JobServer.submit(chunk)
+
+    JobServer.wait()
+
+    pbar.close()
+
+    updated = len(callback.coefficients)
+    try:
+        cnn.update_many('stations', callback.coefficients, ('NetworkCode', 'StationCode'))
+    except dbConnection.dbErrUpdate:
+        # do not lose the coefficients of the whole phase: save them one by one and log the rows that fail
+        for row in callback.coefficients:
+            try:
+                cnn.update('stations', {'Harpos_coeff_otl': row['Harpos_coeff_otl']},
+                           NetworkCode=row['NetworkCode'], StationCode=row['StationCode'])
+            except dbConnection.dbErrUpdate:
+                updated -= 1
+                log_unhandled_error(traceback.format_exc() + ' saving the OTL coefficients of %s'
+                                    % stationID(row))
+
+    tqdm.write(' -- OTL coefficients updated for %i of %i stations' % (updated, len(stations)))
+
+
+def process_fingerprints(cnn, JobServer, pyArchive, archive_path, master_list):
+
+    print("")
+    print(" >> Computing the fingerprint of the archived RINEX files that do not have one...")
+
+    master_list = [stationID(item) for item in master_list]
+
+    records = cnn.query('SELECT * FROM rinex WHERE "Fingerprint" is null '
+                        'AND "NetworkCode" || \'.\' || "StationCode" IN (\'%s\')'
+                        % '\',\''.join(master_list)).dictresult()
+
+    pbar = tqdm(total=len(records), ncols=80, disable=None)
+
+    JobServer.create_cluster(fingerprint_rinex, callback=callback_handle, progress_bar=pbar, modules=POOL_MODULES)
+
+    for record in records:
+        JobServer.submit(record['NetworkCode'], record['StationCode'], record['Filename'],
+                         os.path.join(archive_path, pyArchive.format_rinex_path(record)))
+
+    JobServer.wait()
+
+    pbar.close()
+
 
 def scan_station_info(JobServer, pyArchive, archive_path, master_list):
 
@@ -867,7 +1070,8 @@ def db_checks(cnn):
         cnn.commit_transac()
 
 
-def process_ppp(cnn, Config, pyArchive, archive_path, JobServer, master_list, sdate, edate, h_tolerance):
+def process_ppp(cnn, Config, pyArchive, archive_path, JobServer, master_list, sdate, edate, h_tolerance,
+                batch_size=PPP_BATCH_SIZE, threads=PPP_BATCH_THREADS):
 
     print(" >> Running PPP on the RINEX files in the archive...")
 
@@ -892,18 +1096,9 @@ def process_ppp(cnn, Config, pyArchive, archive_path, JobServer, master_list, sd
 
     tblrinex = rs_rnx.dictresult()
 
-    pbar = tqdm(total=len(tblrinex), ncols=80, disable=None)
-
-    modules = ('pgamit.dbConnection', 'pgamit.pyRinex', 'pgamit.pyPPP', 'pgamit.pyStationInfo', 'pgamit.pyDate',
-               'pgamit.pyProducts', 'os', 'platform', 'pgamit.pyArchiveStruct', 'traceback', 'pgamit.pyOptions',
-               'pgamit.pyEvents', 'pgamit.Utils')
-
-    depfuncs = (remove_from_archive, verify_rinex_date_multiday)
-
-    JobServer.create_cluster(execute_ppp, depfuncs, callback=callback_handle, progress_bar=pbar, modules=modules)
-
+    # DDG: group the RINEX files by day. Each job processes (at most batch_size) files of the same day
+    days = {}
     for record in tblrinex:
-
         rinex_path = pyArchive.build_rinex_path(record['NetworkCode'],
                                                 record['StationCode'],
                                                 record['ObservationYear'],
@@ -912,7 +1107,27 @@ def process_ppp(cnn, Config, pyArchive, archive_path, JobServer, master_list, sd
         # add the base dir
         rinex_path = os.path.join(archive_path, rinex_path)
 
-        JobServer.submit(record, rinex_path, h_tolerance)
+        days.setdefault((record['ObservationYear'], record['ObservationDOY']), []).append((record, rinex_path))
+
+    batches = [(day, files[i:i + batch_size]) for day, files in days.items()
+               for i in range(0, len(files), batch_size)]
+
+    tqdm.write(' -- %i RINEX files in %i days split into %i batches' % (len(tblrinex), len(days), len(batches)))
+
+    pbar = tqdm(total=len(batches), ncols=80, disable=None)
+
+    modules = ('pgamit.dbConnection', 'pgamit.pyRinex', 'pgamit.pyPPP', 'pgamit.pyStationInfo', 'pgamit.pyDate',
+               'pgamit.pyProducts', 'os', 'platform', 'pgamit.pyArchiveStruct', 'traceback', 'pgamit.pyOptions',
+               'pgamit.pyEvents', 'pgamit.Utils', 'pgamit.pyJobServer')
+
+    depfuncs = (remove_from_archive, verify_rinex_date_multiday, prepare_ppp, ppp_exception_event)
+
+    JobServer.create_cluster(execute_ppp_batch, depfuncs, callback=callback_handle, progress_bar=pbar,
+                             modules=modules)
+
+    for day, batch in batches:
+        # batches of the same day go to the same node (to reuse the products of the day) and the largest go first
+        JobServer.submit(batch, h_tolerance, threads, affinity=day, cost=len(batch))
 
     JobServer.wait()
 
@@ -1182,6 +1397,8 @@ def insert_station(cnn, network, station):
                    height           = station['height'],
                    max_dist         = station['max_dist'] if 'max_dist' in station.keys() else None,
                    dome             = station['dome']     if 'dome'     in station.keys() else None)
+
+        pyPPP.StationIndex.invalidate()
         return True
 
 
@@ -1348,16 +1565,31 @@ def main():
                              "Optionally append [date_start] and (optionally) [date_end] to limit the rehashing time "
                              "window. Allowed formats are yyyy.doy or yyyy/mm/dd.")
 
+    parser.add_argument('-fingerprint', '--fingerprint', action='store_true',
+                        help="Compute the content fingerprint of the RINEX files in the database that do not have one "
+                             "(files archived before the fingerprints were introduced). Incoming files are detected "
+                             "as duplicates of archived files only once these have a fingerprint.")
+
     parser.add_argument('-tol', '--stninfo_tolerant', nargs=1, type=int, metavar='{hours}', default=[0],
                         help="Specify a tolerance (in hours) for station information gaps (only use for early "
                              "survey data). Default is zero.")
 
+    parser.add_argument('-batch', '--ppp_batch', nargs='+', type=int, metavar=('{size}', '{threads}'),
+                        default=[PPP_BATCH_SIZE, PPP_BATCH_THREADS],
+                        help="When running -ppp, send at most {size} RINEX files of the same day to a node in each "
+                             "job (smaller batches balance the load better between nodes). Optionally append the "
+                             "number of PPP instances that each job runs at the same time. Default is %i %i."
+                             % (PPP_BATCH_SIZE, PPP_BATCH_THREADS))
+
     parser.add_argument('-np', '--noparallel', action='store_true', help="Execute command without parallelization.")
 
     add_version_argument(parser)
 
     args = parser.parse_args()
 
+    if len(args.ppp_batch) > 2 or min(args.ppp_batch) < 1:
+        parser.error('-batch requires 1 or 2 positive integers.')
+
     if args.station_info is not None and (not len(args.station_info) in (0, 2)):
         parser.error('-stninfo requires 0 or 2 arguments. {} given.'.format(len(args.station_info)))
 
@@ -1371,6 +1603,8 @@ def main():
     stnlist = Utils.process_stnlist(cnn, args.stnlist)
 
     pyArchive = pyArchiveStruct.RinexStruct(cnn)
+    # make sure the rinex table has the Fingerprint column
+    pyArchive.db_checks()
 
     if args.station_info is None:
         JobServer = pyJobServer.JobServer(Config, run_parallel=not args.noparallel,
@@ -1378,6 +1612,15 @@ def main():
     else:
         JobServer = None
 
+    if JobServer is not None and (args.rinex is not None or args.ocean_loading or args.ppp is not None
+                                  or args.fingerprint):
+        # DDG: a single pool for all the phases: the nodes are initialized (and load the configuration) only once
+        JobServer.create_pool((try_insert, obtain_coordinate, obtain_otl, execute_ppp_batch, fingerprint_rinex),
+                              (verify_rinex_date_multiday, ecef2lla, remove_from_archive, prepare_ppp,
+                               ppp_exception_event),
+                              modules=POOL_MODULES,
+                              warm_up=('config',))
+
     #########################################
 
     if args.rinex is not None:
@@ -1390,6 +1633,11 @@ def main():
 
     #########################################
 
+    if args.fingerprint:
+        process_fingerprints(cnn, JobServer, pyArchive, Config.archive_path, stnlist)
+
+    #########################################
+
     if args.station_info is not None:
         if len(args.station_info) == 0:
             scan_station_info(JobServer, pyArchive, Config.archive_path, stnlist)
@@ -1427,7 +1675,7 @@ def main():
             hash_check(cnn, stnlist, dates[0], dates[1], rehash=False, h_tolerant=args.stninfo_tolerant[0])
 
         process_ppp(cnn, Config, pyArchive, Config.archive_path, JobServer, stnlist, dates[0], dates[1],
-                    args.stninfo_tolerant[0])
+                    args.stninfo_tolerant[0], *args.ppp_batch)
 
     #########################################
 
@@ -1454,6 +1702,7 @@ def main():
     #    rmtree('production')
 
     if JobServer is not None:
+        JobServer.close_pool()
         JobServer.close_cluster()
 
 
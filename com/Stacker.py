@@ -56,7 +56,8 @@ def plot_etm(cnn, stack, station, directory):
 
 def station_etm(station, stn_ts, stack_name, iteration=0):
 
-    cnn = dbConnection.Cnn("gnss_data.cfg")
+    # connection kept by the worker between jobs
+    cnn = pyJobServer.worker_cnn()
 
     vertices = None
 
@@ -110,7 +111,7 @@ def calculate_etms(cnn, stack, JobServer, iterations, create_target=True, exclud
     # so that the progress bar ends in the right number
     qbar = tqdm(total=len(stack.stations)-len(exclude_stn), desc=' >> Calculating ETMs', ncols=160, disable=None)
 
-    modules = ('pgamit.pyETM', 'pgamit.pyDate', 'pgamit.dbConnection', 'traceback')
+    modules = ('pgamit.pyETM', 'pgamit.pyDate', 'pgamit.dbConnection', 'traceback', 'pgamit.pyJobServer')
 
     JobServer.create_cluster(station_etm, progress_bar=qbar, callback=callback_handler, modules=modules)
 
@@ -299,6 +300,12 @@ def main():
     JobServer = pyJobServer.JobServer(Config, check_archive=False, check_executables=False, check_atx=False,
                                       run_parallel=not args.noparallel)  # type: pyJobServer.JobServer
 
+    # DDG: the ETMs are calculated several times (once per iteration and after the alignment): keep the nodes alive
+    # between calls to calculate_etms
+    JobServer.create_pool((station_etm,),
+                          modules=('pgamit.pyETM', 'pgamit.pyDate', 'pgamit.dbConnection', 'traceback'),
+                          warm_up=('config',))
+
     if args.max_iters:
         max_iters = int(args.max_iters[0])
     else:
@@ -426,6 +433,8 @@ def main():
 
         qbar.close()
 
+    JobServer.close_pool()
+
 
 if __name__ == '__main__':
     main()
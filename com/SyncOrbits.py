@@ -23,6 +23,7 @@ from pgamit import pyDate
 from pgamit import pyOptions
 from pgamit.Utils import required_length, process_date, add_version_argument
 from pgamit import pyRunWithRetry
+from pgamit.proto_download import ListingCache
 
 # Old FTP server:
 # FTP_HOST = '198.118.242.40'
@@ -97,13 +98,31 @@ def main():
         ftp.set_pasv(True)
         ftp.prot_p()
 
-        def downloadIfMissing(ftp_list, ftp_filename, local_filename, local_dir, desc):
+        # each remote folder is listed once (weekly product folders are shared by seven days) and the listings are
+        # kept in listings_cache, if configured, for the next runs
+        listings_path = Config.options.get('listings_cache')
+        listings_ttl  = float(Config.options.get('listings_ttl')) * 3600
+        if listings_path:
+            listings_path = os.path.expandvars(listings_path)
+            ListingCache.purge(listings_path, listings_ttl)
+        listings = ListingCache(FTP_HOST, listings_path, listings_ttl)
+
+        def ftp_list_dir(server_path):
+            # same contract as IProtocol.list_dir
+            ftp.cwd(os.path.dirname(server_path))
+            return set(ftp.nlst())
+
+        def list_folder(folder):
+            # folders that do not exist or cannot be listed have nothing to download
+            return listings.listing(ftp_list_dir, folder) or set()
+
+        def downloadIfMissing(ftp_list, ftp_folder, ftp_filename, local_filename, local_dir, desc):
             mark_path = os.path.join(local_dir, local_filename)
             if not os.path.isfile(mark_path) and ftp_filename in ftp_list:
                 tqdm.write('%-31s: %s' % (' -- trying to download ' + desc, ftp_filename))
                 down_path = os.path.join(local_dir, ftp_filename)
                 with open(down_path, 'wb') as f:
-                    ftp.retrbinary("RETR " + ftp_filename, f.write)
+                    ftp.retrbinary("RETR " + ftp_folder + '/' + ftp_filename, f.write)
                 return True
             else:
                 return False
@@ -124,21 +143,9 @@ def main():
             # because the CODE FTP has all files in a single directory, list and then search for all desired elements
             opera_folder = replace_vars(OPERA_FOLDER, date)
             repro_folder = replace_vars(REPRO_FOLDER, date)
-            # do not list again if in the same year
-
-            try:
-                ftp.cwd(opera_folder)
-                opera_list = set(ftp.nlst())
-            except ftplib.error_perm:
-                # no operational dir?
-                opera_list = ()
-
-            try:
-                ftp.cwd(repro_folder)
-                repro_list = set(ftp.nlst())
-            except ftplib.error_perm:
-                # no repro dir
-                repro_list = ()
+            # the listings are cached: not listed again for the other days of the week
+            opera_list = list_folder(opera_folder)
+            repro_list = list_folder(repro_folder)
 
             # first look for the operational product
             for sp3type in Config.sp3types:
@@ -161,24 +168,16 @@ def main():
                 for folder, ftp_list in [(opera_folder, opera_list), (repro_folder, repro_list)]:
                     # try to download SP3 files
                     try:
-                        ftp.cwd(folder)
-
                         for ext, recmp in [('SP3', sp3_filename), ('CLK', clk_filename), ('ERP', eop_filename)]:
                             r = re.compile('(' + recmp + ')')
                             match = list(filter(r.match, ftp_list))
                             for file in match:
-                                downloadIfMissing(ftp_list, file, file, sp3_archive, ext)
+                                downloadIfMissing(ftp_list, folder, file, file, sp3_archive, ext)
                     except ftplib.error_perm:
                         continue
 
             # ##### now the brdc files #########
             folder = "/pub/gps/data/daily/%s/%s/%sn" % (date.yyyy(), date.ddd(), date.yyyy()[2:])
-            tqdm.write(' -- Changing folder to ' + folder)
-            try:
-                ftp.cwd(folder)
-                ftp_list = set(ftp.nlst())
-            except Exception:
-                ftp_list = ()
 
             brdc_archive = replace_vars(Config.brdc_path, date)
 
@@ -186,9 +185,16 @@ def main():
                 os.makedirs(brdc_archive)
             try:
                 filename = 'brdc%s0.%sn' % (str(date.doy).zfill(3), str(date.year)[2:4])
+                # only list the folder if the file is missing
+                if not os.path.isfile(os.path.join(brdc_archive, filename)):
+                    tqdm.write(' -- Listing folder ' + folder)
+                    ftp_list = list_folder(folder)
+                else:
+                    ftp_list = set()
+
                 for ext in ('.Z', '.gz'):
                     ftp_filename = filename + ext
-                    if downloadIfMissing(ftp_list, ftp_filename, filename, brdc_archive, 'BRDC'):
+                    if downloadIfMissing(ftp_list, folder, ftp_filename, filename, brdc_archive, 'BRDC'):
                         # decompress file
                         tqdm.write('  -> Download succeeded %s' %  os.path.join(brdc_archive, ftp_filename))
                         pyRunWithRetry.RunCommand('gunzip -f ' + os.path.join(brdc_archive, ftp_filename),
@@ -198,12 +204,6 @@ def main():
 
             # ##### now the ionex files #########
             folder = "/pub/gps/products/ionex/%s/%s" % (date.yyyy(), date.ddd())
-            tqdm.write(' -- Changing folder to ' + folder)
-            try:
-                ftp.cwd(folder)
-                ftp_list = set(ftp.nlst())
-            except ftplib.error_perm:
-                ftp_list = ()
 
             ionex_archive = replace_vars(Config.ionex_path, date)
 
@@ -216,11 +216,14 @@ def main():
 
                 if not (os.path.exists(os.path.join(ionex_archive, l_fname)) or
                         os.path.exists(os.path.join(ionex_archive, s_fname))):
-                    if downloadIfMissing(ftp_list, l_fname, l_fname, ionex_archive, 'IONEX'):
+                    tqdm.write(' -- Listing folder ' + folder)
+                    ftp_list = list_folder(folder)
+
+                    if downloadIfMissing(ftp_list, folder, l_fname, l_fname, ionex_archive, 'IONEX'):
                         # try long name first
                         tqdm.write('  -> Download succeeded %s' % os.path.join(ionex_archive, l_fname))
                         # leave it zipped
-                    elif downloadIfMissing(ftp_list, s_fname, s_fname, ionex_archive, 'IONEX'):
+                    elif downloadIfMissing(ftp_list, folder, s_fname, s_fname, ionex_archive, 'IONEX'):
                         # try short name
                         tqdm.write('  -> Download succeeded %s' % os.path.join(ionex_archive, s_fname))
                         # leave it zipped, but change the name to the long name
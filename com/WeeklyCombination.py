@@ -25,76 +25,11 @@ from pgamit import pyGamitConfig
 from pgamit.Utils import split_string, file_open, file_readlines, stationID, chmod_exec, add_version_argument
 
 
-def replace_in_sinex(sinex, observations, unknowns, new_val):
-
-    new_unknowns = \
-""" NUMBER OF UNKNOWNS%22i
- NUMBER OF DEGREES OF FREEDOM%12i
- PHASE MEASUREMENTS SIGMA          0.0015
+# statistics that glbtosnx does not report
+SINEX_STATISTICS = \
+""" PHASE MEASUREMENTS SIGMA          0.0015
  SAMPLING INTERVAL (SECONDS)           30
-""" % (new_val, observations - new_val)
-
-    snx_path = os.path.basename(os.path.splitext(sinex)[0]) + '_MOD.snx'
-    with file_open(snx_path, 'w') as nsnx:
-        with file_open(sinex, 'r') as osnx:
-            for line in osnx:
-                if ' NUMBER OF UNKNOWNS%22i' % unknowns in line:
-                    # empty means local directory! LA RE PU...
-                    nsnx.write(new_unknowns)
-                else:
-                    nsnx.write(line)
-
-    # rename file
-    os.remove(sinex)
-    os.renames(snx_path, sinex)
-
-
-def add_domes(sinex, stations):
-
-    for stn in stations:
-        if stn['dome'] is not None:
-            # " BATF  A ---------"
-            os.system("sed -i 's/ %s  A ---------/ %s  A %s/g' %s"
-                      % (stn['StationCode'].upper(), stn['StationCode'].upper(), stn['dome'], sinex))
-
-
-def process_sinex(cnn, project, dates, sinex):
-
-    # parse the SINEX to get the station list
-    snx = snxParse.snxFileParser(sinex)
-    snx.parse()
-
-    stnlist = ('\'' + '\',\''.join(snx.stationDict.keys()) + '\'').lower()
-
-    # insert the statistical data
-
-    zg = cnn.query_float('SELECT count("Year")*2 as ss FROM gamit_soln '
-                         'WHERE "Project" = \'%s\' AND "FYear" BETWEEN %.4f AND %.4f AND "StationCode" IN (%s) '
-                         'GROUP BY "Year", "DOY"'
-                         % (project, dates[0].first_epoch('fyear'), dates[1].last_epoch('fyear'), stnlist))
-
-    zg = sum(s[0] for s in zg)
-
-    zd = cnn.query_float('SELECT count("ZTD") + %i as implicit FROM gamit_ztd '
-                         'WHERE "Date" BETWEEN \'%s\' AND \'%s\' '
-                         % (zg, dates[0].first_epoch(), dates[1].last_epoch()))
-
-    zd = zd[0][0]
-
-    print(' >> Adding NUMBER OF UNKNOWNS: %i (previous value: %i)' % (zd, snx.unknowns))
-
-    replace_in_sinex(sinex, snx.observations, snx.unknowns, snx.unknowns + zg + zd)
-
-    rs = cnn.query('SELECT "NetworkCode", "StationCode", dome FROM stations '
-                   'WHERE "StationCode" IN (%s) '
-                   'ORDER BY "NetworkCode", "StationCode"'
-                   % stnlist)
-
-    stations = rs.dictresult()
-
-    print(' >> Adding DOMES')
-    # add domes
-    add_domes(sinex, stations)
+"""
 
 
 class GlobkException(Exception):
@@ -392,6 +327,8 @@ def main():
 
     print(' >> Converting to SINEX the daily solutions')
 
+    sinex_files = []
+
     for day, glx in enumerate(glx_list):
         date = pyDate.Date(gpsWeek    = int(args.gpsweek[0]),
                            gpsWeekDay = day)
@@ -406,16 +343,18 @@ def main():
         move(globk_pwd + '/' + org + date.wwww() + '%i.snx' % (date.gpsWeekDay + 8),
              globk_pwd + '/' + org + date.wwww() + '%i.snx' % date.gpsWeekDay)
 
-        process_sinex(cnn, project, [date, date], globk_pwd + '/' + org + date.wwww() + '%i.snx' % date.gpsWeekDay)
+        sinex_files.append((globk_pwd + '/' + org + date.wwww() + '%i.snx' % date.gpsWeekDay, [date, date]))
 
     # delete the existing GLX files: get ready for weekly combination
     for ff in glob.glob(globk_pwd + '/*.GLX'):
         os.remove(ff)
     # ready to pass list to globk object
     Globk(globk_pwd, org, glx_list, date_s.wwww(), 7, ' '.join(set(use_site)))
-    print(' >> Formatting the SINEX file')
+    sinex_files.append((globk_pwd + '/' + org + date_s.wwww() + '7.snx', [date_s, date_e]))
 
-    process_sinex(cnn, project, [date_s, date_e], globk_pwd + '/' + org + date_s.wwww() + '7.snx')
+    print(' >> Formatting the SINEX files')
+    # DDG: the daily and weekly files are updated in parallel with a single query per table
+    snxParse.update_sinex(cnn, project, sinex_files, SINEX_STATISTICS)
 
 
 if __name__ == '__main__':
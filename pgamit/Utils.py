@@ -941,8 +941,10 @@ database = [gnss_data]
 path = [absolute_path]
 repository = [absolute_path]
 
-# parallel execution of certain tasks. If set to false, everything runs in series.
+# parallel execution of certain tasks. If set to false, everything runs in series. If set to local, the tasks run
+# in a pool of processes in this computer (no dispy nodes needed) using local_cpus CPUs (default: all)
 parallel = True
+#local_cpus = 8
 
 # absolute location of the broadcast orbits, can use keywords declared above
 #brdc = [absolute_path]
@@ -951,6 +953,14 @@ brdc = [absolute_path]
 # absolute location of the sp3 orbits
 sp3 = [absolute_path]
 
+# optional node-local folder to cache uncompressed products (sp3, clk, brdc, ionex) and its size in GB
+#products_cache = [absolute_path]
+#products_cache_size = 20
+
+# optional folder to save the remote directory listings of DownloadSources and SyncOrbits, and their lifetime in hours
+#listings_cache = [absolute_path]
+#listings_ttl = 6
+
 # orbit center to use for processing. Separate by commas to try more than one.
 sp3_ac = IGS
 # precedence of orbital reprocessing campaign
@@ -984,7 +994,7 @@ atx = /example/igs08_1930.atx, /example/igs08_1930.atx
 def fqdn_parse(fqdn, default_port=None):
     if ':' in fqdn:
         fqdn, port = fqdn.split(':')
-        return fqdn, int(port[1])
+        return fqdn, int(port)
     else:
         return fqdn, default_port
 
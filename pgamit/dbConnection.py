@@ -11,6 +11,9 @@ import platform
 import configparser
 import inspect
 import re
+import hashlib
+import struct
+import threading
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions
@@ -106,6 +109,92 @@ class dbErrDelete (Exception): pass
 class DatabaseError(psycopg2.DatabaseError): pass
 
 
+class dbErrLockTimeout(Exception): pass
+
+
+def advisory_lock_key(*args):
+    """
+    Build the 64-bit key of an advisory lock from its arguments (e.g. NetworkCode, StationCode, filename).
+    Python's hash() is salted per process, so a stable digest is used to get the same key in every node
+    """
+    digest = hashlib.sha1('.'.join(str(arg) for arg in args).encode('utf-8')).digest()
+    return struct.unpack('>q', digest[:8])[0]
+
+
+class PgLockBackend(object):
+    """
+    Advisory locks held by the session of a Cnn object. pg_advisory_lock blocks in the server until the lock is
+    granted (no polling), and lock_timeout bounds the wait
+    """
+    def __init__(self, cnn):
+        self.cnn = cnn
+
+    def acquire(self, key, timeout=None):
+        cursor = self.cnn.cnn.cursor()
+        try:
+            if timeout is not None:
+                cursor.execute('SET lock_timeout = %s', ('%ims' % max(int(timeout * 1000), 1),))
+            cursor.execute('SELECT pg_advisory_lock(%s)', (key,))
+        except psycopg2.errors.LockNotAvailable as e:
+            raise dbErrLockTimeout('Timeout after %.1f s while waiting for advisory lock %i' % (timeout, key)) from e
+        finally:
+            if timeout is not None:
+                cursor.execute('SET lock_timeout = DEFAULT')
+            cursor.close()
+
+    def release(self, key):
+        cursor = self.cnn.cnn.cursor()
+        try:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (key,))
+        finally:
+            cursor.close()
+
+
+class LocalLockBackend(object):
+    """
+    In-process stand-in for PgLockBackend to exercise the locking logic without a database: each thread plays the
+    role of a database session (locks are reentrant for the thread that holds them, same as advisory locks)
+    """
+    def __init__(self):
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    def acquire(self, key, timeout=None):
+        with self.guard:
+            lock = self.locks.setdefault(key, threading.RLock())
+
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise dbErrLockTimeout('Timeout after %.1f s while waiting for advisory lock %i' % (timeout, key))
+
+    def release(self, key):
+        self.locks[key].release()
+
+
+class AdvisoryLock(object):
+    """
+    Context manager to serialize work between processes (and nodes) using an advisory lock, e.g.:
+
+        with cnn.advisory_lock('???', StationCode, timeout=60):
+            ...
+
+    raises dbErrLockTimeout if the lock could not be acquired within timeout seconds (None waits forever)
+    """
+    def __init__(self, backend, *args, timeout=None):
+        self.backend = backend
+        self.key     = advisory_lock_key(*args)
+        self.timeout = timeout
+        self.name    = '.'.join(str(arg) for arg in args)
+
+    def __enter__(self):
+        self.backend.acquire(self.key, self.timeout)
+        debug("LOCK: acquired %s (%i)" % (self.name, self.key))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.backend.release(self.key)
+        debug("LOCK: released %s (%i)" % (self.name, self.key))
+
+
 class Cnn(object):
 
     def __init__(self, configfile, use_float=False, write_cfg_file=False):
@@ -117,6 +206,10 @@ class Cnn(object):
 
         self.active_transaction = False
         self.options            = options
+        # cache of table columns used by insert (avoids an information_schema query per insert)
+        self.columns_cache      = {}
+        # when not None, insert_event appends the events here until flush_events is called
+        self.event_buffer       = None
         
         # parse session config file
         config = configparser.ConfigParser()
@@ -240,6 +333,12 @@ class Cnn(object):
         except psycopg2.Error as e:
             raise e
 
+    def advisory_lock(self, *args, timeout=None):
+        """
+        Returns an AdvisoryLock context manager keyed by a hash of args, held by this connection
+        """
+        return AdvisoryLock(PgLockBackend(self), *args, timeout=timeout)
+
     def get_columns(self, table):
         tblinfo = self.query('select column_name, data_type from information_schema.columns where table_name=\'%s\''
                              % table).dictresult()
@@ -266,7 +365,10 @@ class Cnn(object):
         debug("INSERT: table=%r kw=%r" % (table, kw))
 
         # figure out any extra columns and remove them from the incoming **kw
-        cols = list(self.get_columns(table).keys())
+        if table not in self.columns_cache:
+            self.columns_cache[table] = list(self.get_columns(table).keys())
+
+        cols = self.columns_cache[table]
 
         # assuming fields are passed through kw which are keyword arguments
         fields = [k for k in kw.keys() if k in cols]
@@ -283,6 +385,39 @@ class Cnn(object):
             self.cnn.rollback()
             raise dbErrInsert(e)
 
+    def insert_many(self, table, rows):
+        """
+        Insert a list of rows (dictionaries with the same keys) using a single statement inside a transaction. As in
+        insert, the keys that are not columns of the table are ignored. If any of the rows violates a unique
+        constraint, none is inserted
+        """
+        if not rows:
+            return
+
+        debug("INSERT: table=%r rows=%i" % (table, len(rows)))
+
+        if table not in self.columns_cache:
+            self.columns_cache[table] = list(self.get_columns(table).keys())
+
+        cols = self.columns_cache[table]
+
+        fields  = [k for k in rows[0].keys() if k in cols]
+        columns = '", "'.join(fields)
+        query   = f'INSERT INTO {table} ("{columns}") VALUES %s'
+
+        # all the rows in one page (execute_values sends 100 per statement by default) and one transaction
+        self.begin_transac()
+        try:
+            psycopg2.extras.execute_values(self.cursor, query, [[row[f] for f in fields] for row in rows],
+                                           page_size=len(rows))
+            self.commit_transac()
+        except psycopg2.errors.UniqueViolation as e:
+            self.rollback_transac()
+            raise dbErrInsert(e)
+        except psycopg2.Error:
+            self.rollback_transac()
+            raise
+
     def update(self, table, set_row, **kwargs):
         """
         Updates the specified table with new field values. The row(s) are updated based on the primary key(s)
@@ -315,6 +450,38 @@ class Cnn(object):
             self.cnn.rollback()
             raise dbErrUpdate(e)
 
+    def update_many(self, table, rows, keys):
+        """
+        Updates several rows using a single statement inside a transaction: either all the rows are updated or none.
+
+        Parameters:
+        table (str): The table to update.
+        rows (list): Dictionaries (with the same keys) with the key fields and the new field values of each row.
+        keys (tuple): The fields that identify the rows (e.g. ('NetworkCode', 'StationCode')). The rest of the
+                      fields in rows are set.
+        """
+        if not rows:
+            return
+
+        fields     = list(rows[0].keys())
+        set_clause = ', '.join([f'"{field}" = v."{field}"' for field in fields if field not in keys])
+        where      = ' AND '.join([f't."{key}" = v."{key}"' for key in keys])
+        columns    = ', '.join([f'"{field}"' for field in fields])
+
+        query = f'UPDATE {table} AS t SET {set_clause} FROM (VALUES %s) AS v ({columns}) WHERE {where}'
+
+        # DDG: execute_values splits the rows in pages of 100 by default, each one a separate statement that would be
+        # committed on its own (autocommit): send all the rows in one page and one transaction
+        self.begin_transac()
+        try:
+            psycopg2.extras.execute_values(self.cursor, query, [[row[f] for f in fields] for row in rows],
+                                           page_size=len(rows))
+            self.commit_transac()
+            debug(f"UPDATE {table}: {len(rows)} rows")
+        except psycopg2.Error as e:
+            self.rollback_transac()
+            raise dbErrUpdate(e)
+
     def delete(self, table, **kw):
         """
         Deletes row(s) from the specified table based on the provided keyword arguments.
@@ -344,7 +511,41 @@ class Cnn(object):
     def insert_event(self, event):
         debug("EVENT: event=%r" % (event.db_dict()))
 
-        self.insert('events', **event.db_dict())
+        if self.event_buffer is not None:
+            self.event_buffer.append(event.db_dict())
+        else:
+            self.insert('events', **event.db_dict())
+
+    def buffer_events(self):
+        """
+        Start buffering the events passed to insert_event. The buffered events are inserted in a single transaction
+        by flush_events. Used by batch processes to avoid one round-trip (and commit) per event
+        """
+        if self.event_buffer is None:
+            self.event_buffer = []
+
+    def flush_events(self):
+        """
+        Insert all the buffered events using a single statement and stop buffering
+        """
+        events = self.event_buffer
+        self.event_buffer = None
+
+        if not events:
+            return
+
+        fields = list(events[0].keys())
+        columns = '", "'.join(fields)
+        query = f'INSERT INTO events ("{columns}") VALUES %s'
+
+        self.begin_transac()
+        try:
+            psycopg2.extras.execute_values(self.cursor, query, [[e.get(f) for f in fields] for e in events])
+            self.commit_transac()
+            debug(f"EVENTS: flushed {len(events)} events")
+        except psycopg2.Error as e:
+            self.rollback_transac()
+            raise DatabaseError(e)
 
     def insert_event_bak(self, type, module, desc):
         debug("EVENT_BAK: type=%r module=%r desc=%r" % (type, module, desc))
@@ -36,7 +36,7 @@ from scipy.spatial import Delaunay, distance
 
 # app
 from pgamit.pyGamitSession import GamitSession
-from pgamit.pyStation import StationCollection
+from pgamit.pyStation import StationCollection, StationInstanceBatch
 from pgamit.cluster import (BisectingQMeans, overcluster, prune, 
                             select_central_point)
 from pgamit.plots import plot_global_network
@@ -380,11 +380,18 @@ class Network(object):
 
         sessions = []
 
+        # prefetch the information of all the stations of the day for the StationInstances of every session
+        batch = StationInstanceBatch(cnn, archive,
+                                     list(backbone) +
+                                     [stn for c in clusters['stations'] for stn in c] +
+                                     [stn for t in ties for stn in t], date)
+
         if len(backbone):
             # a backbone network was created: at least two or more clusters
             # backbone if always network 00
             sessions.append(GamitSession(cnn, archive, self.name, self.org,
-                                         0, date, self.GamitConfig, backbone))
+                                         0, date, self.GamitConfig, backbone,
+                                         batch=batch))
 
             for c in range(len(clusters['centroids'])):
                 # create a session for each cluster
@@ -392,11 +399,13 @@ class Network(object):
                                              self.org, c + 1, date,
                                              self.GamitConfig,
                                              clusters['stations'][c], ties[c],
-                                             clusters['centroids'][c].tolist()))
+                                             clusters['centroids'][c].tolist(),
+                                             batch=batch))
 
         else:
             sessions.append(GamitSession(cnn, archive, self.name, self.org,
                                          None, date, self.GamitConfig,
-                                         clusters['stations'][0]))
+                                         clusters['stations'][0],
+                                         batch=batch))
 
         return sessions
@@ -21,8 +21,12 @@ import subprocess
 import shutil
 import os
 import time
+import json
+import re
 from tqdm import tqdm
 import traceback
+from urllib.parse import unquote
+from zlib import crc32
 
 # app
 from pgamit.Utils import  file_try_remove, dir_try_remove
@@ -31,6 +35,7 @@ SERVER_REFRESH_INTERVAL      = 2   # in seconds
 SERVER_CONNECTION_TIMEOUT    = 20  # in seconds
 SERVER_RECONNECTION_INTERVAL = 3   # in seconds
 SERVER_MAX_RECONNECTIONS     = 8
+LISTING_TTL                  = 6 * 3600  # in seconds
 
 DEBUG = False
 
@@ -297,6 +302,133 @@ class ProtocolHTTPS(ProtocolHTTP):
         super(ProtocolHTTPS, self).__init__(*args, protocol='https', **kargs)
 
 
+# ----------------
+# LISTINGS CACHE
+# ----------------
+
+
+class ListingCache:
+    """
+    Remote directory listings of a server. Each directory is listed once with IProtocol.list_dir (or any function with
+    the same contract) and the listing is kept for the rest of the run, so that the availability of every file in the
+    directory is known without a round-trip to the server. If a path is given, the listings are also saved there and
+    reused by the following runs until they are ttl seconds old.
+    """
+    # signatures of the directory indexes generated by web servers (Apache, nginx, IIS, python's http.server): any
+    # other html page (login, landing or error pages) says nothing about the files in the folder
+    AUTOINDEX = re.compile(r'<title>\s*(index of|directory listing for)\b|href\s*=\s*["\']\.\./?["\']|'
+                           r'\[to parent directory\]', re.IGNORECASE)
+
+    def __init__(self, host, path=None, ttl=LISTING_TTL):
+        self.host     = host
+        self.path     = path
+        self.ttl      = ttl
+        self.listings = {}  # folder -> set of names, None if the folder cannot be listed
+        self.lock     = threading.Lock()
+        self.locks    = {}  # folder -> lock, so that only one session lists a folder
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def entry(self, folder):
+        return os.path.join(self.path, '%08x.json' % (crc32((self.host + folder).encode()) & 0xffffffff))
+
+    def load(self, folder):
+        try:
+            with open(self.entry(folder)) as f:
+                listing = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (listing.get('host') == self.host and listing.get('folder') == folder
+                and time.time() - listing.get('time', 0) < self.ttl):
+            return set(listing['names'])
+        return None
+
+    def save(self, folder, names):
+        tmp = self.entry(folder) + '.%i.tmp' % os.getpid()
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'host': self.host, 'folder': folder, 'time': time.time(), 'names': sorted(names)}, f)
+            os.replace(tmp, self.entry(folder))
+        except OSError:
+            # the cache is an optimization: failing to save it is not an error
+            file_try_remove(tmp)
+
+    @staticmethod
+    def parse(listing):
+        if isinstance(listing, str):
+            # HTTP servers return an html index: keep the names of the links
+            if not ListingCache.AUTOINDEX.search(listing):
+                return None
+            names = {os.path.basename(unquote(href).rstrip('/'))
+                     for href in re.findall(r'href\s*=\s*["\']([^"\'?#]+)', listing, re.IGNORECASE)}
+            return names - {'', '.', '..'}
+        return {os.path.basename(name.rstrip('/')) for name in listing}
+
+    @staticmethod
+    def is_missing_folder(e):
+        # FTP: 550 on CWD; SFTP: ENOENT; HTTP: 404
+        return (isinstance(e, ftplib.error_perm) and str(e).startswith('550')) or \
+               (isinstance(e, IOError) and e.errno == errno.ENOENT) or \
+               'status code 404' in str(e)
+
+    def listing(self, list_dir, folder):
+        """
+        returns the set of names in the remote folder (empty if the folder does not exist) or None if the folder
+        cannot be listed, in which case the availability of its files is unknown
+        """
+        folder = folder.rstrip('/')
+
+        with self.lock:
+            if folder in self.listings:
+                return self.listings[folder]
+            folder_lock = self.locks.setdefault(folder, threading.Lock())
+
+        with folder_lock:
+            # another session might have listed the folder while waiting for the lock
+            with self.lock:
+                if folder in self.listings:
+                    return self.listings[folder]
+
+            names = self.load(folder) if self.path else None
+
+            if names is None:
+                try:
+                    names = self.parse(list_dir(folder + '/'))
+                except Exception as e:
+                    names = set() if self.is_missing_folder(e) else None
+
+                if names is not None and self.path:
+                    self.save(folder, names)
+
+            with self.lock:
+                self.listings[folder] = names
+
+        return names
+
+    def available(self, list_dir, server_path) -> Optional[bool]:
+        """
+        True or False if the listing of the folder says whether server_path exists, None if unknown
+        """
+        names = self.listing(list_dir, os.path.dirname(server_path))
+        return None if names is None else os.path.basename(server_path) in names
+
+    @staticmethod
+    def purge(path, ttl=LISTING_TTL):
+        """
+        remove the expired listings saved in path
+        """
+        if path and os.path.isdir(path):
+            for name in os.listdir(path):
+                entry = os.path.join(path, name)
+                try:
+                    if time.time() - os.path.getmtime(entry) > ttl:
+                        file_try_remove(entry)
+                except OSError:
+                    pass
+
+
 class Client:
     class NextDownload(NamedTuple):
         urlpath_file: str
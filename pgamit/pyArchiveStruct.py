@@ -276,6 +276,81 @@ class RinexStruct(object):
 
         return self.cnn.query(sql).dictresult()
 
+    def get_rinex_by_fingerprint(self, fingerprint):
+        """
+        Retrieve the rinex records that have the provided content fingerprint (see pyRinex.fingerprint). Used to
+        detect incoming files that are already in the archive before doing any heavy processing on them
+        :param fingerprint: 40 character hex string returned by pyRinex.fingerprint
+        :return: a list of dictionaries with the matching records (empty if the file is not in the database)
+        """
+        if not fingerprint:
+            return []
+
+        return self.cnn.query('SELECT * FROM rinex WHERE "Fingerprint" = \'%s\'' % fingerprint).dictresult()
+
+    def db_checks(self):
+        """
+        Add the Fingerprint column (and its index) to the rinex table if it does not exist. Existing rows are left
+        with a NULL fingerprint, which never matches an incoming file, until ScanArchive -fingerprint fills them
+        """
+        if 'Fingerprint' in self.cnn.get_columns('rinex').keys():
+            # New field in table rinex present, no need to migrate.
+            return
+
+        self.cnn.begin_transac()
+        self.cnn.query("""
+        ALTER TABLE rinex
+        ADD COLUMN "Fingerprint" VARCHAR(40);
+        CREATE INDEX rinex_fingerprint_idx ON rinex ("Fingerprint");
+        """)
+        self.cnn.commit_transac()
+
+    def format_rinex_path(self, field, with_filename=True):
+        """
+        Build the archive path of a rinex / rinex_proc record
+        :param field: dictionary with the archive level columns and the Filename
+        :param with_filename: if set, returns a path including the filename (CRINEZ). Otherwise, just returns the path
+        :return: a path with or without filename
+        """
+        path = "/".join('{key:0{width}{type}}'.format(key=field[level['rinex_col_in']],
+                                                      width=level['TotalChars'],
+                                                      type='.0f' if level['isnumeric'] == '1' else 's')
+                        for level in self.levels)
+
+        if with_filename:
+            rnx_name = RinexNameFormat(field['Filename'])
+            # database stores rinex, we want crinez
+            return path + "/" + rnx_name.to_rinex_format(pyRinexName.TYPE_CRINEZ)
+        else:
+            return path
+
+    def get_rinex_proc_records(self, stations, ObservationYear, ObservationDOY):
+        """
+        Retrieve in a single query the processing file (rinex_proc) of several stations for a given day. Pass the
+        records to format_rinex_path to obtain the same result as build_rinex_path
+        :param stations: list of (NetworkCode, StationCode) tuples
+        :param ObservationYear: Year of the rinex files being retrieved
+        :param ObservationDOY: DOY of the rinex files being retrieved
+        :return: a dictionary {(NetworkCode, StationCode): record}. Stations without data are not in the dictionary
+        """
+        if not len(stations):
+            return {}
+
+        sql_string = ", ".join(['"' + level['rinex_col_in'] + '"' for level in self.levels] +
+                               ['"NetworkCode"', '"StationCode"', '"Filename"'])
+
+        rs = self.cnn.query('SELECT ' + sql_string + ' FROM rinex_proc WHERE "ObservationYear" = ' +
+                            str(ObservationYear) + ' AND "ObservationDOY" = ' + str(ObservationDOY) +
+                            ' AND ("NetworkCode", "StationCode") IN (' +
+                            ', '.join('(\'%s\', \'%s\')' % stn for stn in stations) + ')')
+
+        records = {}
+        for record in rs.dictresult():
+            # keep the first record, as build_rinex_path does
+            records.setdefault((record['NetworkCode'], record['StationCode']), record)
+
+        return records
+
     def scan_archive_struct(self, rootdir, progress_bar=None):
         self.archiveroot = rootdir
 
@@ -365,18 +440,7 @@ class RinexStruct(object):
             if not rs.ntuples():
                 return None
 
-            field = rs.dictresult()[0]
-            path = "/".join('{key:0{width}{type}}'.format(key=field[level['rinex_col_in']],
-                                                          width=level['TotalChars'],
-                                                          type='.0f' if level['isnumeric'] == '1' else 's')
-                            for level in self.levels)
-
-            if with_filename:
-                rnx_name = RinexNameFormat(field['Filename'])
-                # database stores rinex, we want crinez
-                return path + "/" + rnx_name.to_rinex_format(pyRinexName.TYPE_CRINEZ)
-            else:
-                return path
+            return self.format_rinex_path(rs.dictresult()[0], with_filename)
 
         else:
             # new file (get the path where it's supposed to go)
@@ -2977,6 +2977,103 @@ class ETM:
 
         return xyz, sig, window, source
 
+    def get_xyz_s_many(self, dates, sigma_h=SIGMA_FLOOR_H, sigma_v=SIGMA_FLOOR_V, force_model=False):
+        """
+        Vectorized version of get_xyz_s: returns the coordinates and sigmas of several epochs at once. The ETM is
+        evaluated for all the epochs that need it with a single matrix product and the jump windows are determined
+        with masks. Returns the same values as calling get_xyz_s for each date
+        :param dates: list of pyDate.Date objects
+        :param sigma_h: horizontal sigma floor
+        :param sigma_v: vertical sigma floor
+        :param force_model: evaluate the ETM even if there is a good solution for the date
+        :return: xyz (3 x n array), sig (3 x n array), window (list with the date of the jump or None for each date),
+        source (list of strings describing the origin of each coordinate)
+        """
+        mjd   = np.array([date.mjd   for date in dates], dtype=int)
+        fyear = np.array([date.fyear for date in dates])
+        n     = mjd.size
+
+        window = [None] * n
+        for jump in self.Jumps.table:
+            if jump.p.jump_type in (GENERIC_JUMP, CO_SEISMIC_JUMP_DECAY, ANTENNA_CHANGE, CO_SEISMIC_JUMP) and \
+                    jump.fit and \
+                    np.sqrt(np.sum(np.square(jump.p.params[:, 0]))) > 0.02:
+                for i in np.where(mjd == jump.date.mjd)[0]:
+                    window[i] = jump.date
+
+        # find the epochs in the t vector (first occurrence of each mjd)
+        soln_mjd, first = np.unique(np.array(self.soln.mjd, dtype=int), return_index=True)
+        pos   = np.clip(np.searchsorted(soln_mjd, mjd), 0, soln_mjd.size - 1)
+        found = soln_mjd[pos] == mjd
+        index = first[pos]
+
+        L       = self.L
+        ref_pos = np.array([self.soln.auto_x,
+                            self.soln.auto_y,
+                            self.soln.auto_z], dtype=float).reshape((3, 1))
+
+        xyz    = np.zeros((3, n))
+        sig    = np.zeros((3, n))
+        source = [''] * n
+        stack  = self.soln.stack_name.upper()
+
+        if self.A is not None:
+            # a valid epoch that was not filtered out: the coordinate is good
+            good = found & np.all(self.F[:, index], axis=0) & (not force_model)
+            # epochs that have to come from the ETM
+            model = ~good
+
+            xyz[:, good] = L[:, index[good]]
+            sig[:, good] = self.R[:, index[good]]
+
+            if np.any(model):
+                # closest epoch in the (sorted) ts vector, same as argmin(abs(ts - fyear))
+                ts  = self.soln.ts
+                idt = np.clip(np.searchsorted(ts, fyear[model]), 1, ts.size - 1)
+                idt = np.where(np.abs(ts[idt - 1] - fyear[model]) <= np.abs(ts[idt] - fyear[model]), idt - 1, idt) \
+                    if ts.size > 1 else np.zeros(idt.size, dtype=int)
+
+                neu = np.dot(self.As[idt, :], np.array(self.C[0:3]).T).T
+                xyz[:, model] = self.rotate_2xyz(neu) + ref_pos
+
+            # the coordinate is marked as bad: use the deviation from the ETM multiplied by 2.5 to estimate the error
+            filtered = model & found
+            sig[:, filtered] = 2.5 * self.R[:, index[filtered]]
+            # the coordinate doesn't exist: use the nominal sigma multiplied by 2.5
+            missing = model & ~found
+            sig[:, missing] = 2.5 * self.factor[:, np.newaxis]
+
+            for i in range(n):
+                if good[i]:
+                    source[i] = stack + ' with ETM solution: good'
+                elif found[i]:
+                    source[i] = stack + ' with ETM solution: filtered'
+                else:
+                    source[i] = 'No ' + stack + ' solution: ETM'
+
+            # get the velocity of the site
+            if np.sqrt(np.square(self.Linear.p.params[0, 1]) +
+                       np.square(self.Linear.p.params[1, 1]) +
+                       np.square(self.Linear.p.params[2, 1])) > 0.2:
+                # fast moving station! bump up the sigma floor
+                sigma_h = 99.9
+                sigma_v = 99.9
+                source  = [src + '. fast moving station, bumping up sigmas' for src in source]
+        else:
+            # no ETM (too few points): use the solution of the day or the average
+            xyz[:, found]  = L[:, index[found]]
+            xyz[:, ~found] = np.mean(L, axis=1)[:, np.newaxis]
+            # set the uncertainties in NEU by hand
+            sig[:, :] = 9.99
+
+            source = [stack + ' solution, no ETM' if f else
+                      'No ' + stack + ' solution, no ETM: mean coordinate' for f in found]
+
+        # apply floor sigmas
+        sig = np.sqrt(np.square(sig) + np.square(np.array([[sigma_h], [sigma_h], [sigma_v]])))
+
+        return xyz, sig, window, source
+
     def rotate_2neu(self, ecef):
 
         return np.array(ct2lg(ecef[0], ecef[1], ecef[2], self.soln.lat, self.soln.lon))
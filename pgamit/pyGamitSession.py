@@ -13,7 +13,7 @@ from tqdm import tqdm
 
 # app
 from pgamit import pyRinexName
-from pgamit.pyStation import StationInstance, StationCollection
+from pgamit.pyStation import StationInstance, StationInstanceBatch, StationCollection
 from pgamit.Utils import determine_frame, file_open, stationID, chmod_exec
 from pgamit import pyGamitConfig
 from pgamit import snxParse
@@ -29,7 +29,8 @@ class GamitSessionException(Exception):
 
 class GamitSession(object):
 
-    def __init__(self, cnn, archive, name, org, subnet, date, GamitConfig, stations, ties=(), centroid=()):
+    def __init__(self, cnn, archive, name, org, subnet, date, GamitConfig, stations, ties=(), centroid=(),
+                 batch=None):
         """
         The GAMIT session object creates all the directory structure and configuration files according to the parameters
         set in GamitConfig. Two stations list are passed and merged to create the session
@@ -42,6 +43,9 @@ class GamitSession(object):
         :param GamitConfig: configuration to run gamit
         :param stations: list of stations to be processed
         :param ties: tie stations as obtained by pyNetwork
+        :param centroid: centroid of the sub-network
+        :param batch: StationInstanceBatch with the information of all the stations of this day (shared between the
+        sessions of the day). If None, one is created for the stations of this session
         """
         self.NetName = name
         self.org     = org
@@ -83,10 +87,13 @@ class GamitSession(object):
                               for stn in stations]
 
         # make StationInstances
+        if batch is None:
+            batch = StationInstanceBatch(cnn, archive, stations + list(ties), date)
+
         station_instances = []
         for stn in stations:
             try:
-                station_instances += [StationInstance(cnn, archive, stn, date, GamitConfig)]
+                station_instances += [StationInstance(cnn, archive, stn, date, GamitConfig, batch=batch)]
             except pyRinexName.RinexNameException:
                 tqdm.write(' -- WARNING (station instance): station %s on day %s appears to have a badly formed RINEX '
                            'filename. Please check the archive and make sure all filenames follow the RINEX 2/3 '
@@ -96,7 +103,8 @@ class GamitSession(object):
         # do the same with ties
         for stn in ties:
             try:
-                station_instances += [StationInstance(cnn, archive, stn, date, GamitConfig, is_tie=True)]
+                station_instances += [StationInstance(cnn, archive, stn, date, GamitConfig, is_tie=True,
+                                                      batch=batch)]
             except pyRinexName.RinexNameException:
                 tqdm.write(' -- WARNING (tie instance): station %s on day %s appears to have a badly formed RINEX '
                            'filename. Please check the archive and make sure all filenames follow the RINEX 2/3 '
@@ -335,8 +343,11 @@ $$\n""" % (self.Config.options['otlmodel']))
         # copy process.defaults and sestbl.
         copyfile(self.GamitOpts['process_defaults'],
                  os.path.join(self.pwd_tables, 'process.defaults'))
-        # copyfile(self.GamitOpts['atx'], os.path.join(self.pwd_tables, 'antmod.dat'))
-        copyfile(atx, os.path.join(self.pwd_tables, 'antmod.dat'))
+        # DDG: link the ATX instead of copying it. The link is resolved by GamitTask using the node tables cache
+        antmod = os.path.join(self.pwd_tables, 'antmod.dat')
+        if os.path.lexists(antmod):
+            os.remove(antmod)
+        os.symlink(os.path.abspath(atx), antmod)
 
         # change the scratch directory in the sestbl. file
         with file_open(os.path.join(self.pwd_tables, 'sestbl.'), 'w') as sestbl:
@@ -349,7 +360,8 @@ $$\n""" % (self.Config.options['otlmodel']))
                         sestbl.write(line)
 
     def link_tables(self):
-        script_path = 'link_tables.sh'
+        # DDG: script goes in the session directory since sessions might be initialized concurrently
+        script_path = os.path.join(self.solution_pwd, 'link_tables.sh')
         try:
             link_tables = file_open(script_path, 'w')
         except (OSError, IOError):
@@ -372,7 +384,8 @@ $$\n""" % (self.Config.options['otlmodel']))
         link_tables.close()
 
         chmod_exec(script_path)
-        os.system('./'+script_path)
+        os.system(os.path.join('.', script_path))
+        os.remove(script_path)
 
     def get_rinex_filenames(self):
         return [stn.GetRinexFilename() for stn in self.StationInstances]
@@ -13,13 +13,22 @@ import platform
 import traceback
 import numpy
 import zipfile
+import hashlib
+import errno
+import stat
+import tempfile
 
 # app
 from pgamit import pyRinex
 from pgamit import pyProducts
 from pgamit.Utils import (file_write, file_open,
                           file_append, file_readlines,
-                          chmod_exec, stationID)
+                          chmod_exec, stationID, file_try_remove)
+
+# node-local directory where the GAMIT tables are stored once and hard-linked into each session
+TABLES_CACHE = 'production/tables_cache'
+# disk budget of the tables cache (in GB): the least recently used tables are evicted beyond it
+TABLES_CACHE_SIZE = 10
 
 
 def now_str():
@@ -33,6 +42,164 @@ def replace_vars(archive, date):
         .replace('$gpswkday', str(date.gpsWeekDay))
 
 
+class TablesCache(object):
+    """
+    Node-local, content-addressed store of the (read-only) GAMIT tables. The symlinks created by sh_links.tables
+    in the solution directory are replaced by hard links to a single copy of each table kept in the cache, so the
+    large tables (otl.grid, luntab, soltab, antmod.dat, etc.) are only transferred once per node. The source files
+    are identified by path, size and modification time, so the shared storage is only read when a table changes.
+    Entries are written to a temporary file and renamed into place, which makes the cache safe for concurrent jobs
+    running on the same node. Cached tables are read-only and an entry is discarded if its size or modification
+    time changed (written in place through one of the links). The least recently used tables are evicted when the
+    cache exceeds its disk budget.
+    """
+
+    def __init__(self, cache_pwd=TABLES_CACHE, max_size_gb=TABLES_CACHE_SIZE):
+        self.cache_pwd = cache_pwd
+        self.pwd_index = os.path.join(cache_pwd, 'index')
+        self.pwd_files = os.path.join(cache_pwd, 'files')
+        self.max_bytes = int(float(max_size_gb) * 1024 ** 3)
+
+        for path in (self.pwd_index, self.pwd_files):
+            os.makedirs(path, exist_ok=True)
+
+    def materialize(self, pwd_tables, exclude=()):
+        """
+        replace every symlink in pwd_tables (except the ones in exclude) with a hard link to the cached table.
+        Returns a tuple with the number of tables found in the cache and the number of tables added to it
+        """
+        hits   = 0
+        misses = 0
+        used   = set()
+
+        for name in sorted(os.listdir(pwd_tables)):
+            link = os.path.join(pwd_tables, name)
+
+            if name in exclude or not os.path.islink(link):
+                continue
+
+            target = os.path.realpath(link)
+            if not os.path.isfile(target):
+                # dangling link or directory: leave it as is
+                continue
+
+            os.remove(link)
+
+            # retry once in case the table was evicted by another job between get and link
+            for retry in (0, 1):
+                cached, hit = self.get(target)
+                try:
+                    os.link(cached, link)
+                    break
+                except FileNotFoundError:
+                    if retry:
+                        raise
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    # cache and session on different file systems (or no hard link support): fall back to a copy
+                    shutil.copyfile(cached, link)
+                    break
+
+            used.add(os.path.basename(cached))
+
+            hits   += hit
+            misses += not hit
+
+        self.evict(keep=used)
+
+        return hits, misses
+
+    def get(self, target):
+        """
+        return the path of the cached copy of target and True if it was already in the cache
+        """
+        st  = os.stat(target)
+        key = hashlib.sha1(('%s %i %i' % (target, st.st_size, st.st_mtime_ns)).encode()).hexdigest()
+
+        index_file = os.path.join(self.pwd_index, key)
+        try:
+            # digest of the content, size and modification time of the cached table
+            with open(index_file) as f:
+                digest, size, mtime = f.read().split()
+            cached = os.path.join(self.pwd_files, digest)
+            st     = os.stat(cached)
+            if st.st_size == int(size) and st.st_mtime_ns == int(mtime):
+                # the modification time of the index entries keeps track of the last access for the LRU
+                os.utime(index_file)
+                return cached, True
+            # the table was modified through one of its links: do not hand it to other sessions
+            file_try_remove(cached)
+        except (OSError, IOError, ValueError):
+            pass
+
+        # not in the cache (or entry removed): copy the table while computing its digest
+        digest = hashlib.sha1()
+        fd, tmp = self.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(target, 'rb') as src:
+                for chunk in iter(lambda: src.read(1 << 20), b''):
+                    digest.update(chunk)
+                    dst.write(chunk)
+
+            cached = os.path.join(self.pwd_files, digest.hexdigest())
+            # tables are shared by all sessions through hard links: never allow modifications
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            # if another job cached the same content in the meantime, the rename replaces an identical file
+            os.replace(tmp, cached)
+            st = os.stat(cached)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        fd, tmp = self.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('%s %i %i' % (digest.hexdigest(), st.st_size, st.st_mtime_ns))
+        os.replace(tmp, index_file)
+
+        return cached, False
+
+    def evict(self, keep=()):
+        """
+        remove the least recently used tables (except the ones in keep) and their index entries until the cache is
+        under its disk budget. Tables linked from session folders remain valid after eviction
+        """
+        # last access of each table: the most recent use through any of its index entries
+        last_use = {}
+        indices  = {}
+        for key in os.listdir(self.pwd_index):
+            index_file = os.path.join(self.pwd_index, key)
+            try:
+                with open(index_file) as f:
+                    digest = f.read().split()[0]
+                last_use[digest] = max(last_use.get(digest, 0.), os.stat(index_file).st_mtime)
+            except (OSError, IOError, IndexError):
+                # removed by another job
+                continue
+            indices.setdefault(digest, []).append(index_file)
+
+        entries = []
+        for digest in os.listdir(self.pwd_files):
+            try:
+                entries.append((last_use.get(digest, 0.), os.stat(os.path.join(self.pwd_files, digest)).st_size,
+                                digest))
+            except OSError:
+                pass
+
+        total = sum(e[1] for e in entries)
+        for _, size, digest in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if digest not in keep and file_try_remove(os.path.join(self.pwd_files, digest)):
+                total -= size
+                for index_file in indices.get(digest, []):
+                    file_try_remove(index_file)
+
+    def mkstemp(self):
+        return tempfile.mkstemp(dir=self.cache_pwd, prefix='.tmp_')
+
+
 class GamitTask(object):
 
     def __init__(self, remote_pwd, params, solution_pwd):
@@ -55,6 +222,8 @@ class GamitTask(object):
         self.stdout    = ''
         self.stderr    = ''
         self.p         = None
+        # thread warming the products cache with the next day (see fetch_orbits)
+        self.prefetch  = None
 
         # a dictionary to keep track of how many stations support each system
         self.system_count = {'E': 0, 'G': 0, 'R': 0, 'C': 0}
@@ -90,12 +259,10 @@ class GamitTask(object):
             # this flag is to inform to the error handler that file operations have been made: thus, errors can
             # be written to monitor.log
             copy_done = True
-            # create the run script
-            self.create_replace_links()
-            # run the script to replace the links of the tables directory
-            self.execute('find ./tables ! -name "otl.grid" -type l -exec ./replace_links.sh {} +',
-                         shell=True)
-            self.log('Pre-process tasks (symlink fix) finished with no errors')
+            # replace the links of the tables directory with hard links to the node-local tables cache
+            hits, misses = TablesCache().materialize(self.pwd_tables)
+            self.log(f'Pre-process tasks (symlink fix) finished with no errors: {hits} tables from node '
+                     f'cache, {misses} tables added to the cache')
 
             self.fetch_orbits()
 
@@ -174,6 +341,12 @@ class GamitTask(object):
             # return useful information to the main node (return list because now there is one result per system)
             return [results]
 
+        finally:
+            if self.prefetch is not None:
+                # the job process ends with the job: let the prefetch finish (it usually did while GAMIT ran)
+                # instead of leaving partial products in the cache
+                self.prefetch.join()
+
     def log(self, message, no_timestamp=False):
         if not no_timestamp:
             file_append(self.monitor_file, now_str() + ' -> ' + message + '\n')
@@ -256,8 +429,12 @@ class GamitTask(object):
     def fetch_orbits(self):
         self.log('fetching orbits')
 
+        # node-local products cache (None if not configured)
+        cache = pyProducts.ProductCache.from_options(self.options)
+
         try:
-            Sp3 = pyProducts.GetSp3Orbits(self.orbits['sp3_path'], self.date, self.orbits['sp3types'], self.pwd_igs, True)
+            Sp3 = pyProducts.GetSp3Orbits(self.orbits['sp3_path'], self.date, self.orbits['sp3types'], self.pwd_igs,
+                                          True, cache=cache)
 
             self.log(f'sp3 orbit found: {Sp3.sp3_filename} -> {Sp3.file_path}')
 
@@ -275,7 +452,8 @@ class GamitTask(object):
 
         self.log('fetching broadcast orbits')
 
-        brdc = pyProducts.GetBrdcOrbits(self.orbits['brdc_path'], self.date, self.pwd_brdc, no_cleanup=True)
+        brdc = pyProducts.GetBrdcOrbits(self.orbits['brdc_path'], self.date, self.pwd_brdc, no_cleanup=True,
+                                        cache=cache)
 
         self.log(f'broadcast orbit found: {brdc.brdc_filename}')
 
@@ -288,14 +466,24 @@ class GamitTask(object):
         if os.path.exists(ionex_path):
             # use short name when copying
             short_name = 'igsg%s0.%si.Z' % (self.date.ddd(), str(self.date.year)[2:4])
-            shutil.copyfile(ionex_path, os.path.join(self.pwd, 'ionex/' + short_name))
-            # uncompress the file
-            self.execute('gunzip -f ionex/' + short_name, shell=True)
+            if cache is not None:
+                # the cache returns the uncompressed file
+                cache.place(ionex_path, os.path.join(self.pwd, 'ionex/' + short_name[:-2]))
+            else:
+                shutil.copyfile(ionex_path, os.path.join(self.pwd, 'ionex/' + short_name))
+                # uncompress the file
+                self.execute('gunzip -f ionex/' + short_name, shell=True)
             self.log(f'Ionex file found: {ionex_path} -> {os.path.join(self.pwd, short_name)}')
         else:
             self.log(f'IONEX path {ionex_path} does not exist. This might stop GAMIT during processing if '
                      '"Apply 2nd/3rd order ionospheric terms" (Ion model) is set to GMAP.')
 
+        if cache is not None:
+            # sessions are submitted in date order: warm the cache with the next day while GAMIT runs. The thread is
+            # joined at the end of start
+            self.prefetch = cache.prefetch_async([self.date + 1], self.orbits['sp3_path'], self.orbits['sp3types'],
+                                                 self.orbits['brdc_path'])
+
     def fetch_rinex(self):
         for rinex in self.params['rinex']:
 
@@ -334,22 +522,24 @@ class GamitTask(object):
                         for Rnx in Rinex.multiday_rnx_list:
                             if Rnx.date == self.date:
                                 Rnx.rename(rinex['destiny'])
+                                # window, decimate and purge comments in a single pass
+                                transform = Rnx.transform()
 
                                 if rinex['jump'] is not None:
-                                    self.window_rinex(Rnx, rinex['jump'])
+                                    self.window_rinex(transform, rinex['jump'])
                                 # before creating local copy, decimate file
-                                Rnx.decimate(30)
-                                Rnx.purge_comments()
+                                transform.decimate(30).purge_comments().apply()
                                 Rnx.compress_local_copyto(self.pwd_rinex, rinex['destiny'])
                                 break
                     else:
                         Rinex.rename(rinex['destiny'])
+                        # window, decimate and purge comments in a single pass
+                        transform = Rinex.transform()
 
                         if rinex['jump'] is not None:
-                            self.window_rinex(Rinex, rinex['jump'])
+                            self.window_rinex(transform, rinex['jump'])
                         # before creating local copy, decimate file
-                        Rinex.decimate(30)
-                        Rinex.purge_comments()
+                        transform.decimate(30).purge_comments().apply()
                         Rinex.compress_local_copyto(self.pwd_rinex, rinex['destiny'])
 
             except (OSError, IOError):
@@ -362,7 +552,7 @@ class GamitTask(object):
 
     def window_rinex(self, Rinex, window):
 
-        # windows the data:
+        # windows the data (Rinex can be a ReadRinex or a RinexTransform object):
         # check which side of the earthquake yields more data: window before or after the earthquake
         dt = window.datetime()
         if (dt.hour + dt.minute/60.0) < 12:
@@ -448,38 +638,6 @@ class GamitTask(object):
 
             self.log(f'ERROR in pyGamitTask.finish()\n{msg}')
 
-    def create_replace_links(self):
-        replace_ln_file_path = os.path.join(self.pwd, 'replace_links.sh')
-
-        try:
-            replace_ln_file = file_open(replace_ln_file_path, 'w')
-        except (OSError, IOError):
-            raise Exception('could not open file ' + replace_ln_file_path)
-
-        replace_ln_file.write("""#!/bin/bash
-        set -e
-        for link; do
-            test -h "$link" || continue
-
-            dir=$(dirname "$link")
-            reltarget=$(readlink "$link")
-            case $reltarget in
-                /*) abstarget=$reltarget;;
-                *)  abstarget=$dir/$reltarget;;
-            esac
-
-            rm -fv "$link"
-            cp -afv "$abstarget" "$link" || {
-                # on failure, restore the symlink
-                rm -rfv "$link"
-                ln -sfv "$reltarget" "$link"
-            }
-        done
-        """)
-
-        replace_ln_file.close()
-        chmod_exec(replace_ln_file_path)
-
     def translate_station_alias(self, station_alias):
         if type(station_alias) is str:
             for rinex in self.params['rinex']:
@@ -7,10 +7,18 @@ This module handles the cluster nodes and checks all the necessary dependencies
 before sending jobs to each node
 """
 
+import os
 import time
 import _thread
+import io
+import itertools
+import contextlib
+import multiprocessing
+import platform
 import queue
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 # deps
 from tqdm import tqdm
@@ -220,9 +228,63 @@ def test_node(check_gamit_tables=None, check_archive=True, check_executables=Tru
     return ' -- %s: Test passed!' % platform.node()
 
 
-def setup(modules):
+# state kept by each worker process between jobs (see warm)
+worker_state = {}
+
+
+def warm(key, factory):
+    """
+    return the object stored in the worker state under key, creating it with factory the first time. Used by the jobs
+    to reuse expensive objects (configuration, database connection, parsed tables) instead of loading them every time
+    :param key: hashable key
+    :param factory: function without arguments that creates the object
+    """
+    if key not in worker_state:
+        worker_state[key] = factory()
+    return worker_state[key]
+
+
+def worker_config():
+    """
+    configuration (gnss_data.cfg) of this worker
+    """
+    from pgamit import pyOptions
+    return warm('config', lambda: pyOptions.ReadOptions('gnss_data.cfg'))
+
+
+def worker_cnn():
+    """
+    database connection of this worker process. Connections cannot be shared between processes: the key includes the
+    pid so that forked processes open their own. A connection closed by a previous job is reopened and a transaction
+    left open by a failed job is rolled back
+    """
+    from pgamit import dbConnection
+
+    key = ('cnn', os.getpid())
+    cnn = warm(key, lambda: dbConnection.Cnn('gnss_data.cfg'))
+
+    if cnn.cnn.closed:
+        worker_state.pop(key)
+        cnn = warm(key, lambda: dbConnection.Cnn('gnss_data.cfg'))
+    elif cnn.active_transaction:
+        cnn.rollback_transac()
+
+    return cnn
+
+
+def run_pool_function(name, args):
+    """
+    computation of the clusters created by JobServer.create_pool: execute the registered function name (sent to the
+    nodes as a dependency)
+    """
+    return globals()[name](*args)
+
+
+def setup(modules, warm_up=()):
     """
     function to import modules in the nodes
+    :param modules: list of modules to import
+    :param warm_up: names of the worker state to load before running any job (e.g. 'config' calls worker_config)
     :return: 0
     """
     print(' >> Initializing node...')
@@ -239,9 +301,85 @@ def setup(modules):
             globals()[module] = module_obj
             print(' >> Importing module %s' % module)
 
+    # DDG: load the worker state now so that the processes forked for each job inherit it
+    if warm_up:
+        from pgamit import pyJobServer as job_server
+        for name in warm_up:
+            print(' >> Warming up %s' % name)
+            getattr(job_server, 'worker_' + name)()
+
     return 0
 
 
+def setup_local(node_setup, args):
+    """
+    initializer of the workers of the local backend: run the setup function without flooding the console
+    (dispy nodes print to their own output)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        node_setup(*args)
+
+
+def run_local_job(function, args):
+    """
+    run a job in a worker of the local backend. Exceptions are returned as a string (the same way the serial runner
+    reports them) since not all the exceptions can be pickled
+    """
+    try:
+        return function(*args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+class LocalNode(object):
+    """
+    stand-in for dispy.DispyNode used by the local backend: the computer running the JobServer
+    """
+    def __init__(self, cpus):
+        self.name       = platform.node()
+        self.ip_addr    = '127.0.0.1'
+        self.avail_cpus = cpus
+
+
+class CostQueue:
+    """
+    Queue that releases the job with the largest expected cost first (longest-expected-first), so that long jobs
+    do not end up at the tail of the execution. The reordering is bounded: a job can be overtaken by at most window
+    jobs submitted after it; after that, it is released before any other job.
+    """
+
+    def __init__(self, window=20):
+        self.window = window
+        self.items  = []
+        self.seq    = itertools.count()
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, cost, item):
+        # [cost, submission order, times overtaken, item]
+        self.items.append([cost, next(self.seq), 0, item])
+
+    def pop(self):
+        """
+        :return: tuple with the cost and the item of the next job to execute
+        """
+        aged = [e for e in self.items if e[2] >= self.window]
+        if aged:
+            entry = min(aged, key=lambda e: e[1])
+        else:
+            # largest cost first, submission order breaks ties
+            entry = max(self.items, key=lambda e: (e[0], -e[1]))
+
+        self.items.remove(entry)
+
+        for e in self.items:
+            if e[1] < entry[1]:
+                e[2] += 1
+
+        return entry[0], entry[3]
+
+
 class JobServer:
 
     def check_cluster(self, status, node, job):
@@ -264,9 +402,12 @@ class JobServer:
             while job is None and (time.time() - start_t) < self.delay:
                 time.sleep(1)
 
-            self.result.append(job.result)
+            with self.cpus_changed:
+                self.result.append(job.result)
 
-            self.nodes.append(node)
+                self.nodes.append(node)
+                # wake up the discovery in __init__
+                self.cpus_changed.notify_all()
 
     def __init__(self, Config, check_gamit_tables=None, check_archive=True, check_executables=True, check_atx=True,
                  run_parallel=True, software_sync=()):
@@ -288,6 +429,9 @@ class JobServer:
         self.result       = []
         self.jobs         = []
         self.run_parallel = Config.run_parallel and run_parallel
+        # local backend: pool of processes in this computer instead of a dispy cluster
+        self.run_local    = Config.run_local and run_parallel
+        self.executor     = None
         self.delay        = Config.cluster_delay
         self.verbose      = False
         self.close        = False
@@ -304,6 +448,26 @@ class JobServer:
         self.on_nodes_changed = None
         self.job_runner_inbox = queue.PriorityQueue()
         self.node_cleanup = None
+        # notified when a job leaves the cluster or the nodes change (see wait_free_cpus)
+        self.cpus_changed = threading.Condition()
+        # locality-aware scheduling (see submit_async): nodes that received each affinity key, node assigned to each
+        # job, jobs running on each node and cache hit/miss statistics per node. Keys and statistics are kept across
+        # create_cluster calls since the node-local caches survive between clusters
+        self.affinity_nodes = {}
+        self.job_node       = {}
+        self.node_load      = {}
+        self.affinity_stats = {}
+        # jobs submitted with a cost wait here until there are idle CPUs (see submit)
+        self.cost_queue     = CostQueue()
+        # ids of the jobs whose callback has not been executed yet (see wait) and nodes initialized in the current
+        # cluster (see create_cluster)
+        self.pending_callbacks = set()
+        self.initialized       = set()
+        # startup times (in seconds) for node discovery and each cluster creation
+        self.startup_times     = {'discovery': 0., 'clusters': []}
+        # functions registered in the persistent pool (see create_pool) and worker state loaded during node setup
+        self.pool_functions    = {}
+        self.warm_up           = ()
 
         print(" ==== Starting JobServer(dispy) ====")
 
@@ -329,12 +493,24 @@ class JobServer:
                                                              if type(self.ip_address) is list or self.ip_address is None
                                                              else [self.ip_address])
 
+            start_t = time.time()
             # discover the available nodes
             self.cluster.discover_nodes(servers)
 
-            # wait for all nodes
-            tqdm.write(" >> Waiting %d seconds to discover all nodes... " % self.delay)
-            time.sleep(self.delay)
+            # wait for all the nodes in node_list to be tested (or all the nodes that answer within the cluster
+            # delay when no node_list was provided)
+            expected = None if servers == ['*'] else len(servers)
+            if expected is None:
+                tqdm.write(" >> Waiting %d seconds to discover all nodes... " % self.delay)
+            else:
+                tqdm.write(" >> Waiting for %d nodes (no more than %d seconds)... " % (expected, self.delay))
+
+            with self.cpus_changed:
+                self.cpus_changed.wait_for(lambda: expected is not None and len(self.result) >= expected,
+                                           timeout=self.delay)
+
+            self.startup_times['discovery'] = time.time() - start_t
+            tqdm.write(" >> %d nodes found in %.1f seconds" % (len(self.nodes), self.startup_times['discovery']))
 
             # if no nodes were found, stop
             if not len(self.nodes):
@@ -354,7 +530,11 @@ class JobServer:
 
             self.cluster.close()
         else:
-            print(' >> Parallel processing deactivated by user')
+            if self.run_local:
+                self.nodes = [LocalNode(Config.local_cpus)]
+                print(' >> Local parallel processing using %i CPUs' % Config.local_cpus)
+            else:
+                print(' >> Parallel processing deactivated by user')
             r = test_node(check_gamit_tables=check_gamit_tables, check_archive=check_archive,
                           check_executables=check_executables, check_atx=check_atx)
             if 'Test passed!' not in r:
@@ -365,28 +545,54 @@ class JobServer:
     def create_cluster(self, function, deps=(), callback=None, progress_bar=None, verbose=False, modules=(),
                        on_nodes_changed=None,
                        node_setup=None,
-                       node_cleanup=None
+                       node_cleanup=None,
+                       reorder_window=20
                        ):
 
-        self.jobs     = []
-        self.callback = callback
-        self.function = function
-        self.verbose  = verbose
-        self.close    = True
-        self.on_nodes_changed = on_nodes_changed
-        self.node_cleanup     = node_cleanup
-        
-        if not self.run_parallel:
+        if self.pool_functions:
+            if function.__name__ in self.pool_functions:
+                # the persistent pool can run this function: keep the nodes (and their state) and only start a new
+                # phase of jobs
+                self.start_phase(function, callback, progress_bar, verbose, on_nodes_changed, reorder_window)
+                return
+            # function not registered in the pool: replace the pool with a regular cluster
+            self.close_pool()
+
+        self.start_phase(function, callback, None, verbose, on_nodes_changed, reorder_window)
+        self.close        = True
+        self.node_cleanup = node_cleanup
+        self.initialized  = set()
+
+        if self.run_local:
+            # fork: the workers inherit the modules and the functions of the calling script
+            self.executor = ProcessPoolExecutor(self.total_cpus(),
+                                                mp_context =multiprocessing.get_context('fork'),
+                                                initializer=setup_local,
+                                                initargs   =(node_setup, ()) if node_setup
+                                                            else (setup, (modules, self.warm_up)))
+            if self.on_nodes_changed:
+                self.on_nodes_changed(self.nodes)
+
+        elif not self.run_parallel:
             if node_setup:
                 node_setup()
             _thread.start_new_thread(self._job_runner_thread, ())
         else:
+            start_t = time.time()
+            # nodes might be repeated if they were reinitialized
+            expected = {node.ip_addr for node in self.nodes}
+
             # DDG: NodeAllocate is used to pass the arguments to setup during node initialization
             self.cluster = dispy.JobCluster(function,
-                                            [dispy.NodeAllocate(node.ip_addr, setup_args=() if node_setup else (modules,))
+                                            [dispy.NodeAllocate(node.ip_addr,
+                                                                setup_args=() if node_setup
+                                                                           else (modules, self.warm_up))
                                              for node in self.nodes],
                                             list(deps),
-                                            callback,
+                                            # the callback of a pool changes with each phase (the pool functions
+                                            # are registered after the cluster is created)
+                                            self._dispy_callback if callback or function is run_pool_function
+                                            else None,
                                             self.cluster_status,
                                             pulse_interval=10,
                                             ping_interval =10,
@@ -405,20 +611,84 @@ class JobServer:
 
             self.http_server = dispy.httpd.DispyHTTPServer(self.cluster, poll_sec=2)
 
-            # wait for all nodes to be created
-            tqdm.write(" >> Waiting %d seconds to initialize all nodes... " % self.delay)
-            time.sleep(self.delay)
+            # wait for all nodes to be initialized (no more than the cluster delay)
+            tqdm.write(" >> Waiting for %d nodes to initialize (no more than %d seconds)... "
+                       % (len(expected), self.delay))
+            with self.cpus_changed:
+                self.cpus_changed.wait_for(lambda: expected <= self.initialized, timeout=self.delay)
+
+            self.startup_times['clusters'].append(time.time() - start_t)
+            tqdm.write(" >> %d of %d nodes initialized in %.1f seconds"
+                       % (len(expected & self.initialized), len(expected), self.startup_times['clusters'][-1]))
 
         self.progress_bar = progress_bar
 
-    def submit(self, *args):
+    def start_phase(self, function, callback, progress_bar, verbose, on_nodes_changed, reorder_window):
+        """
+        reset the state of the jobs before submitting a new batch to the cluster
         """
-        function to submit jobs to dispy. If run_parallel == False, the jobs are executed
+        with self.cpus_changed:
+            self.jobs         = []
+            self.callback     = callback
+            self.function     = function
+            self.verbose      = verbose
+            self.progress_bar = progress_bar
+            self.on_nodes_changed  = on_nodes_changed
+            self.job_node          = {}
+            self.node_load         = {}
+            self.cost_queue        = CostQueue(reorder_window)
+            self.pending_callbacks = set()
+
+    def create_pool(self, functions, deps=(), modules=(), warm_up=(), node_setup=None, node_cleanup=None,
+                    reorder_window=20):
+        """
+        create a cluster that stays alive across create_cluster calls for any of the registered functions, so that
+        scripts with several phases do not pay the node initialization (and the loading of the worker state) for
+        each phase. Call create_cluster with one of the functions to start a phase and close_pool when done
+        :param functions: list of functions that will be executed in the pool
+        :param deps: functions or classes needed by the registered functions
+        :param modules: union of the modules needed by the registered functions
+        :param warm_up: names of the worker state loaded during node setup, e.g. ('config',) (see worker_config).
+                        Other objects (e.g. parsed ATX or earthquake tables) can be kept using warm
+        """
+        self.close_pool()
+
+        self.warm_up = tuple(warm_up)
+        self.create_cluster(run_pool_function, tuple(functions) + tuple(deps),
+                            modules       =tuple(modules) + ('pgamit.pyJobServer',),
+                            node_setup    =node_setup,
+                            node_cleanup  =node_cleanup,
+                            reorder_window=reorder_window)
+        # register after creating the cluster: create_cluster replaces the pool if it is active
+        self.pool_functions = {function.__name__: function for function in functions}
+
+    def close_pool(self):
+        """
+        close the cluster created by create_pool
+        """
+        if self.pool_functions:
+            self.pool_functions = {}
+            self.warm_up        = ()
+            self.close_cluster()
+
+    def submit(self, *args, affinity=None, cost=None):
+        """
+        function to submit jobs to dispy (or to the local pool of processes). If run_parallel == False, the jobs are
+        executed
         :param args:
+        :param affinity: optional hashable key (e.g. the date) used to send the job to a node that already processed
+                         jobs with the same key (see select_node)
+        :param cost: optional expected cost (e.g. run time) of the job. Jobs with a cost are held in a queue and sent to
+                     the cluster when there are idle CPUs, largest cost first (see CostQueue and create_cluster's
+                     reorder_window). Ignored in serial mode
         :return:
         """
-        if self.run_parallel:
-            self.jobs.append(self.cluster.submit(*args))
+        if (self.run_parallel or self.run_local) and cost is not None:
+            with self.cpus_changed:
+                self.cost_queue.push(cost, (args, affinity))
+                self.dispatch()
+        elif self.run_parallel or self.run_local:
+            self._submit_job(args, affinity)
         # if no-parallel was invoked, execute the procedure manually and synchronously
         elif not self.callback:
             self.function(*args)
@@ -432,7 +702,7 @@ class JobServer:
                 job.exception = e
             self.callback(job)
 
-    def submit_async(self, *args):
+    def submit_async(self, *args, affinity=None):
         # If run_parallel == True, works the same as the submit() method
         # If run_parallel == False, then the job will be run asynchronously in a job_runner
         # thread.
@@ -440,15 +710,189 @@ class JobServer:
         # make sure no code depends on submit() synchronous behavior. So every job submitted
         # will run asynchronously no matter run_parallel value and no different running semantics
         # will be used.
-        if self.run_parallel:
-            job = self.cluster.submit(*args)
-            self.jobs.append(job)
+        if self.run_parallel or self.run_local:
+            job = self._submit_job(args, affinity)
         else:
             # dispy will a sign a job.id automatically
             job = dispy.DispyJob(None, args, ())
             self.job_runner_inbox.put((1, job, args))
         return job
 
+    def _submit_job(self, args, affinity):
+        """
+        send a job to the cluster or to the local pool and add it to the list of running jobs
+        """
+        # the lock makes sure the job is in the list before its completion is reported (see release_job)
+        with self.cpus_changed:
+            if self.run_local:
+                # dispy will a sign a job.id automatically
+                job = dispy.DispyJob(None, args, ())
+                job.ip_addr    = self.nodes[0].ip_addr
+                job.status     = dispy.DispyJob.Running
+                job.start_time = time.time()
+                self.jobs.append(job)
+
+                future = self.executor.submit(run_local_job, self.function, args)
+                # if the job already finished, the callback runs right here
+                future.add_done_callback(lambda f: self._local_job_done(job, f))
+            else:
+                job = self._submit_cluster(args, affinity)
+                if job is None:
+                    tqdm.write(' -- WARNING: dispy did not accept the job with arguments %s' % str(args))
+                    return None
+                self.jobs.append(job)
+                if self.callback:
+                    self.pending_callbacks.add(job.id)
+
+            return job
+
+    def _local_job_done(self, job, future):
+        """
+        called by the local pool when a job finishes: equivalent to dispy's callback and cluster_status
+        """
+        try:
+            job.result, job.exception = future.result()
+        except Exception:
+            # the worker died or the arguments/result could not be pickled
+            job.exception = traceback.format_exc()
+
+        job.status   = dispy.DispyJob.Finished if job.exception is None else dispy.DispyJob.Terminated
+        job.end_time = time.time()
+
+        if self.progress_bar is not None:
+            self.progress_bar.update()
+
+        try:
+            if self.callback:
+                self.callback(job)
+            elif job.exception is not None:
+                tqdm.write(' -- Job %04i has been terminated with the following exception: ' % job.id)
+                tqdm.write(str(job.exception))
+        except:
+            tqdm.write('WARNING: Exception running job callback: ' + traceback.format_exc())
+
+        self.release_job(job)
+
+    def _dispy_callback(self, job):
+        """
+        wrapper of the user's callback to keep track of the callbacks that have been executed (see wait)
+        """
+        try:
+            if self.callback:
+                self.callback(job)
+        finally:
+            if job.status in (dispy.DispyJob.Finished, dispy.DispyJob.Terminated, dispy.DispyJob.Cancelled):
+                with self.cpus_changed:
+                    self.pending_callbacks.discard(job.id)
+                    self.cpus_changed.notify_all()
+
+    def _submit_cluster(self, args, affinity):
+        if self.pool_functions:
+            # DDG: the pool runs run_pool_function, which calls the function of the current phase by name
+            args = (self.function.__name__, args)
+
+        if affinity is None:
+            # let dispy decide where the job goes (node is registered when the job starts running)
+            return self.cluster.submit(*args)
+
+        with self.cpus_changed:
+            node = self.select_node(affinity)
+
+            if node is None:
+                return self.cluster.submit(*args)
+
+            job = self.cluster.submit_node(node, *args)
+            if job is None:
+                # the node might have gone away: let dispy decide where the job goes
+                return self.cluster.submit(*args)
+
+            self.job_node[job.id] = node.ip_addr
+            self.node_load[node.ip_addr] = self.node_load.get(node.ip_addr, 0) + 1
+
+            return job
+
+    def dispatch(self, flush=False):
+        """
+        send the jobs waiting in the cost queue to the cluster while there are idle CPUs
+        :param flush: send all the jobs, regardless of the number of idle CPUs
+        """
+        with self.cpus_changed:
+            while len(self.cost_queue) and (flush or len(self.jobs) < self.total_cpus()):
+                _, (args, affinity) = self.cost_queue.pop()
+                self._submit_job(args, affinity)
+
+    def select_node(self, affinity):
+        """
+        select the node for a job with the given affinity key: among the nodes with free CPUs, prefer the least
+        loaded node that already received jobs with the same key (hit); otherwise, use the least loaded node (miss).
+        When the whole cluster is busy, the job is queued in the least loaded node that has seen the key (if any).
+        Updates the per-node statistics (see affinity_report)
+        :param affinity: hashable key, for example a pyDate.Date
+        :return: the selected dispy node or None if no nodes are available
+        """
+        # nodes might be repeated if they were reinitialized
+        nodes = list({node.ip_addr: node for node in self.nodes}.values())
+        if not nodes:
+            return None
+
+        def load(node):
+            return self.node_load.get(node.ip_addr, 0) / float(max(node.avail_cpus, 1))
+
+        seen = self.affinity_nodes.setdefault(affinity, set())
+        free = [node for node in nodes if self.node_load.get(node.ip_addr, 0) < node.avail_cpus]
+
+        candidates = [node for node in (free if free else nodes) if node.ip_addr in seen]
+        if candidates:
+            node = min(candidates, key=load)
+        else:
+            node = min(free if free else nodes, key=load)
+
+        stats = self.affinity_stats.setdefault(node.ip_addr, {'name': node.name, 'hits': 0, 'misses': 0})
+        if node.ip_addr in seen:
+            stats['hits'] += 1
+        else:
+            stats['misses'] += 1
+            seen.add(node.ip_addr)
+
+        return node
+
+    def affinity_report(self):
+        """
+        :return: string with the affinity hits (jobs sent to a node that already processed the same key) and misses
+        per node
+        """
+        lines = []
+        for ip, stats in sorted(self.affinity_stats.items(), key=lambda x: x[1]['name']):
+            total = stats['hits'] + stats['misses']
+            lines.append(' -- %-20s %-15s hits: %6i misses: %6i (hit rate %5.1f%%)'
+                         % (stats['name'], ip, stats['hits'], stats['misses'],
+                            100. * stats['hits'] / total if total else 0))
+        return '\n'.join(lines)
+
+    def total_cpus(self):
+        """
+        number of CPUs available in the cluster or the local pool (1 if running in serial mode)
+        """
+        if self.run_parallel or self.run_local:
+            # nodes might be repeated if they were reinitialized
+            return sum({node.ip_addr: node.avail_cpus for node in self.nodes}.values())
+        else:
+            return 1
+
+    def wait_free_cpus(self, overcommit=0):
+        """
+        block until the number of submitted jobs that did not finish is below the number of CPUs in the cluster
+        (plus overcommit, to keep the nodes busy while the next job is being sent). Used by callers that prepare their
+        jobs on the fly to apply back-pressure instead of queueing everything at once. Jobs waiting in the cost queue
+        count as submitted. In serial mode submit runs the job synchronously, so there is nothing to wait for
+        :param overcommit: number of jobs that can be queued above the number of CPUs. When submitting with costs, use
+        the reorder window so that there are enough jobs in the queue to choose from
+        """
+        if self.run_parallel or self.run_local:
+            with self.cpus_changed:
+                while len(self.jobs) + len(self.cost_queue) >= self.total_cpus() + overcommit:
+                    self.cpus_changed.wait()
+
     def _job_runner_thread(self):
         while True:
             (prio, job, args) = self.job_runner_inbox.get()
@@ -473,11 +917,23 @@ class JobServer:
         :return: none
         """
         if self.run_parallel:
-            tqdm.write(' -- Waiting for jobs to finish (no less than %d seconds)...' % self.delay)
+            tqdm.write(' -- Waiting for jobs to finish...')
             try:
+                # release the jobs still waiting in the cost queue as CPUs become idle
+                with self.cpus_changed:
+                    while len(self.cost_queue):
+                        self.dispatch()
+                        if len(self.cost_queue):
+                            self.cpus_changed.wait()
+
                 self.cluster.wait()
-                # let the process trigger cluster_status before letting the calling proc close the progress bar
-                time.sleep(self.delay)
+                # the status notifications and callbacks run in a dispy thread: wait until all of them have been
+                # processed before letting the calling proc close the progress bar (the delay is just a safeguard)
+                with self.cpus_changed:
+                    if not self.cpus_changed.wait_for(lambda: not self.jobs and not self.pending_callbacks,
+                                                      timeout=self.delay):
+                        tqdm.write(' -- %d job notifications and %d callbacks not received after %d seconds'
+                                   % (len(self.jobs), len(self.pending_callbacks), self.delay))
             except KeyboardInterrupt:
                 for job in self.jobs:
                     if job.status in (dispy.DispyJob.Running,
@@ -485,9 +941,30 @@ class JobServer:
                         self.cluster.cancel(job)
                 self.cluster.shutdown()
 
+        elif self.run_local:
+            try:
+                # the jobs leave the list after their callback is executed (see _local_job_done)
+                with self.cpus_changed:
+                    while len(self.cost_queue) or len(self.jobs):
+                        self.dispatch()
+                        if len(self.jobs):
+                            self.cpus_changed.wait()
+            except KeyboardInterrupt:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+
     def close_cluster(self):
-        if self.run_parallel and self.close:
+        if self.pool_functions:
+            # end of a phase: the pool stays alive until close_pool is called
+            self.callback     = None
+            self.progress_bar = None
+
+        elif self.run_local and self.close:
+            self.cleanup()
+
+        elif self.run_parallel and self.close:
             tqdm.write('')
+            if self.affinity_stats:
+                tqdm.write(' >> Job affinity statistics per node:\n' + self.affinity_report())
             self.http_server.shutdown()
             self.cleanup()
 
@@ -508,6 +985,7 @@ class JobServer:
                 # test node to make sure everything works
                 self.cluster.send_file('gnss_data.cfg', node)
                 self.nodes.append(node)
+                self.initialized.add(node.ip_addr)
                 if self.on_nodes_changed:
                     self.on_nodes_changed(self.nodes)
 
@@ -515,6 +993,11 @@ class JobServer:
                 self.nodes.remove(node)
                 if self.on_nodes_changed:
                     self.on_nodes_changed(self.nodes)
+
+            with self.cpus_changed:
+                # a new node might have idle CPUs for the jobs in the cost queue
+                self.dispatch()
+                self.cpus_changed.notify_all()
         else:
             # Job status change
             if J.Finished == s:
@@ -533,6 +1016,13 @@ class JobServer:
                 if self.verbose:
                     tqdm.write(' -- Job %i has been created' % job.id)
 
+            elif J.Running == s:
+                with self.cpus_changed:
+                    if job.id not in self.job_node and node is not None:
+                        # job placed by dispy: account for it in the node load used by select_node
+                        self.job_node[job.id] = node.ip_addr
+                        self.node_load[node.ip_addr] = self.node_load.get(node.ip_addr, 0) + 1
+
             elif J.Terminated == s:
                 tqdm.write(' -- Job %04i has been terminated with the following exception: ' % job.id)
                 tqdm.write(str(job.exception))
@@ -546,13 +1036,34 @@ class JobServer:
                 self.progress_bar.update()
                 
             if s in (J.Finished, J.Abandoned, J.Terminated, J.Cancelled):
-                try:
-                    self.jobs.remove(job)
-                except:
-                    pass
+                self.release_job(job)
+
+    def release_job(self, job):
+        """
+        remove a job that left the cluster from the list of submitted jobs and send the next job of the cost queue
+        """
+        with self.cpus_changed:
+            # DDG: dispy reports copies of the job objects in cluster_status, find the job by id
+            for i, j in enumerate(self.jobs):
+                if j is not None and j.id == job.id:
+                    del self.jobs[i]
+                    break
+
+            ip = self.job_node.pop(job.id, None)
+            if ip is not None:
+                self.node_load[ip] -= 1
+
+            # a CPU was released: send the next job waiting in the cost queue
+            self.dispatch()
+            self.cpus_changed.notify_all()
 
     def cleanup(self):
-        if not self.run_parallel:
+        if self.run_local:
+            if self.close:
+                self.executor.shutdown()
+                self.close = False
+
+        elif not self.run_parallel:
             if self.node_cleanup:
                 self.node_cleanup()
             self.job_runner_inbox.put((0, 'CLOSE', None))
@@ -73,33 +73,75 @@ class OceanLoading():
         if not self.z:
             self.z = z
 
-        out, err = pyRunWithRetry.RunCommand(self.grdtab +
-                                             ' ' + str(self.x) + ' ' + str(self.y) +
-                                             ' ' + str(self.z) + ' ' + self.StationCode,
-                                             5,
-                                             self.rootdir).run_shell()
-        if err:
-            raise pyOTLException('grdtab returned an error: ' + err)
+        return self.run_grdtab(self.StationCode, self.x, self.y, self.z)
 
+    def run_grdtab(self, StationCode, x, y, z):
+        """
+        run grdtab for a station and return the HARPOS coefficients. The files of the station are removed so that
+        the same instance (folder and grid link) can be reused for other stations (see calculate_otl_coeffs)
+        """
         fatal_path  = os.path.join(self.rootdir, 'GAMIT.fatal')
-        harpos_path = os.path.join(self.rootdir, 'harpos.' + self.StationCode)
+        harpos_path = os.path.join(self.rootdir, 'harpos.' + StationCode)
 
-        if os.path.isfile(fatal_path) and not os.path.isfile(harpos_path):
-            raise pyOTLException('grdtab returned an error:\n' + file_read_all(fatal_path))
-
-        # open otl file
-        return file_read_all(harpos_path)
+        try:
+            out, err = pyRunWithRetry.RunCommand(self.grdtab +
+                                                 ' ' + str(x) + ' ' + str(y) +
+                                                 ' ' + str(z) + ' ' + StationCode,
+                                                 5,
+                                                 self.rootdir).run_shell()
+            if err:
+                raise pyOTLException('grdtab returned an error: ' + err)
+
+            if os.path.isfile(fatal_path) and not os.path.isfile(harpos_path):
+                raise pyOTLException('grdtab returned an error:\n' + file_read_all(fatal_path))
+
+            # open otl file
+            return file_read_all(harpos_path)
+
+        finally:
+            for f in ('GAMIT.status',
+                      'GAMIT.fatal',
+                      'grdtab.out',
+                      'harpos.' + StationCode,
+                      'ufile.' + StationCode):
+                f = os.path.join(self.rootdir, f)
+                if os.path.isfile(f):
+                    os.remove(f)
 
     def __del__(self):
-        for f in ('GAMIT.status',
-                  'GAMIT.fatal',
-                  'grdtab.out',
-                  'harpos.' + self.StationCode,
-                  'otl.grid',
-                  'ufile.' + self.StationCode):
-            f = os.path.join(self.rootdir, f)
-            if os.path.isfile(f):
-                os.remove(f)
+        otl_grid = os.path.join(self.rootdir, 'otl.grid')
+        if os.path.islink(otl_grid):
+            os.remove(otl_grid)
 
         if os.path.isdir(self.rootdir):
             os.rmdir(self.rootdir)
+
+
+def calculate_otl_coeffs(stations, grdtab, otlgrid):
+    """
+    compute the OTL coefficients of several stations using a single production folder and grid link
+    :param stations: list of dictionaries with NetworkCode, StationCode, auto_x, auto_y and auto_z
+    :return: list of dictionaries with NetworkCode, StationCode and Harpos_coeff_otl (ready for Cnn.update_many) and
+             a list of error messages of the stations that failed
+    """
+    coefficients = []
+    errors       = []
+
+    if not stations:
+        return coefficients, errors
+
+    otl = OceanLoading(stations[0]['StationCode'], grdtab, otlgrid)
+
+    for stn in stations:
+        try:
+            coefficients.append({'NetworkCode'     : stn['NetworkCode'],
+                                 'StationCode'     : stn['StationCode'],
+                                 'Harpos_coeff_otl': otl.run_grdtab(stn['StationCode'],
+                                                                    stn['auto_x'],
+                                                                    stn['auto_y'],
+                                                                    stn['auto_z'])})
+        except (pyOTLException, pyRunWithRetry.RunCommandWithRetryExeception, IOError) as e:
+            errors.append('Error while calculating OTL for %s.%s: %s' % (stn['NetworkCode'], stn['StationCode'],
+                                                                         str(e)))
+
+    return coefficients, errors
@@ -24,11 +24,16 @@ class ReadOptions:
                         'format_scripts_path'  : '/tmp', 
                         'parallel'             : False,
                         'cluster_delay'        : 90,
+                        'local_cpus'           : None,
                         'cups'                 : None,
                         'node_list'            : None,
                         'ip_address'           : None,
                         'brdc'                 : None,
                         'ionex'                : None,
+                        'products_cache'       : None,
+                        'products_cache_size'  : 20,
+                        'listings_cache'       : None,
+                        'listings_ttl'         : 6,
                         'sp3_ac'               : ['IGS', 'JPL'],
                         'sp3_cs'               : ['R03', 'R02', 'OPS'],
                         'sp3_st'               : ['FIN', 'RAP'],
@@ -118,5 +123,8 @@ class ReadOptions:
                 self.sp3types.append(ac[0:2].lower() + ll + '{WWWWD}')
 
         self.run_parallel = (self.options['parallel'] == 'True')
+        # parallel = local: use a pool of processes in this computer instead of a dispy cluster
+        self.run_local    = (str(self.options['parallel']).lower() == 'local')
+        self.local_cpus   = int(self.options['local_cpus']) if self.options['local_cpus'] else os.cpu_count()
         self.cluster_delay = int(self.options['cluster_delay'])
 
@@ -9,13 +9,23 @@ PPPSpatialCheck
 
 """
 from shutil import copyfile, rmtree
-from math import isnan
+from math import isnan, radians, sin, cos, asin, sqrt
+from collections import namedtuple
+import heapq
 import os
+import json
+import fcntl
+import time
 import uuid
 import re
 
 # deps
 import numpy
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # pure-Python fallback (see KDTree)
+    cKDTree = None
 
 # app
 from pgamit import pyRinex
@@ -23,11 +33,22 @@ from pgamit import pyProducts
 from pgamit import pyEvents
 from pgamit import pyRunWithRetry
 from pgamit.pyDate import Date
-from pgamit.Utils import lg2ct, ecef2lla, determine_frame, file_write, file_readlines
+from pgamit.Utils import lg2ct, ecef2lla, determine_frame, file_write, file_readlines, crc32
 
 OBSERV_CODE_ONLY  = '1'
 OBSERV_CODE_PHASE = '2'
 
+# radius of the sphere used to compute the distance between stations (same as the original SQL queries)
+EARTH_RADIUS = 6371000.
+# default search radius (in meters) of the stations without max_dist
+DEFAULT_MAX_DIST = 20.
+# DDG: seconds after which the station index is rebuilt even if no changes were detected in the stations table
+STATION_INDEX_TTL = 60
+# folder (inside production/ppp) where the per-day workspaces are staged
+PPP_WORKSPACES = 'days'
+# DDG: number of idle per-day workspaces kept in each node so that later runs of the same days can reuse them
+PPP_WORKSPACES_KEPT = 2
+
 
 def find_between(s, first, last):
     try:
@@ -54,6 +75,213 @@ class pyRunPPPExceptionZeroProcEpochs   (pyRunPPPException): pass
 class pyRunPPPExceptionEOPError         (pyRunPPPException): pass
 
 
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    great circle distance in meters between two points given in degrees
+    """
+    return 2 * asin(sqrt(sin((radians(lat1) - radians(lat2)) / 2) ** 2 + cos(radians(lat2)) *
+                         cos(radians(lat1)) * sin((radians(lon1) - radians(lon2)) / 2) ** 2)) * EARTH_RADIUS
+
+
+def sphere_xyz(lat, lon):
+    """
+    cartesian coordinates of a point on the sphere of radius EARTH_RADIUS. The chord between two points grows
+    monotonically with the haversine distance, so the nearest points in this space are the nearest on the sphere
+    """
+    lat = radians(lat)
+    lon = radians(lon)
+    return (EARTH_RADIUS * cos(lat) * cos(lon),
+            EARTH_RADIUS * cos(lat) * sin(lon),
+            EARTH_RADIUS * sin(lat))
+
+
+def chord(distance):
+    """
+    length of the chord for a great circle distance in meters
+    """
+    return 2 * EARTH_RADIUS * sin(min(distance / (2 * EARTH_RADIUS), numpy.pi / 2))
+
+
+class KDTree:
+    """
+    pure-Python kd-tree used when scipy is not available. Implements the subset of scipy.spatial.cKDTree used by
+    StationIndex
+    """
+
+    def __init__(self, points):
+        self.points = [tuple(p) for p in points]
+        self.root   = self.build(list(range(len(self.points))), 0)
+
+    def build(self, indices, depth):
+        if not indices:
+            return None
+
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        median = len(indices) // 2
+
+        # node: (axis, index of the point, left branch, right branch)
+        return (axis, indices[median],
+                self.build(indices[:median], depth + 1),
+                self.build(indices[median + 1:], depth + 1))
+
+    def distance(self, x, i):
+        return sqrt(sum((a - b) ** 2 for a, b in zip(x, self.points[i])))
+
+    def query_ball_point(self, x, r):
+        """
+        :return: indices of the points within r of x
+        """
+        result = []
+        stack  = [self.root]
+
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+
+            axis, i, left, right = node
+            if self.distance(x, i) <= r:
+                result.append(i)
+
+            delta = x[axis] - self.points[i][axis]
+            if delta <= r:
+                stack.append(left)
+            if delta >= -r:
+                stack.append(right)
+
+        return result
+
+    def query(self, x, k):
+        """
+        :return: distances and indices of the k points closest to x, closest first
+        """
+        # max-heap (negative distances) with the best k points found so far
+        best = []
+
+        def search(node):
+            if node is None:
+                return
+
+            axis, i, left, right = node
+            d = self.distance(x, i)
+            if len(best) < k:
+                heapq.heappush(best, (-d, i))
+            elif d < -best[0][0]:
+                heapq.heapreplace(best, (-d, i))
+
+            delta = x[axis] - self.points[i][axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            search(near)
+            # only visit the other side if it can contain a closer point
+            if len(best) < k or abs(delta) < -best[0][0]:
+                search(far)
+
+        search(self.root)
+        best = sorted((-d, i) for d, i in best)
+
+        return [d for d, _ in best], [i for _, i in best]
+
+
+class StationIndex:
+    """
+    in-memory spatial index of the coordinates in the stations table. Answers the queries of
+    PPPSpatialCheck.verify_spatial_coherence (stations within their max_dist and nearest stations) in logarithmic time
+    instead of computing the distance to every station in the database. Use StationIndex.get to obtain an index that
+    is rebuilt when the stations table changes
+    """
+    # indices of this process by database and search_in_new: [index, signature of the table, time of creation]
+    indices = {}
+
+    def __init__(self, stations):
+        # stations without coordinates are never matched (their distance is null in SQL)
+        self.stations = [stn for stn in stations if stn['lat'] is not None and stn['lon'] is not None]
+        self.max_dist = max([self.radius(stn) for stn in self.stations] + [DEFAULT_MAX_DIST])
+
+        points = [sphere_xyz(stn['lat'], stn['lon']) for stn in self.stations]
+
+        if not points:
+            self.tree = None
+        elif cKDTree is not None:
+            self.tree = cKDTree(numpy.array(points))
+        else:
+            self.tree = KDTree(points)
+
+    @staticmethod
+    def radius(stn):
+        return stn['max_dist'] if stn['max_dist'] is not None else DEFAULT_MAX_DIST
+
+    @staticmethod
+    def signature(cnn):
+        """
+        number of changes to the stations table reported by the statistics collector (None if not available)
+        """
+        try:
+            rs = cnn.query('SELECT n_tup_ins + n_tup_upd + n_tup_del AS changes FROM pg_stat_user_tables '
+                           'WHERE relname = \'stations\'').dictresult()
+            return rs[0]['changes'] if rs else None
+        except Exception:
+            return None
+
+    @classmethod
+    def get(cls, cnn, search_in_new=False):
+        """
+        index of the stations in the database of cnn. The index is kept by the process and rebuilt when the number
+        of changes to the stations table differs from the one at creation time or after STATION_INDEX_TTL seconds
+        (the statistics collector reports the changes of other sessions with a small delay)
+        :param cnn: connection to the database
+        :param search_in_new: include the stations in the ??? networks
+        """
+        key       = (cnn.options.get('hostname'), cnn.options.get('database'), search_in_new)
+        signature = cls.signature(cnn)
+        entry     = cls.indices.get(key)
+
+        if entry is None or entry[1] != signature or time.time() - entry[2] > STATION_INDEX_TTL:
+            where_clause = '' if search_in_new else 'WHERE "NetworkCode" not like \'?%\''
+            stations     = cnn.query('SELECT * FROM stations %s' % where_clause).dictresult()
+            entry        = cls.indices[key] = [cls(stations), signature, time.time()]
+
+        return entry[0]
+
+    @classmethod
+    def invalidate(cls):
+        """
+        discard the indices of this process (e.g. after modifying the coordinates of a station)
+        """
+        cls.indices.clear()
+
+    def result(self, i, lat, lon):
+        stn = dict(self.stations[i])
+        stn['distance'] = haversine(lat, lon, stn['lat'], stn['lon'])
+        return stn
+
+    def within_max_dist(self, lat, lon):
+        """
+        :return: list of stations closer to (lat, lon) than their max_dist (20 m if null), closest first
+        """
+        if self.tree is None:
+            return []
+
+        # DDG: 1 mm of slack to avoid missing stations at the edge of the radius due to round off
+        candidates = self.tree.query_ball_point(sphere_xyz(lat, lon), chord(self.max_dist) + 1e-3)
+        match      = [self.result(i, lat, lon) for i in candidates]
+
+        return sorted([stn for stn in match if stn['distance'] < self.radius(stn)], key=lambda stn: stn['distance'])
+
+    def nearest(self, lat, lon, n=1):
+        """
+        :return: list with the n stations closest to (lat, lon), closest first
+        """
+        if self.tree is None or n < 1:
+            return []
+
+        n = min(n, len(self.stations))
+        _, indices = self.tree.query(sphere_xyz(lat, lon), k=n)
+
+        return sorted([self.result(i, lat, lon) for i in numpy.atleast_1d(indices)],
+                      key=lambda stn: stn['distance'])
+
+
 class PPPSpatialCheck:
 
     def __init__(self, lat=None, lon=None, h=None, epoch=None):
@@ -62,7 +290,7 @@ class PPPSpatialCheck:
         self.h     = h
         self.epoch = epoch
 
-    def verify_spatial_coherence(self, cnn, StationCode, search_in_new=False):
+    def verify_spatial_coherence(self, cnn, StationCode, search_in_new=False, n_closest=10):
         # checks the spatial coherence of the resulting coordinate
         # will not make any decisions, just output the candidates
         # if ambiguities are found, the rinex StationCode is used to solve them
@@ -72,51 +300,21 @@ class PPPSpatialCheck:
         # the logic is as follows:
         # 1) if etm data is available, then use it to bring the coordinate to self.epoch
         # 2) if no etm parameters are available, default to the coordinate reported in the stations table
+        # DDG: the distances used to be computed in SQL for every station in the table (twice if there was no match).
+        # Now the queries go through the spatial index of the stations (see StationIndex). n_closest is the number of
+        # stations returned (closest first) when there is no match. Stations in the ??? networks are not returned
+        # unless search_in_new == True
 
-        if not search_in_new:
-            where_clause = 'WHERE "NetworkCode" not like \'?%%\''
-        else:
-            where_clause = ''
-
-        # start by reducing the number of stations filtering everything beyond 100 km from the point of interest
-        # rs = cnn.query("""
-        #     SELECT * FROM
-        #     (SELECT *, 2*asin(sqrt(sin((radians(%.8f)-radians(lat))/2)^2 + cos(radians(lat)) * cos(radians(%.8f)) *
-        #     sin((radians(%.8f)-radians(lon))/2)^2))*6371000 AS distance
-        #     FROM stations %s) as DD
-        #     WHERE distance <= %f
-        #     """ % (self.lat[0], self.lat[0], self.lon[0], where_clause, 1e3))  # DO NOT RETURN RESULTS
-        #     WITH NetworkCode = '?%'
-
-        rs = cnn.query("""
-            SELECT st1."NetworkCode", st1."StationCode", st1."StationName", st1."DateStart", st1."DateEnd",
-             st1."auto_x", st1."auto_y", st1."auto_z", st1."Harpos_coeff_otl", st1."lat", st1."lon", st1."height",
-             st1."max_dist", st1."dome", st1.distance FROM
-            (SELECT *, 2*asin(sqrt(sin((radians(%.8f)-radians(lat))/2)^2 + cos(radians(lat)) * 
-            cos(radians(%.8f)) * sin((radians(%.8f)-radians(lon))/2)^2))*6371000 AS distance
-            FROM stations %s) as st1 left join stations as st2 ON 
-                st1."StationCode" = st2."StationCode" and
-                st1."NetworkCode" = st2."NetworkCode" and
-                st1.distance < coalesce(st2.max_dist, 20)
-                WHERE st2."NetworkCode" is not NULL
-            """ % (self.lat[0], self.lat[0], self.lon[0], where_clause))  # DO NOT RETURN RESULTS NetworkCode = '?%'
-
-        stn_match = rs.dictresult()
+        index = StationIndex.get(cnn, search_in_new)
+
+        # stations closer than their max_dist (20 m if not set)
+        stn_match = index.within_max_dist(self.lat[0], self.lon[0])
 
         # using the list of coordinates, check if StationCode exists in the list
         if len(stn_match) == 0:
             # no match, find closest station
             # get the closest station and distance in km to help the caller function
-            rs = cnn.query("""
-                SELECT * FROM
-                    (SELECT *, 2*asin(sqrt(sin((radians(%.8f)-radians(lat))/2)^2 + cos(radians(lat)) * 
-                    cos(radians(%.8f)) * sin((radians(%.8f)-radians(lon))/2)^2))*6371000 AS distance
-                        FROM stations %s) as DD ORDER BY distance
-                """ % (self.lat[0], self.lat[0], self.lon[0], where_clause))
-
-            stn = rs.dictresult()
-
-            return False, [], stn
+            return False, [], index.nearest(self.lat[0], self.lon[0], n_closest)
 
         elif len(stn_match) == 1:
             if stn_match[0]['StationCode'] == StationCode:
@@ -141,6 +339,112 @@ class PPPSpatialCheck:
                 return False, stn_match, []
 
 
+# description of the products staged in a PPPWorkspace (same attributes used from the pyProducts objects)
+StagedProduct = namedtuple('StagedProduct', ('filename', 'archive_filename', 'type', 'hash'))
+
+
+class PPPWorkspace:
+    """
+    Per-node, per-day PPP workspace. The inputs that do not depend on the station (orbits, clocks, EOP, ATX and the
+    static PPP files) are staged once for each day and orbit type and shared by all the runs of the node through
+    symbolic links. Each run registers a reference (named after its pid) while using the workspace. When a run
+    releases its reference, the workspaces without live references are removed, except for the most recently used
+    ones (see PPP_WORKSPACES_KEPT)
+    """
+
+    def __init__(self, options, date, orbit_type, observations, atx, apply_met,
+                 root=os.path.join('production', 'ppp', PPP_WORKSPACES)):
+
+        self.root = root
+        key = crc32(repr((tuple(orbit_type), observations, atx, apply_met, options['ppp_path'])))
+
+        self.path     = os.path.join(root, '%s_%08x' % (date.yyyyddd(space=False), key & 0xffffffff))
+        self.ref      = None
+        self.products = None
+
+    @staticmethod
+    def lock(path):
+        lock = open(path, 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    @staticmethod
+    def alive(ref):
+        try:
+            os.kill(int(ref.split('_')[0]), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, ValueError):
+            pass
+        return True
+
+    def acquire(self, stage):
+        """
+        register a reference to the workspace and return the description of the products. stage(path) is called only
+        by the first run of the node: it should put the products in path and return their description (a dictionary
+        that can be saved as json)
+        """
+        os.makedirs(self.root, exist_ok=True)
+
+        # the reference is created under the lock of the root folder to prevent a release from removing the workspace
+        with self.lock(os.path.join(self.root, '.lock')):
+            os.makedirs(os.path.join(self.path, 'refs'), exist_ok=True)
+            self.ref = os.path.join(self.path, 'refs', '%i_%s' % (os.getpid(), uuid.uuid4()))
+            open(self.ref, 'w').close()
+            # the modification time of the workspaces is used to decide which ones to keep
+            os.utime(self.path)
+
+        description = os.path.join(self.path, 'products.json')
+        try:
+            if not os.path.isfile(description):
+                with self.lock(os.path.join(self.path, '.lock')):
+                    # another run might have staged the products while waiting for the lock
+                    if not os.path.isfile(description):
+                        products = stage(self.path)
+                        file_write(description + '.tmp', json.dumps(products))
+                        os.replace(description + '.tmp', description)
+
+            with open(description) as f:
+                self.products = json.load(f)
+        except Exception:
+            self.release()
+            raise
+
+        return self.products
+
+    def release(self):
+        """
+        remove the reference of this run and the workspaces that are no longer in use
+        """
+        if self.ref is None:
+            return
+
+        with self.lock(os.path.join(self.root, '.lock')):
+            if os.path.isfile(self.ref):
+                os.remove(self.ref)
+            self.ref = None
+
+            idle = []
+            for workspace in os.listdir(self.root):
+                refs = os.path.join(self.root, workspace, 'refs')
+                if not os.path.isdir(refs):
+                    continue
+
+                live = False
+                for ref in os.listdir(refs):
+                    if self.alive(ref):
+                        live = True
+                    else:
+                        # the run died without releasing the workspace
+                        os.remove(os.path.join(refs, ref))
+
+                if not live:
+                    idle.append((os.path.getmtime(os.path.join(self.root, workspace)), workspace))
+
+            for _, workspace in sorted(idle, reverse=True)[PPP_WORKSPACES_KEPT:]:
+                rmtree(os.path.join(self.root, workspace), ignore_errors=True)
+
+
 class RunPPP(PPPSpatialCheck):
     def __init__(self, in_rinex, otl_coeff, options, sp3types, sp3altrn, antenna_height, strict=True, apply_met=True,
                  kinematic=False, clock_interpolation=False, hash=0, erase=True, decimate=True, solve_coordinates=True,
@@ -151,6 +455,8 @@ class RunPPP(PPPSpatialCheck):
         # pyRinex call below fails
         # generate a unique id for this instance
         self.rootdir = os.path.join(os.path.join('production', 'ppp'), str(uuid.uuid4()))
+        # DDG: per-day workspace with the products shared with other runs (only used if the folders are erased)
+        self.workspace = None
 
         self.antH      = antenna_height
         self.ppp_path  = options['ppp_path']
@@ -217,15 +523,14 @@ class RunPPP(PPPSpatialCheck):
 
         assert isinstance(in_rinex, pyRinex.ReadRinex)
 
+        # DDG: all changes to the RINEX (conversion and decimation) are applied in a single pass when making the
+        # local copy, leaving the original file untouched
+        rinexobj  = in_rinex
+        transform = rinexobj.transform()
+
         # DDG: if RINEX 3 version, convert to RINEX 2 (no PPP support)
         if in_rinex.rinex_version >= 3:
-            # DDG: make a new object and convert to RINEX 3 to leave the other one untouched
-            rinexobj = pyRinex.ReadRinex(in_rinex.NetworkCode, in_rinex.StationCode, in_rinex.origin_file,
-                                         no_cleanup=in_rinex.no_cleanup, allow_multiday=in_rinex.allow_multiday)
-            rinexobj.ConvertRinex(2)
-        else:
-            # file is in RINEX 2 format, use file as is
-            rinexobj = in_rinex
+            transform.ConvertRinex(2)
 
         PPPSpatialCheck.__init__(self)
 
@@ -261,7 +566,9 @@ class RunPPP(PPPSpatialCheck):
                 # create a production folder to analyze the rinex file
                 if not os.path.exists(self.rootdir):
                     os.makedirs(self.rootdir)
-                    os.makedirs(os.path.join(self.rootdir, 'orbits'))
+                    # when using a workspace, orbits is a link to the workspace folder
+                    if not self.erase:
+                        os.makedirs(os.path.join(self.rootdir, 'orbits'))
             except Exception:
                 # could not create production dir! FATAL
                 raise
@@ -281,24 +588,28 @@ class RunPPP(PPPSpatialCheck):
                                                    'next day.'))
 
             self.write_otl()
-            self.copyfiles()
+            if not self.erase:
+                # with a workspace, the files are staged together with the orbits
+                self.copyfiles()
             self.config_session()
 
             # make a local copy of the rinex file
             # decimate the rinex file if the interval is < 15 sec.
             # DDG: only decimate when told by caller
             if self.rinex.interval < 15 and decimate:
-                self.rinex.decimate(30)
+                transform.decimate(30)
 
-            copyfile(self.rinex.rinex_path,
-                     os.path.join(self.rootdir, self.rinex.rinex))
+            transform.apply(copyto=os.path.join(self.rootdir, self.rinex.rinex))
 
         else:
             raise pyRunPPPException('The file ' + self.rinex.rinex_path +
                                     ' could not be found. PPP was not executed.')
 
-    def copyfiles(self):
+    def copyfiles(self, path=None):
         # prepare all the files required to run PPP
+        path   = path or self.rootdir
+        copied = []
+
         files = ('gpsppp.stc', 'gpsppp.svb_gnss_yrly', 'gpsppp.flt')
         if self.apply_met:
             files = ('gpsppp.met',) + files
@@ -306,13 +617,17 @@ class RunPPP(PPPSpatialCheck):
         for f in files:
             if os.path.exists(os.path.join(self.ppp_path, f)):
                 copyfile(os.path.join(self.ppp_path, f),
-                         os.path.join(self.rootdir,  f))
+                         os.path.join(path,  f))
+                copied.append(f)
             else:
                 if f == 'gpsppp.svb_gnss_yrly':
                     raise pyRunPPPException(f'Missing gpsppp.svb_gnss_yrly for PPP processing.')
 
         copyfile(os.path.join(self.atx),
-                 os.path.join(self.rootdir, os.path.basename(self.atx)))
+                 os.path.join(path, os.path.basename(self.atx)))
+        copied.append(os.path.basename(self.atx))
+
+        return copied
 
     def write_otl(self):
         file_write(os.path.join(self.rootdir, self.rinex.StationCode + '.olc'),
@@ -385,31 +700,94 @@ class RunPPP(PPPSpatialCheck):
                    % (self.rinex.rinex, self.orbits1.filename, self.clocks1.filename,
                       self.orbits2.filename, self.clocks2.filename))
 
-    def get_orbits(self, orbit_type):
-
+    def fetch_orbits(self, orbit_type, path):
+        """
+        get the orbits and clocks (into path/orbits) and the EOP (into path) from the archive
+        """
         options = self.options
 
-        orbits_path = os.path.join(self.rootdir, 'orbits')
+        orbits_path = os.path.join(path, 'orbits')
 
-        if self.observations == OBSERV_CODE_PHASE:
-            orbits1 = pyProducts.GetSp3Orbits(options['sp3'], self.rinex.date,     orbit_type, orbits_path, True)
-            orbits2 = pyProducts.GetSp3Orbits(options['sp3'], self.rinex.date + 1, orbit_type, orbits_path, True)
+        # node-local products cache (None if not configured)
+        cache = pyProducts.ProductCache.from_options(options)
 
-            clocks1 = pyProducts.GetClkFile(  options['sp3'], self.rinex.date,     orbit_type, orbits_path, True)
-            clocks2 = pyProducts.GetClkFile(  options['sp3'], self.rinex.date + 1, orbit_type, orbits_path, True)
+        if self.observations == OBSERV_CODE_PHASE:
+            orbits1 = pyProducts.GetSp3Orbits(options['sp3'], self.rinex.date,     orbit_type, orbits_path, True,
+                                              cache=cache)
+            orbits2 = pyProducts.GetSp3Orbits(options['sp3'], self.rinex.date + 1, orbit_type, orbits_path, True,
+                                              cache=cache)
+
+            clocks1 = pyProducts.GetClkFile(  options['sp3'], self.rinex.date,     orbit_type, orbits_path, True,
+                                              cache=cache)
+            clocks2 = pyProducts.GetClkFile(  options['sp3'], self.rinex.date + 1, orbit_type, orbits_path, True,
+                                              cache=cache)
         else:
             # for code-only solution we get the BRDC orbit and we use the same information for all files.
-            orbits1 = pyProducts.GetBrdcOrbits(options['brdc'], self.rinex.date, orbits_path, True)
+            orbits1 = pyProducts.GetBrdcOrbits(options['brdc'], self.rinex.date, orbits_path, True, cache=cache)
             orbits2 = orbits1
             clocks1 = orbits1
             clocks2 = orbits1
         try:
-            eop_file = pyProducts.GetEOP(options['sp3'], self.rinex.date, orbit_type, self.rootdir)
+            eop_file = pyProducts.GetEOP(options['sp3'], self.rinex.date, orbit_type, path, cache=cache)
             eop_file = eop_file.filename
         except pyProducts.pyEOPException:
             # no eop, continue with out one
             eop_file = 'dummy.eop'
 
+        return orbits1, orbits2, clocks1, clocks2, eop_file
+
+    def stage_workspace(self, orbit_type, path):
+        """
+        put the products and static files in the workspace and return their description
+        """
+        os.makedirs(os.path.join(path, 'orbits'), exist_ok=True)
+
+        products = dict(zip(('orbits1', 'orbits2', 'clocks1', 'clocks2', 'eop_file'),
+                            self.fetch_orbits(orbit_type, path)))
+
+        for key in ('orbits1', 'orbits2', 'clocks1', 'clocks2'):
+            product       = products[key]
+            products[key] = {'filename'        : product.filename,
+                             'archive_filename': product.archive_filename,
+                             'type'            : getattr(product, 'type', None),
+                             'hash'            : getattr(product, 'hash', 0)}
+
+        products['files'] = ['orbits'] + self.copyfiles(path)
+        if products['eop_file'] != 'dummy.eop':
+            products['files'].append(products['eop_file'])
+
+        return products
+
+    def link_workspace(self, workspace):
+        """
+        link the files of the workspace into the run folder (replacing the links of a previous workspace, if any)
+        """
+        for f in os.listdir(self.rootdir):
+            if os.path.islink(os.path.join(self.rootdir, f)):
+                os.remove(os.path.join(self.rootdir, f))
+
+        for f in workspace.products['files']:
+            os.symlink(os.path.abspath(os.path.join(workspace.path, f)), os.path.join(self.rootdir, f))
+
+    def get_orbits(self, orbit_type):
+
+        if self.erase:
+            # DDG: the products of the day are staged once per node and shared by all the runs
+            workspace = PPPWorkspace(self.options, self.rinex.date, orbit_type, self.observations, self.atx,
+                                     self.apply_met)
+            products  = workspace.acquire(lambda path: self.stage_workspace(orbit_type, path))
+
+            # when falling back to the alternative orbits, release the previous workspace
+            self.release_workspace()
+            self.workspace = workspace
+            self.link_workspace(workspace)
+
+            orbits1, orbits2, clocks1, clocks2 = (StagedProduct(**products[key])
+                                                  for key in ('orbits1', 'orbits2', 'clocks1', 'clocks2'))
+            eop_file = products['eop_file']
+        else:
+            orbits1, orbits2, clocks1, clocks2, eop_file = self.fetch_orbits(orbit_type, self.rootdir)
+
         self.orbits1    = orbits1
         self.orbits2    = orbits2
         self.clocks1    = clocks1
@@ -420,6 +798,11 @@ class RunPPP(PPPSpatialCheck):
         # DDG: new -> add the value of the orbit hash to the PPP hash to include the orbit type
         self.hash += orbits1.hash
 
+    def release_workspace(self):
+        if self.workspace is not None:
+            self.workspace.release()
+            self.workspace = None
+
     def get_text(self, summary, start, end):
         copy = False
 
@@ -750,9 +1133,11 @@ class RunPPP(PPPSpatialCheck):
 
     def cleanup(self):
         if os.path.isdir(self.rootdir) and self.erase:
-            # remove all the directory contents
+            # remove all the directory contents (the links to the workspace, not their targets)
             rmtree(self.rootdir)
 
+        self.release_workspace()
+
     def __del__(self):
         self.cleanup()
 
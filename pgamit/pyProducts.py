@@ -6,8 +6,16 @@ Author: Demian D. Gomez
 import os
 import glob
 import re
+import errno
+import fcntl
+import shutil
+import gzip
+import tempfile
+import threading
+import subprocess
 from shutil import copyfile
 from datetime import datetime
+from collections import OrderedDict
 
 # app
 from pgamit import pyRunWithRetry
@@ -52,14 +60,311 @@ class pyBrdcException(pyProductsException):
     pass
 
 
+class ProductCache:
+    """
+    Node-local cache of uncompressed products. Each product is copied from the archive and uncompressed once per
+    node, then hard-linked (or copied, if the destination is on a different file system) to every requester. Entries
+    are stored as <cache>/<archive folder id>/<product file name>: since the archive folder resolves $year, $doy,
+    $gpsweek, etc., and the file name identifies the product type, the key is unique for each product and date.
+    A file lock per entry prevents concurrent workers from fetching the same product twice; the least recently used
+    entries are evicted when the cache exceeds its disk budget.
+    """
+
+    def __init__(self, path, max_size_gb=20):
+        self.path      = path
+        self.max_bytes = int(float(max_size_gb) * 1024 ** 3)
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def from_options(options):
+        """
+        returns the node cache configured in gnss_data.cfg ([archive] products_cache and products_cache_size in GB)
+        or None if no cache has been configured
+        """
+        if options.get('products_cache'):
+            return ProductCache(os.path.expandvars(options['products_cache']),
+                                options.get('products_cache_size') or 20)
+        return None
+
+    def entry(self, source):
+        # remove the compression extension, if any: cached products are always uncompressed
+        name, ext = os.path.splitext(os.path.basename(source))
+        if ext not in ('.Z', '.gz', '.zip'):
+            name += ext
+
+        return os.path.join(self.path, '%08x' % (crc32(os.path.dirname(os.path.abspath(source))) & 0xffffffff), name)
+
+    def get(self, source):
+        """
+        return the path to the uncompressed copy of source in the cache, fetching it from the archive if needed
+        """
+        entry = self.entry(source)
+
+        if os.path.isfile(entry):
+            self.touch(entry)
+            return entry
+
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        with open(entry + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another worker might have fetched the product while waiting for the lock
+                if not os.path.isfile(entry):
+                    self.fetch(source, entry)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self.evict(keep=entry)
+
+        return entry
+
+    def fetch(self, source, entry):
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp_')
+        try:
+            tmp_file = os.path.join(tmp_dir, os.path.basename(source))
+            copyfile(source, tmp_file)
+
+            if os.path.splitext(source)[1] in ('.Z', '.gz', '.zip'):
+                pyRunWithRetry.RunCommand('gunzip -f ' + tmp_file, 15).run_shell()
+                tmp_file = os.path.join(tmp_dir, os.path.basename(entry))
+
+            if not os.path.isfile(tmp_file):
+                raise pyProductsException('Could not uncompress ' + source)
+
+            # entries are shared through hard links: do not allow modifications
+            os.chmod(tmp_file, 0o444)
+            os.replace(tmp_file, entry)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def place(self, source, destination):
+        """
+        put an uncompressed copy of source in destination, going through the cache
+        """
+        file_try_remove(destination)
+
+        # retry once in case the entry was evicted by another worker between get and link
+        for retry in (0, 1):
+            entry = self.get(source)
+            try:
+                os.link(entry, destination)
+                return destination
+            except FileNotFoundError:
+                if retry:
+                    raise
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                copyfile(entry, destination)
+                return destination
+
+    @staticmethod
+    def touch(entry):
+        try:
+            # the modification time of the entries is used to keep track of the last access for the LRU
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """
+        remove the least recently used entries (except keep) until the cache is under its disk budget. Files linked
+        from processing folders remain valid after eviction
+        """
+        entries = []
+        for root, _, files in os.walk(self.path):
+            if os.path.basename(root).startswith('.tmp_'):
+                continue
+            for f in files:
+                if f.endswith('.lock'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, f))
+                    entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+                except OSError:
+                    # removed by another worker
+                    pass
+
+        total = sum(e[1] for e in entries)
+        for _, size, f in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if f != keep and file_try_remove(f):
+                total -= size
+
+    def prefetch(self, dates, sp3_archive=None, sp3types=(), brdc_archive=None, clocks=False):
+        """
+        warm the cache with the products of the given dates. Missing products are silently skipped
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.path, prefix='.tmp_')
+        try:
+            for date in dates:
+                products = []
+                if sp3_archive:
+                    products.append(lambda: GetSp3Orbits(sp3_archive, date, sp3types, tmp_dir, cache=self))
+                    if clocks:
+                        products.append(lambda: GetClkFile(sp3_archive, date, sp3types, tmp_dir, cache=self))
+                if brdc_archive:
+                    products.append(lambda: GetBrdcOrbits(brdc_archive, date, tmp_dir, cache=self))
+
+                for product in products:
+                    try:
+                        product().cleanup()
+                    except pyProductsException:
+                        pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def prefetch_async(self, *args, **kwargs):
+        """
+        run prefetch in a background thread so that the products are ready while the current processes run
+        """
+        thread = threading.Thread(target=self.prefetch, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+
+class ProductIndex:
+    """
+    Per-process index of the archive folders (one folder per gps week or day, depending on the archive structure).
+    Each folder is listed once and the listing is reused until the modification time of the folder changes (files
+    added to or removed from the folder), replacing the os.path.isfile probes for each product type and compression
+    extension
+    """
+
+    def __init__(self):
+        self.folders = {}
+        self.lock    = threading.Lock()
+
+    def listdir(self, folder):
+        """
+        same as os.listdir (including the exception if the folder does not exist) but cached
+        """
+        mtime = os.stat(folder).st_mtime_ns
+
+        with self.lock:
+            cached = self.folders.get(folder)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        files = frozenset(os.listdir(folder))
+
+        with self.lock:
+            self.folders[folder] = (mtime, files)
+
+        return files
+
+    def find(self, folder, filename, extensions=('', '.Z', '.gz', '.zip')):
+        """
+        return the path to filename + the first extension found in folder (or None if not available)
+        """
+        try:
+            files = self.listdir(folder)
+        except OSError:
+            return None
+
+        for ext in extensions:
+            if filename + ext in files:
+                return os.path.join(folder, filename + ext)
+
+        return None
+
+    def invalidate(self):
+        with self.lock:
+            self.folders.clear()
+
+
+class ProductMemory:
+    """
+    Per-process cache of the decompressed products (least recently used products are dropped when the cache exceeds
+    max_bytes). Used when no ProductCache is configured so that a product requested several times by the same worker
+    is only decompressed once. Entries are keyed by the path, modification time and size of the archive file
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.products  = OrderedDict()
+        self.size      = 0
+        self.lock      = threading.Lock()
+
+    @staticmethod
+    def decompress(source):
+        ext = os.path.splitext(source)[1]
+
+        if ext == '.gz':
+            with gzip.open(source, 'rb') as f:
+                return f.read()
+        elif ext in ('.Z', '.zip'):
+            # DDG: gzip can decompress unix compress (and single file zip) files, python can't
+            return subprocess.run(['gzip', '-dc', source], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  check=True).stdout
+
+        with open(source, 'rb') as f:
+            return f.read()
+
+    def get(self, source):
+        """
+        return the decompressed contents of source
+        """
+        st  = os.stat(source)
+        key = (source, st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            if key in self.products:
+                self.products.move_to_end(key)
+                return self.products[key]
+
+        try:
+            data = self.decompress(source)
+        except (OSError, EOFError, subprocess.CalledProcessError) as e:
+            raise pyProductsException('Could not uncompress %s: %s' % (source, str(e)))
+
+        with self.lock:
+            if key not in self.products:
+                self.products[key] = data
+                self.size += len(data)
+
+            while self.size > self.max_bytes and len(self.products) > 1:
+                _, dropped = self.products.popitem(last=False)
+                self.size -= len(dropped)
+
+        return data
+
+    def place(self, source, destination):
+        """
+        put an uncompressed copy of source in destination
+        """
+        data = self.get(source)
+
+        # do not write through a link to a product shared with other processes
+        file_try_remove(destination)
+        with open(destination, 'wb') as f:
+            f.write(data)
+
+        return destination
+
+    def clear(self):
+        with self.lock:
+            self.products.clear()
+            self.size = 0
+
+
+# DDG: index of the archive folders and decompressed products kept by each process (worker)
+product_index  = ProductIndex()
+product_memory = ProductMemory()
+
+
 class OrbitalProduct:
-    def __init__(self, archive, date, filename, copyto, short_name=True):
+    def __init__(self, archive, date, filename, copyto, short_name=True, cache=None):
         """
         Module to obtain IGS products.
         archive   : location of the local archive where files live
         date      : date of the orbit file being retrieved
         filename  : orbital product file name (now with REGEX for version)
         short_name: if True, then copy the product to destination using shortname format (default is True)
+        cache     : ProductCache object to obtain the uncompressed product from (default is None, no cache)
         """
         if date.gpsWeek < 0 or date > pyDate.Date(datetime=datetime.now()):
             # do not allow negative weeks or future orbit downloads!
@@ -85,7 +390,7 @@ class OrbitalProduct:
         # first, check if letter is upper case, which means we are getting a long filename
         if filename[0].isupper():
             r = re.compile('(' + filename + ')')
-            match = list(filter(r.match, os.listdir(archive)))
+            match = list(filter(r.match, product_index.listdir(archive)))
             for prod in match:
                 if int(prod[3]) >= self.version:
                     # save the version
@@ -117,27 +422,23 @@ class OrbitalProduct:
             self.archive_filename = filename
 
         copy_path = os.path.join(copyto, self.filename)
-        archive_file_path = os.path.join(archive, self.archive_filename)
         self.file_path = copy_path
 
         # try both zipped and unzipped n files
-        if os.path.isfile(archive_file_path):
-            # if enters here, then uncompressed file exists in the orbits archive
-            copyfile(archive_file_path, copy_path)
-        else:
-            for ext in ('.Z', '.gz', '.zip'):
-                if os.path.isfile(archive_file_path + ext):
-                    copyfile(archive_file_path + ext, copy_path + ext)
+        # DDG: look for the file in the (cached) listing of the archive folder
+        source = product_index.find(archive, self.archive_filename)
+        if source is None:
+            raise pyProductsException('Could not find the archive file for ' + self.filename)
 
-                    pyRunWithRetry.RunCommand('gunzip -f ' + copy_path + ext, 15).run_shell()
-                    break
-            else:
-                raise pyProductsException('Could not find the archive file for ' + self.filename)
+        if cache is not None:
+            cache.place(source, copy_path)
+        else:
+            product_memory.place(source, copy_path)
 
 
 class GetSp3Orbits(OrbitalProduct):
 
-    def __init__(self, sp3archive, date, sp3types, copyto, no_cleanup=False):
+    def __init__(self, sp3archive, date, sp3types, copyto, no_cleanup=False, cache=None):
 
         # try both compressed and non-compressed sp3 files
         # loop through the types of sp3 files to try
@@ -158,7 +459,7 @@ class GetSp3Orbits(OrbitalProduct):
                 self.sp3_filename = sp3type.replace('{WWWWD}', date.wwwwd()) + '.sp3'
 
             try:
-                OrbitalProduct.__init__(self, sp3archive, date, self.sp3_filename, copyto)
+                OrbitalProduct.__init__(self, sp3archive, date, self.sp3_filename, copyto, cache=cache)
                 self.sp3_path = self.file_path
                 self.type     = sp3type
                 break
@@ -202,7 +503,7 @@ class GetSp3Orbits(OrbitalProduct):
 
 class GetClkFile(OrbitalProduct):
 
-    def __init__(self, clk_archive, date, sp3types, copyto, no_cleanup=False):
+    def __init__(self, clk_archive, date, sp3types, copyto, no_cleanup=False, cache=None):
 
         # try both compressed and non-compressed sp3 files
         # loop through the types of sp3 files to try
@@ -222,7 +523,7 @@ class GetClkFile(OrbitalProduct):
                 self.clk_filename = sp3type.replace('{WWWWD}', date.wwwwd()) + '.clk'
 
             try:
-                OrbitalProduct.__init__(self, clk_archive, date, self.clk_filename, copyto)
+                OrbitalProduct.__init__(self, clk_archive, date, self.clk_filename, copyto, cache=cache)
                 self.clk_path = self.file_path
                 break
             except pyProductsExceptionUnreasonableDate:
@@ -253,7 +554,7 @@ class GetClkFile(OrbitalProduct):
 
 class GetEOP(OrbitalProduct):
 
-    def __init__(self, sp3archive, date, sp3types, copyto):
+    def __init__(self, sp3archive, date, sp3types, copyto, cache=None):
 
         # try both compressed and non-compressed sp3 files
         # loop through the types of sp3 files to try
@@ -277,7 +578,7 @@ class GetEOP(OrbitalProduct):
                 self.eop_filename = sp3type.replace('{WWWWD}', week.wwww()) + '7.erp'
 
             try:
-                OrbitalProduct.__init__(self, sp3archive, date, self.eop_filename, copyto)
+                OrbitalProduct.__init__(self, sp3archive, date, self.eop_filename, copyto, cache=cache)
                 self.eop_path = self.file_path
                 self.type     = sp3type
                 break
@@ -307,7 +608,7 @@ class GetEOP(OrbitalProduct):
 
 class GetBrdcOrbits(OrbitalProduct):
 
-    def __init__(self, brdc_archive, date, copyto, no_cleanup=False):
+    def __init__(self, brdc_archive, date, copyto, no_cleanup=False, cache=None):
 
         self.brdc_archive = brdc_archive
         self.brdc_path    = None
@@ -319,7 +620,7 @@ class GetBrdcOrbits(OrbitalProduct):
         self.brdc_filename = 'brdc' + str(date.doy).zfill(3) + '0.' + str(date.year)[2:4] + 'n'
 
         try:
-            OrbitalProduct.__init__(self, self.brdc_archive, date, self.brdc_filename, copyto)
+            OrbitalProduct.__init__(self, self.brdc_archive, date, self.brdc_filename, copyto, cache=cache)
             self.brdc_path = self.file_path
 
         except pyProductsExceptionUnreasonableDate:
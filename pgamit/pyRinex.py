@@ -12,6 +12,7 @@ import re
 import struct
 import json
 import glob
+import hashlib
 
 # app
 from pgamit.pyEvents import Event
@@ -21,6 +22,8 @@ from pgamit import pyRinexName
 from pgamit import pyDate
 from pgamit import pyRunWithRetry
 from pgamit import pyStationInfo
+from pgamit import pySPP
+from pgamit.pyProducts import pyProductsException
 from pgamit import Utils
 from pgamit.Utils import (file_open,
                           file_write,
@@ -49,6 +52,14 @@ class pyRinexExceptionSingleEpoch (pyRinexException): pass
 class pyRinexExceptionNoAutoCoord (pyRinexException): pass
 
 
+class pyRinexExceptionDuplicate(pyRinexException):
+    def __init__(self, value, match):
+        super(pyRinexExceptionDuplicate, self).__init__(value)
+        # the archive records that have the same content
+        self.match = match
+        self.event['EventType'] = 'info'
+
+
 class RinexRecord(object):
 
     def __init__(self, NetworkCode=None, StationCode=None):
@@ -96,6 +107,7 @@ class RinexRecord(object):
         self.completion        = None
         self.rel_completion    = None
         self.rinex_version     = None
+        self.fingerprint       = None
         self.min_time_seconds  = 3600
 
         # log list to append all actions performed to rinex file
@@ -168,7 +180,7 @@ class RinexRecord(object):
         fieldnames = ['NetworkCode','StationCode','ObservationYear','ObservationMonth','ObservationDay',
                       'ObservationDOY','ObservationFYear','ObservationSTime','ObservationETime','ReceiverType',
                       'ReceiverSerial','ReceiverFw','AntennaType','AntennaSerial','AntennaDome','Filename','Interval',
-                      'AntennaOffset', 'Completion']
+                      'AntennaOffset', 'Completion', 'Fingerprint']
 
         self.record = dict.fromkeys(fieldnames)
 
@@ -193,6 +205,330 @@ class RinexRecord(object):
         r['Interval']         = self.interval
         r['AntennaOffset']    = self.antOffset
         r['Completion']       = self.completion
+        r['Fingerprint']      = self.fingerprint
+
+
+class RinexTransform(object):
+    """
+    Collects the operations requested on a RINEX file (time window, sampling, system filter, version conversion
+    and header edits) and applies them with a single gfzrnx_lx invocation followed by a single header pass, so
+    that the file is read and written once instead of once per operation. Methods mirror the ReadRinex ones:
+
+        rnx.transform().window_data(end=dt).decimate(30).purge_comments().apply()
+    """
+    def __init__(self, rinex):
+        self.rinex      = rinex
+        self.start      = None
+        self.end        = None
+        self.rate       = None
+        self.systems    = None
+        self.version    = None
+        self.header_ops = []
+
+    def window_data(self, start=None, end=None):
+        rnx = self.rinex
+
+        if start is None:
+            start = rnx.datetime_firstObs
+            rnx.log_event('Setting start = first obs in window_data')
+
+        if end is None:
+            end = rnx.datetime_lastObs
+            rnx.log_event('Setting end = last obs in window_data')
+
+        self.start = start
+        self.end   = end
+        return self
+
+    def decimate(self, decimate_rate):
+        self.rate = decimate_rate
+        return self
+
+    def remove_systems(self, systems=('C', 'E', 'I', 'J', 'R', 'S')):
+        self.systems = systems
+        return self
+
+    def ConvertRinex(self, to_version):
+        self.version = to_version
+        return self
+
+    def purge_comments(self):
+        self.header_ops.append(lambda header: self.rinex._purge_comments(header))
+        return self
+
+    def normalize_header(self, NewValues=None, brdc=None, x=None, y=None, z=None):
+        self.header_ops.append(lambda header: self.rinex._normalize_header(header, NewValues, brdc, x, y, z))
+        return self
+
+    def gfzrnx_args(self):
+        args = ''
+
+        if self.start is not None:
+            d = int((self.end - self.start).total_seconds())
+            args += ' -epo_beg %i%02i%02i_%02i%02i%02i -d %i' % (self.start.year, self.start.month, self.start.day,
+                                                                 self.start.hour, self.start.minute,
+                                                                 self.start.second, d)
+        if self.rate is not None:
+            args += ' -smp %i' % self.rate
+
+        if self.systems is not None:
+            args += ' -satsys %s' % ''.join(s for s in 'CEIGJRS' if s not in self.systems)
+
+        if args or self.version is not None:
+            args += (' -vo %i -f' % self.version) if self.version is not None else ' -kv'
+
+        return args
+
+    def run_gfzrnx(self, args, dst):
+        rnx = self.rinex
+
+        cmd = pyRunWithRetry.RunCommand('gfzrnx_lx -finp %s -fout %s.t%s' % (rnx.rinex_path, dst, args), 45)
+        try:
+            _, err = cmd.run_shell()
+        except pyRunWithRetry.RunCommandWithRetryExeception as e:
+            # catch the timeout except and pass it as a pyRinexException
+            raise pyRinexException(str(e))
+
+        # raise error if error reported by gfzrnx
+        if '| E |' in err:
+            if self.version is not None:
+                raise pyRinexExceptionBadFile('gfzrnx_lx returned error converting to RINEX %i:\n'
+                                              % self.version + err)
+            raise pyRinexException('Error while transforming RINEX file: ' + err)
+
+        elif not os.path.exists(dst + '.t'):
+            raise pyRinexExceptionBadFile('gfzrnx_lx failed to transform RINEX file:\n' + err)
+
+        return dst + '.t'
+
+    def rewrite_header(self, src, dst, collect_data=False):
+        # apply the header operations to the header of src and stream the data into dst
+        rnx    = self.rinex
+        header = rnx.get_header(src)
+
+        for op in self.header_ops:
+            header = op(header)
+
+        data = [] if collect_data else None
+        out  = dst + '.h' if src == dst else dst
+
+        with file_open(src) as fsrc, file_open(out, 'w') as fdst:
+            fdst.writelines(header)
+            # skip the header of the source
+            for line in fsrc:
+                if line.strip().endswith('END OF HEADER'):
+                    break
+
+            for line in fsrc:
+                fdst.write(line)
+                if collect_data:
+                    data.append(line)
+
+        if out != dst:
+            move(out, dst)
+
+        return header, data
+
+    def apply(self, copyto=None):
+        """
+        Apply the collected operations. If copyto is passed, the result is written to copyto and the current rinex
+        is left untouched. Otherwise, the file and the object are updated in place
+        """
+        rnx  = self.rinex
+        dst  = copyto if copyto is not None else rnx.rinex_path
+        args = self.gfzrnx_args()
+
+        if args:
+            src = self.run_gfzrnx(args, dst)
+
+            if self.header_ops:
+                header, data = self.rewrite_header(src, dst, collect_data=copyto is None)
+                os.remove(src)
+            else:
+                if os.path.isfile(dst):
+                    os.remove(dst)
+                move(src, dst)
+                header, data = None, None
+
+            if copyto is None:
+                # header and data changed: if not collected, data is reloaded by write_rinex when needed
+                rnx.header = header if header else rnx.get_header()
+                rnx.data   = data
+
+        elif self.header_ops:
+            if copyto is None:
+                new_header = rnx.header
+                for op in self.header_ops:
+                    new_header = op(new_header)
+                rnx.write_rinex(new_header)
+            else:
+                self.rewrite_header(rnx.rinex_path, dst)
+
+        elif copyto is not None:
+            copyfile(rnx.rinex_path, copyto)
+
+        applied = ' (applied to %s)' % str(dst)
+
+        if copyto is None:
+            if self.start is not None:
+                rnx.datetime_firstObs = self.start
+                rnx.datetime_lastObs  = self.end
+                rnx.firstObs          = self.start.strftime('%Y/%m/%d %H:%M:%S')
+                rnx.lastObs           = self.end  .strftime('%Y/%m/%d %H:%M:%S')
+
+            if self.rate is not None:
+                rnx.interval = self.rate
+
+            if self.version is not None:
+                rnx.rinex_version = self.version
+
+            if self.systems is not None:
+                # reload information from this file
+                rnx.parse_output(rnx.RunGfzrnx(), rnx.min_time_seconds)
+
+        if self.version is not None:
+            rnx.log_event('Origin file was RINEX 3 -> Converted to 2.11' + applied)
+
+        if self.rate is not None:
+            rnx.log_event('RINEX decimated to %is' % self.rate + applied)
+
+        if self.systems is not None:
+            rnx.log_event('Removed systems %s' % ','.join(self.systems) + applied)
+
+
+class RinexStream(object):
+    """
+    Consumer for pyRunWithRetry.RunPipeline that splits a streamed RINEX into header and data lines
+    """
+    def __init__(self):
+        self.header        = []
+        self.data          = []
+        self.size          = 0
+        self.end_of_header = False
+        self.fingerprint   = RinexFingerprint()
+
+    def __call__(self, line):
+        self.size += len(line)
+        self.fingerprint(line)
+
+        if self.end_of_header:
+            self.data.append(line)
+        else:
+            self.header.append(line)
+            self.end_of_header = line.strip().endswith('END OF HEADER')
+
+
+class RinexFingerprint(object):
+    """
+    Consumer for pyRunWithRetry.RunPipeline that computes a content fingerprint of a RINEX file: a sha1 of the
+    epoch blocks that fall on a round sampling time. The header is only read to get the RINEX version: the archive
+    keeps the files with a normalized header (station code, approximate coordinates, etc.) so hashing it would make
+    an incoming file never match its archived copy. The same observations give the same fingerprint regardless of
+    the compression, the line padding, the header or the program that wrote the file, so duplicates can be detected
+    before running gfzrnx or PPP
+    """
+    # only the epoch blocks at multiples of this many seconds of day are hashed
+    sampling     = 900
+
+    # RINEX 2 epoch line: yy mm dd hh mm ss.sssssss  f nnn
+    epoch_rnx2   = re.compile(r'^ [ \d]\d [ \d]\d [ \d]\d [ \d]\d [ \d]\d [ \d]\d\.\d{7}  [0-6][ \d]{3}')
+
+    def __init__(self):
+        self.sha1          = hashlib.sha1()
+        self.version       = 2
+        self.end_of_header = False
+        self.in_block      = False
+        self.blocks        = 0
+
+    def __call__(self, line):
+        line = line.rstrip()
+
+        if not self.end_of_header:
+            if line.endswith('RINEX VERSION / TYPE'):
+                try:
+                    self.version = int(float(line[0:9]))
+                except ValueError:
+                    pass
+
+            self.end_of_header = line.endswith('END OF HEADER')
+        else:
+            sod = self.seconds_of_day(line)
+
+            if sod is not None:
+                # a new epoch block starts, decide if it goes into the fingerprint
+                self.in_block = int(round(sod)) % self.sampling == 0
+                self.blocks  += self.in_block
+
+            if self.in_block:
+                self.sha1.update(line.encode('utf-8', 'ignore'))
+
+    def seconds_of_day(self, line):
+        # return the seconds of day of an epoch line or None if line is not the start of an epoch
+        try:
+            if self.version >= 3:
+                if line.startswith('>'):
+                    fields = line.split()
+                    return int(fields[4]) * 3600 + int(fields[5]) * 60 + float(fields[6])
+            elif self.epoch_rnx2.match(line):
+                return int(line[10:12]) * 3600 + int(line[13:15]) * 60 + float(line[15:26])
+        except (ValueError, IndexError):
+            pass
+
+        return None
+
+    def hexdigest(self):
+        # without observations at the round sampling times there is nothing to tell the file apart from others
+        return self.sha1.hexdigest() if self.blocks else None
+
+
+def uncompress_commands(filename, origin_type):
+    """
+    Return the RunPipeline commands that stream the RINEX content of filename to stdout
+    """
+    # determine compression type from the magic number, if necessary
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+
+    if magic == b'PK':
+        commands = [['unzip', '-p', filename]]
+    elif magic in (b'\x1f\x8b', b'\x1f\x9d'):
+        # gzip or unix compress (.Z)
+        commands = [['gzip', '-dc', filename]]
+    else:
+        commands = [['cat', filename]]
+
+    # determine the program to pipe into
+    if origin_type in (TYPE_CRINEZ, TYPE_CRINEX, TYPE_CRINEZ_2):
+        commands.append(['crx2rnx'])
+
+    return commands
+
+
+def fingerprint(filename):
+    """
+    Compute the RinexFingerprint of a RINEX / CRINEX file, compressed or not, streaming its content (nothing is
+    written to disk). ReadRinex computes the fingerprint while decompressing, use this function for files that are
+    not read with ReadRinex (e.g. to fill the fingerprint of the files already in the archive)
+    :param filename: path to the file, which has to follow the RINEX naming convention
+    :return: the fingerprint as a 40 character hex string or None if the file has no epochs to fingerprint
+    """
+    try:
+        origin_type = pyRinexName.RinexNameFormat(filename).type
+    except pyRinexName.RinexNameException as e:
+        raise pyRinexException('File name does not follow the RINEX(Z)/CRINEX(Z) naming convention: %s'
+                               % (os.path.basename(filename))) from e
+
+    fp  = RinexFingerprint()
+    cmd = pyRunWithRetry.RunPipeline(uncompress_commands(filename, origin_type), 45)
+    try:
+        cmd.run_pipe(fp)
+    except pyRunWithRetry.RunCommandWithRetryExeception as e:
+        raise pyRinexException(str(e))
+
+    if not fp.end_of_header:
+        raise pyRinexExceptionBadFile('Invalid header: could not find END OF HEADER tag.')
+
+    return fp.hexdigest()
 
 
 class ReadRinex(RinexRecord):
@@ -255,11 +591,15 @@ class ReadRinex(RinexRecord):
 
         return '%-60s' % data + record
 
-    def write_rinex(self, new_header):
-        if new_header != self.header:
+    def write_rinex(self, new_header, force=False):
+        if new_header != self.header or force:
 
             self.header = new_header
 
+            # data might have been invalidated by a transform
+            if self.data is None:
+                self.read_data()
+
             # add new header
             rinex = new_header + self.data
 
@@ -316,7 +656,7 @@ class ReadRinex(RinexRecord):
 
         return new_header
 
-    def __purge_comments(self, header):
+    def _purge_comments(self, header):
         new_header = [line for line in header if not line.strip().endswith('COMMENT')]
 
         self.log_event('Purged all COMMENTs from RINEX header.')
@@ -325,7 +665,7 @@ class ReadRinex(RinexRecord):
 
     def purge_comments(self):
 
-        new_header = self.__purge_comments(self.header)
+        new_header = self._purge_comments(self.header)
 
         self.write_rinex(new_header)
 
@@ -373,7 +713,10 @@ class ReadRinex(RinexRecord):
 
     def check_header(self):
 
-        self.header = self.get_header()
+        # header might have been loaded already by uncompress
+        if self.header is None:
+            self.header = self.get_header()
+
         new_header  = []
 
         self.system = ''
@@ -404,7 +747,8 @@ class ReadRinex(RinexRecord):
                     self.rinex_version = float(fields[0])
 
                     # now that we know the version, we can get the first obs
-                    self.read_data()
+                    if self.data is None:
+                        self.read_data()
                     first_obs = self.get_firstobs()
 
                     if first_obs is None:
@@ -490,7 +834,8 @@ class ReadRinex(RinexRecord):
 
         new_header += [''.ljust(60, ' ') + 'END OF HEADER\n']
 
-        self.write_rinex(new_header)
+        # if the RINEX came from a stream, it has not been written yet
+        self.write_rinex(new_header, force=not os.path.isfile(self.rinex_path))
 
     def indentify_file(self, input_file):
         # get the crinez and rinex names
@@ -523,39 +868,22 @@ class ReadRinex(RinexRecord):
         chmod_exec(script_path)
 
     def uncompress(self):
+        # DDG: the decompression is streamed (decompressor | crx2rnx) straight into memory where the header and
+        # data are split for check_header. The origin file is not copied to rootdir and the RINEX is written to
+        # disk only once, by check_header, since gfzrnx needs a file to work with
 
-        # determine compression type, if necessary
-        result = os.system('file "%s" | grep -q "Zip"' % self.local_copy)
-        if result == 0:
-            prg1 = 'unzip -p "%s" ' % self.local_copy
-        else:
-            result = os.system('file "%s" | grep -q "ASCII"' % self.local_copy)
-            if result == 0:
-                prg1 = 'cat "%s" ' % self.local_copy
-            else:
-                prg1 = 'zcat "%s" ' % self.local_copy
-
-        # determine the program to pipe into
-        if self.origin_type in (TYPE_CRINEZ, TYPE_CRINEX, TYPE_CRINEZ_2):
-            prg2 = ' crx2rnx > "%s"' % self.rinex_path
-        else:
-            prg2 = ' > "%s"' % self.rinex_path
-
-        # create an uncompression script
-        self.create_script('uncompress.sh', prg1 + '|' + prg2)
-
-        # run crz2rnx with timeout structure
-        cmd = pyRunWithRetry.RunCommand(os.path.join(self.rootdir, 'uncompress.sh'), 45)
+        stream = RinexStream()
+        # run the pipeline with timeout structure
+        cmd = pyRunWithRetry.RunPipeline(uncompress_commands(self.origin_file, self.origin_type), 45, self.rootdir)
         try:
-            _, err = cmd.run_shell()
+            err = cmd.run_pipe(stream)
         except pyRunWithRetry.RunCommandWithRetryExeception as e:
             # catch the timeout except and pass it as a pyRinexException
             raise pyRinexException(str(e))
 
-        # check the size of the file
-        size = os.path.getsize(self.local_copy)
-        if os.path.isfile(self.rinex_path):
-            if err and os.path.getsize(self.rinex_path) < size:
+        # check the size of the output
+        if stream.size:
+            if err and stream.size < os.path.getsize(self.origin_file):
                 raise pyRinexExceptionBadFile("Error in ReadRinex.__init__ -- crz2rnx: error and empty file: "
                                               + self.origin_file + ' -> ' + err)
         else:
@@ -563,35 +891,25 @@ class ReadRinex(RinexRecord):
                 ('Could not create RINEX file. crx2rnx stderr follows: ' + err) if err else
                 'Could not create RINEX file. Unknown reason. Possible problem with crx2rnx?')
 
-    def ConvertRinex(self, to_version):
-        # only available to convert from 3 -> 2
-        try:
-            # most programs still don't support RINEX 3 (partially implemented in this code)
-            # convert to RINEX 2.11 using gfzrnx_lx
-            cmd = pyRunWithRetry.RunCommand('gfzrnx_lx -finp %s -fout %s.t -vo %i -f'
-                                            % (self.rinex, self.rinex, to_version), 45, self.rootdir)
-
-            _, err = cmd.run_shell()
-
-            result_path = self.rinex_path + '.t'
-            
-            if '| E |' in err:
-                raise pyRinexExceptionBadFile('gfzrnx_lx returned error converting to RINEX 2.11:\n' + err)
-
-            elif not os.path.exists(result_path):
-                raise pyRinexExceptionBadFile('gfzrnx_lx failed to convert to RINEX 2.11:\n' + err)
+        if not stream.end_of_header:
+            raise pyRinexExceptionBadFile('Invalid header: could not find END OF HEADER tag.')
 
-            # if all ok, move converted file to rinex_path
-            os.remove(self.rinex_path)
-            move(result_path, self.rinex_path)
-            # change version
-            self.rinex_version = to_version
+        self.header      = stream.header
+        self.data        = stream.data
+        self.fingerprint = stream.fingerprint.hexdigest()
 
-            self.log_event('Origin file was RINEX 3 -> Converted to 2.11')
+    def ConvertRinex(self, to_version):
+        # only available to convert from 3 -> 2
+        # most programs still don't support RINEX 3 (partially implemented in this code)
+        # convert to RINEX 2.11 using gfzrnx_lx
+        self.transform().ConvertRinex(to_version).apply()
 
-        except pyRunWithRetry.RunCommandWithRetryExeception as e:
-            # catch the timeout except and pass it as a pyRinexException
-            raise pyRinexException(str(e))
+    def transform(self):
+        """
+        Start a RinexTransform to apply several operations (window, decimate, remove systems, conversion, header
+        edits) in a single pass over the file
+        """
+        return RinexTransform(self)
 
     def RunRinSum(self):
         """
@@ -631,11 +949,14 @@ class ReadRinex(RinexRecord):
             return json.load(info)
 
     def __init__(self, NetworkCode, StationCode, origin_file, no_cleanup=False, allow_multiday=False,
-                 min_time_seconds=3600):
+                 min_time_seconds=3600, duplicates=None):
         """
         pyRinex initialization
         if file is multiday, DO NOT TRUST date object for initial file. Only use pyRinex objects contained in the
         multiday list
+        duplicates: optional function that receives the content fingerprint and returns the archive records with the
+        same content (e.g. RinexStruct.get_rinex_by_fingerprint). If any, pyRinexExceptionDuplicate is raised before
+        checking the header and running gfzrnx
         """
         RinexRecord.__init__(self, NetworkCode, StationCode)
 
@@ -657,10 +978,18 @@ class ReadRinex(RinexRecord):
 
         self.indentify_file(origin_file)
 
-        copy(origin_file, self.rootdir)
-
         if self.origin_type in (TYPE_CRINEZ, TYPE_CRINEX, TYPE_RINEZ, TYPE_CRINEZ_2):
             self.uncompress()
+        else:
+            copy(origin_file, self.rootdir)
+            self.fingerprint = fingerprint(origin_file)
+
+        if duplicates is not None:
+            match = duplicates(self.fingerprint)
+            if match:
+                raise pyRinexExceptionDuplicate('%s has the same content as %s.%s %s already in the archive.'
+                                                % (os.path.basename(origin_file), match[0]['NetworkCode'],
+                                                   match[0]['StationCode'], match[0]['Filename']), match)
 
         # check basic infor in the rinex header to avoid problems with RinSum
         self.check_header()
@@ -945,13 +1274,13 @@ class ReadRinex(RinexRecord):
 
         return date
 
-    def get_header(self):
+    def get_header(self, path=None):
 
         header = []
         # retry reading. Every now and then there is a problem during file read.
         for i in range(2):
             try:
-                with file_open(self.rinex_path) as fileio:
+                with file_open(path if path else self.rinex_path) as fileio:
                     for line in fileio:
                         header.append(line)
                         if line.strip().endswith('END OF HEADER'):
@@ -967,6 +1296,29 @@ class ReadRinex(RinexRecord):
         return header
 
     def auto_coord(self, brdc, chi_limit=3):
+        # DDG: compute the coordinate with the built-in single point positioning (broadcast orbits and pseudoranges
+        # of the streamed observations). Only if it fails, fall back to NRCAN PPP in code-only mode
+        try:
+            nav = pySPP.nav_cache.get_brdc(brdc)
+
+            if self.data is not None:
+                header, lines = self.header, self.data
+            else:
+                header, lines = pySPP.read_rinex_lines(self.rinex_path)
+
+            x0 = (self.x, self.y, self.z) if self.x is not None else None
+            xyz, _ = pySPP.single_point_position(header, lines, nav, x0, chi_limit)
+
+        except (pySPP.pySPPException, pyProductsException, ValueError, IndexError, OSError) as e:
+            self.log_event('Single point positioning failed (%s), running PPP in code-only mode' % str(e))
+            return self.auto_coord_ppp(brdc, chi_limit)
+
+        self.x, self.y, self.z = (float(c) for c in xyz)
+        self.lat, self.lon, self.h = ecef2lla([self.x, self.y, self.z])
+
+        return (self.x, self.y, self.z), (self.lat, self.lon, self.h)
+
+    def auto_coord_ppp(self, brdc, chi_limit=3):
         # use NRCAN PPP in code-only mode to obtain a coordinate of the station
         from pgamit import pyPPP, pyOptions
 
@@ -1000,19 +1352,23 @@ class ReadRinex(RinexRecord):
             # make a copy to decimate and remove systems to help sh_rx2apr (also, convert to rinex 2, if rinex 3)
             # allow multiday files (will not change the answer), just get a coordinate for this file
             rnx = ReadRinex(self.NetworkCode, self.StationCode, self.rinex_path, allow_multiday=True)
+            # apply all the changes in a single pass
+            transform = rnx.transform()
 
             if rnx.rinex_version >= 3:
-                rnx.ConvertRinex(2)
+                transform.ConvertRinex(2)
 
             if rnx.interval < 15:
-                rnx.decimate(30)
+                transform.decimate(30)
                 self.log_event('Decimating to 30 seconds to run auto_coord')
 
             # remove the other systems that sh_rx2apr does not use
             if rnx.system == 'M':
-                rnx.remove_systems()
+                transform.remove_systems()
                 self.log_event('Removing systems other systems to run auto_coord')
 
+            transform.apply()
+
         except pyRinexException as e:
             # print str(e)
             # ooops, something went wrong, try with local file (without removing systems or decimating)
@@ -1089,107 +1445,26 @@ class ReadRinex(RinexRecord):
         :param end: a end datetime or self.lastObs if None
         :return:
         """
-        if start is None:
-            start = self.datetime_firstObs
-            self.log_event('Setting start = first obs in window_data')
-
-        if end is None:
-            end = self.datetime_lastObs
-            self.log_event('Setting end = last obs in window_data')
-
-        d = int((end - start).total_seconds())
-
-        cmd = pyRunWithRetry.RunCommand('gfzrnx_lx -finp %s -fout %s.t -epo_beg %i%02i%02i_%02i%02i%02i -d %i -kv'
-                                        % (self.rinex_path, self.rinex_path,
-                                           start.year, start.month, start.day,
-                                           start.hour, start.minute, start.second, d), 45)
-        try:
-            _, err = cmd.run_shell()
-            # raise error if error reported by gfzrnx
-            if '| E |' in err:
-                raise pyRinexException('Error while windowing RINEX file: ' + err)
-
-        except pyRunWithRetry.RunCommandWithRetryExeception as e:
-            # catch the timeout except and pass it as a pyRinexException
-            raise pyRinexException(str(e))
-
-        # delete the original file and replace with .t
-        if copyto is None:
-            os.remove(self.rinex_path)
-            move(self.rinex_path + '.t', self.rinex_path)
-            self.datetime_firstObs = start
-            self.datetime_lastObs  = end
-            self.firstObs          = start.strftime('%Y/%m/%d %H:%M:%S')
-            self.lastObs           = end  .strftime('%Y/%m/%d %H:%M:%S')
-        else:
-            move(self.rinex_path + '.t', copyto)
+        self.transform().window_data(start, end).apply(copyto)
 
     def decimate(self, decimate_rate, copyto=None):
         # if copy to is passed, then the decimation is done on the copy of the file, not on the current rinex.
         # otherwise, decimation is done in current rinex
-        if copyto is not None:
-            copyfile(self.rinex_path, copyto)
-        else:
-            copyto = self.rinex_path
-            self.interval = decimate_rate
-
-        cmd = pyRunWithRetry.RunCommand('gfzrnx_lx -finp %s -fout %s.t -smp %i -kv'
-                                        % (copyto, copyto, decimate_rate), 45)
-        try:
-            _, err = cmd.run_shell()
-            # raise error if error reported by gfzrnx
-            if '| E |' in err:
-                raise pyRinexException('Error while windowing RINEX file: ' + err)
-
-        except pyRunWithRetry.RunCommandWithRetryExeception as e:
-            # catch the timeout except and pass it as a pyRinexException
-            raise pyRinexException(str(e))
-
-        # delete the original file and replace with .t
-        os.remove(copyto)
-        move(copyto + '.t', copyto)
-
-        self.log_event('RINEX decimated to %is (applied to %s)' % (decimate_rate, str(copyto)))
+        self.transform().decimate(decimate_rate).apply(copyto)
 
     def remove_systems(self, systems=('C', 'E', 'I', 'J', 'R', 'S'), copyto=None):
         # if copy to is passed, then the system removal is done on the copy of the file, not on the current rinex.
         # other wise, system removal is done to current rinex
-        if copyto is not None:
-            copyfile(self.rinex_path, copyto)
-        else:
-            copyto = self.rinex_path
-
-        vsys = 'CEIGJRS'
-        rsys = ''.join(s for s in vsys if s not in systems)
-
-        cmd = pyRunWithRetry.RunCommand('gfzrnx_lx -finp %s -fout %s.t -satsys %s -kv' % (copyto, copyto, rsys), 45)
-
-        try:
-            _, err = cmd.run_shell()
-            # raise error if error reported by gfzrnx
-            if '| E |' in err:
-                raise pyRinexException('Error while binning RINEX file: ' + err)
-
-        except pyRunWithRetry.RunCommandWithRetryExeception as e:
-            # catch the timeout except and pass it as a pyRinexException
-            raise pyRinexException(str(e))
-
-        # delete the original file and replace with .t
-        os.remove(copyto)
-        move(copyto + '.t', copyto)
-        # if working on local copy, reload the rinex information
-        if copyto == self.rinex_path:
-            # reload information from this file
-            self.parse_output(self.RunGfzrnx(), self.min_time_seconds)
-        else:
-            raise pyRinexException(err)
-
-        self.log_event('Removed systems %s (applied to %s)' % (','.join(systems), str(copyto)))
+        self.transform().remove_systems(systems).apply(copyto)
 
     def normalize_header(self, NewValues=None, brdc=None, x=None, y=None, z=None):
         # this function gets rid of the heaer information and replaces it with the station info (trusted)
         # should be executed before calling PPP or before rebuilding the Archive
         # new function now accepts a dictionary OR a station info object
+        self.write_rinex(self._normalize_header(self.header, NewValues, brdc, x, y, z))
+
+    def _normalize_header(self, header, NewValues=None, brdc=None, x=None, y=None, z=None):
+        # returns the normalized version of header (see normalize_header)
 
         if type(NewValues) is pyStationInfo.StationInfo:
             if NewValues.date is not None and NewValues.date != self.date:
@@ -1208,7 +1483,7 @@ class ReadRinex(RinexRecord):
         rinex_field = ('AntennaOffset', None, None, 'ReceiverType', 'ReceiverFw', 'ReceiverSerial',
                        'AntennaType', 'AntennaDome', 'AntennaSerial')
 
-        new_header = self.header
+        new_header = header
 
         # DDG: to keep things compatible, only check the first 4 chars of the station code (to keep the rest of the
         # stuff of RINEX 3 files)
@@ -1224,8 +1499,7 @@ class ReadRinex(RinexRecord):
             self.marker_name = marker_name
             # DDG: allow invoking without any new values to check the marker name
             if NewValues is None:
-                self.write_rinex(new_header)
-                return
+                return new_header
 
         # set values
         for i, field in enumerate(fieldnames):
@@ -1323,7 +1597,7 @@ class ReadRinex(RinexRecord):
         new_header = self.insert_comment(new_header, 'HEADER NORMALIZED BY pyRinex ON ' +
                                          datetime.datetime.now().strftime('%Y/%m/%d %H:%M'))
 
-        self.write_rinex(new_header)
+        return new_header
 
     def apply_file_naming_convention(self):
         """
@@ -4,6 +4,7 @@ Date: 02/16/2017
 Author: Demian D. Gomez
 """
 
+import io
 import os
 import subprocess
 import threading
@@ -143,4 +144,83 @@ class RunCommand():
                 return cmd.stdout, cmd.stderr
 
 
+class RunPipeline():
+    """
+    Run a chain of commands connected through pipes (cmd1 | cmd2 | ...) without a shell script and without
+    writing intermediate files. The stdout of the last command is streamed, line by line, to the consumer
+    passed to run_pipe so that it can be scanned (or written) while the pipeline is still running
+    """
+    def __init__(self, commands, time_out, cwd = None, stdin_file = None):
+        # commands is a list of argument lists, e.g. [['zcat', 'file.Z'], ['crx2rnx']]
+        self.commands   = commands
+        self.time_out   = time_out
+        self.cwd        = cwd
+        self.stdin_file = stdin_file
+
+    def run_pipe(self, consumer):
+        cmd_stdin = open(self.stdin_file, 'rb') if self.stdin_file else None
+        procs     = []
+        stderr    = []
+        readers   = []
+
+        def read_stderr(stream, i):
+            stderr[i] = stream.read().decode('utf-8', 'ignore')
 
+        try:
+            for i, cmd in enumerate(self.commands):
+                p = subprocess.Popen(cmd,
+                                     shell     = False,
+                                     stdin     = procs[-1].stdout if procs else cmd_stdin,
+                                     stdout    = subprocess.PIPE,
+                                     stderr    = subprocess.PIPE,
+                                     cwd       = self.cwd,
+                                     close_fds = True)
+                if procs:
+                    # allow the previous process to receive SIGPIPE if this one exits
+                    procs[-1].stdout.close()
+
+                procs.append(p)
+                stderr.append('')
+                readers.append(threading.Thread(target=read_stderr, args=(p.stderr, i)))
+                readers[-1].start()
+
+        except OSError:
+            for p in procs:
+                p.kill()
+            print(' | '.join(' '.join(cmd) for cmd in self.commands))
+            raise
+
+        finally:
+            if cmd_stdin:
+                cmd_stdin.close()
+
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            for p in procs:
+                try:
+                    p.kill()
+                except OSError:
+                    pass
+
+        timer = threading.Timer(self.time_out, kill)
+        timer.start()
+        try:
+            for line in io.TextIOWrapper(procs[-1].stdout, encoding='utf-8', errors='ignore'):
+                consumer(line)
+
+            for p in procs:
+                p.wait()
+        finally:
+            timer.cancel()
+            for r in readers:
+                r.join()
+
+        if timed_out.is_set():
+            raise RunCommandWithRetryExeception(
+                "Error in RunPipeline.run_pipe -- (" + ' | '.join(' '.join(cmd) for cmd in self.commands) +
+                "): Timeout after %i seconds" % self.time_out)
+
+        # remove non-ASCII chars
+        return ''.join([i if ord(i) < 128 else ' ' for i in ''.join(stderr)])
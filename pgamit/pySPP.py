@@ -0,0 +1,545 @@
+"""
+Project: Parallel.Archive
+Date: 10/19/2026
+Author: Demian D. Gomez
+
+Single point positioning (SPP) using the GPS broadcast ephemeris: the broadcast orbits are evaluated with NumPy and
+the pseudoranges of the RINEX file are adjusted with an iterated least squares (one clock per epoch, eliminated
+before solving for the coordinates). Used by pyRinex.ReadRinex.auto_coord to obtain approximate coordinates without
+running external programs. The parsed navigation files are kept in memory by each process (see NavCache)
+"""
+
+import os
+import datetime
+import threading
+from collections import OrderedDict
+
+# deps
+import numpy
+
+# app
+from pgamit import pyEvents
+from pgamit import pyProducts
+from pgamit.Utils import file_open, ecef2lla
+
+# WGS84 / IS-GPS-200 constants
+GM      = 3.986005e14
+OMEGA_E = 7.2921151467e-5
+C       = 299792458.0
+F_REL   = -4.442807633e-10
+F1      = 1575.42e6
+F2      = 1227.60e6
+
+GPS_EPOCH = datetime.datetime(1980, 1, 6)
+
+# pseudorange observables (in order of preference) for RINEX 2 and RINEX 3 files
+CODES_L1 = ('P1', 'C1', 'C1W', 'C1P', 'C1C', 'C1X')
+CODES_L2 = ('P2', 'C2', 'C2W', 'C2P', 'C2L', 'C2S', 'C2X')
+
+# DDG: seconds between the epochs used in the adjustment (more epochs do not improve an approximate coordinate)
+SPP_INTERVAL = 300
+# a priori sigma of the pseudoranges (m) used to compute the chi of the solution
+SIGMA_CODE   = 3.
+# ephemeris records are valid for +- 2 hours around toe (using 4 to allow for gaps)
+MAX_EPH_AGE  = 4 * 3600.
+
+# fields of the RINEX 2 navigation records after the epoch
+NAV_FIELDS = ('af0', 'af1', 'af2',
+              'iode', 'crs', 'dn', 'm0',
+              'cuc', 'e', 'cus', 'sqrta',
+              'toe', 'cic', 'omega0', 'cis',
+              'i0', 'crc', 'omega', 'omegadot',
+              'idot', 'codes', 'week', 'l2p',
+              'accuracy', 'health', 'tgd', 'iodc')
+
+
+class pySPPException(Exception):
+    def __init__(self, value):
+        self.value = value
+        self.event = pyEvents.Event(Description=value, EventType='error', module=type(self).__name__)
+
+    def __str__(self):
+        return str(self.value)
+
+
+def gps_seconds(year, month, day, hour, minute, second):
+    # seconds since the GPS epoch (no leap seconds: RINEX times are in GPS time)
+    return (datetime.datetime(year, month, day) - GPS_EPOCH).days * 86400. + hour * 3600. + minute * 60. + second
+
+
+def to_float(field):
+    field = field.strip()
+    return float(field.replace('D', 'E').replace('d', 'E')) if field else 0.
+
+
+class BroadcastEphemeris:
+    """
+    GPS broadcast ephemeris of a RINEX 2 navigation file as arrays (one element per record) and the Klobuchar
+    ionospheric coefficients of the header (None if not present)
+    """
+
+    def __init__(self, text):
+        lines = text.splitlines()
+
+        self.ion_alpha = None
+        self.ion_beta  = None
+
+        for i, line in enumerate(lines):
+            label = line[60:].strip()
+            try:
+                if label == 'ION ALPHA':
+                    self.ion_alpha = numpy.array([to_float(line[2 + j * 12:14 + j * 12]) for j in range(4)])
+                elif label == 'ION BETA':
+                    self.ion_beta  = numpy.array([to_float(line[2 + j * 12:14 + j * 12]) for j in range(4)])
+            except ValueError:
+                # the broadcast ionosphere is only used for single frequency observations, ignore it
+                pass
+
+            if label == 'END OF HEADER':
+                lines = lines[i + 1:]
+                break
+        else:
+            raise pySPPException('Invalid navigation file: could not find END OF HEADER tag.')
+
+        if self.ion_alpha is None or self.ion_beta is None:
+            self.ion_alpha = self.ion_beta = None
+
+        prn     = []
+        toc     = []
+        records = []
+
+        lines = [line for line in lines if line.strip()]
+        for i in range(0, len(lines) - 7, 8):
+            block = lines[i:i + 8]
+            try:
+                line = block[0]
+                year = int(line[3:5])
+                year += 2000 if year < 80 else 1900
+
+                prn.append(int(line[0:2]))
+                toc.append(gps_seconds(year, int(line[6:8]), int(line[9:11]), int(line[12:14]), int(line[15:17]),
+                                       float(line[17:22])))
+
+                values = [to_float(line[22 + j * 19:41 + j * 19]) for j in range(3)]
+                for line in block[1:7]:
+                    values += [to_float(line[3 + j * 19:22 + j * 19]) for j in range(4)]
+
+                records.append(values)
+            except (ValueError, IndexError):
+                # incomplete record, skip
+                del prn[len(records):]
+                del toc[len(records):]
+
+        if not records:
+            raise pySPPException('The navigation file does not contain any valid records.')
+
+        self.prn = numpy.array(prn)
+        self.toc = numpy.array(toc)
+
+        records = numpy.array(records)
+        for j, field in enumerate(NAV_FIELDS):
+            setattr(self, field, records[:, j])
+
+        # absolute time of ephemeris
+        self.toe_abs = self.week * 604800. + self.toe
+
+    def select(self, prn, t):
+        """
+        index of the healthy record closest to each (prn, t) or -1 if not available
+        """
+        index = numpy.full(prn.shape, -1)
+
+        for sat in numpy.unique(prn):
+            records = numpy.flatnonzero((self.prn == sat) & (self.health == 0))
+            if records.size == 0:
+                continue
+
+            obs  = numpy.flatnonzero(prn == sat)
+            age  = numpy.abs(t[obs, numpy.newaxis] - self.toe_abs[numpy.newaxis, records])
+            best = age.argmin(axis=1)
+
+            index[obs] = numpy.where(age[numpy.arange(obs.size), best] <= MAX_EPH_AGE, records[best], -1)
+
+        return index
+
+    def position(self, index, t):
+        """
+        ECEF position of the satellites (n x 3) and clock offsets (s, L1 P code) at time t (transmission time)
+        """
+        a   = self.sqrta[index] ** 2
+        e   = self.e[index]
+        tk  = t - self.toe_abs[index]
+
+        n   = numpy.sqrt(GM / a ** 3) + self.dn[index]
+        M   = self.m0[index] + n * tk
+
+        # Kepler's equation
+        E = M.copy()
+        for _ in range(10):
+            E = M + e * numpy.sin(E)
+
+        v   = numpy.arctan2(numpy.sqrt(1 - e ** 2) * numpy.sin(E), numpy.cos(E) - e)
+        phi = v + self.omega[index]
+
+        sin2phi = numpy.sin(2 * phi)
+        cos2phi = numpy.cos(2 * phi)
+
+        u = phi + self.cus[index] * sin2phi + self.cuc[index] * cos2phi
+        r = a * (1 - e * numpy.cos(E)) + self.crs[index] * sin2phi + self.crc[index] * cos2phi
+        i = self.i0[index] + self.cis[index] * sin2phi + self.cic[index] * cos2phi + self.idot[index] * tk
+
+        x = r * numpy.cos(u)
+        y = r * numpy.sin(u)
+
+        omega = self.omega0[index] + (self.omegadot[index] - OMEGA_E) * tk - OMEGA_E * self.toe[index]
+
+        xyz = numpy.column_stack((x * numpy.cos(omega) - y * numpy.cos(i) * numpy.sin(omega),
+                                  x * numpy.sin(omega) + y * numpy.cos(i) * numpy.cos(omega),
+                                  y * numpy.sin(i)))
+
+        dt  = t - self.toc[index]
+        dts = (self.af0[index] + self.af1[index] * dt + self.af2[index] * dt ** 2 +
+               F_REL * e * self.sqrta[index] * numpy.sin(E) - self.tgd[index])
+
+        return xyz, dts
+
+
+def klobuchar(alpha, beta, lat, lon, elev, azim, t):
+    """
+    L1 ionospheric delay (m) of the broadcast model (IS-GPS-200, 20.3.3.5.2.5)
+    :param alpha: ION ALPHA coefficients of the navigation file
+    :param beta: ION BETA coefficients of the navigation file
+    :param lat: latitude of the receiver (radians)
+    :param lon: longitude of the receiver (radians)
+    :param elev: elevation of the satellites (radians)
+    :param azim: azimuth of the satellites (radians)
+    :param t: time of the observations (gps seconds)
+    """
+    # the model works in semicircles
+    phi  = lat / numpy.pi
+    lam  = lon / numpy.pi
+    e    = numpy.maximum(elev, 0.) / numpy.pi
+
+    # earth centered angle and geodetic coordinates of the ionospheric pierce point
+    psi   = 0.0137 / (e + 0.11) - 0.022
+    phi_i = numpy.clip(phi + psi * numpy.cos(azim), -0.416, 0.416)
+    lam_i = lam + psi * numpy.sin(azim) / numpy.cos(phi_i * numpy.pi)
+    # geomagnetic latitude
+    phi_m = phi_i + 0.064 * numpy.cos((lam_i - 1.617) * numpy.pi)
+
+    local = numpy.mod(4.32e4 * lam_i + t, 86400.)
+    slant = 1. + 16. * (0.53 - e) ** 3
+
+    powers = phi_m[:, numpy.newaxis] ** numpy.arange(4)
+    amp    = numpy.maximum(powers @ alpha, 0.)
+    per    = numpy.maximum(powers @ beta, 72000.)
+
+    x     = 2 * numpy.pi * (local - 50400.) / per
+    delay = numpy.where(numpy.abs(x) < 1.57, 5e-9 + amp * (1 - x ** 2 / 2 + x ** 4 / 24), 5e-9)
+
+    return C * slant * delay
+
+
+class NavCache:
+    """
+    Per-process cache of the parsed broadcast navigation files (one per day). Entries are keyed by the path,
+    modification time and size of the file, the least recently used files are dropped after max_files
+    """
+
+    def __init__(self, max_files=8):
+        self.max_files = max_files
+        self.files     = OrderedDict()
+        self.lock      = threading.Lock()
+
+    def get(self, source):
+        st  = os.stat(source)
+        key = (os.path.abspath(source), st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            if key in self.files:
+                self.files.move_to_end(key)
+                return self.files[key]
+
+        # decompressed by (and kept in) the products memory of this process
+        nav = BroadcastEphemeris(pyProducts.product_memory.get(source).decode('ascii', 'ignore'))
+
+        with self.lock:
+            self.files[key] = nav
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+
+        return nav
+
+    def get_brdc(self, brdc):
+        """
+        parsed ephemeris of a pyProducts.GetBrdcOrbits object: read from the archive file (shared by all the copies
+        of the same day) if available
+        """
+        source = pyProducts.product_index.find(brdc.archive, brdc.archive_filename)
+        return self.get(source if source is not None else brdc.brdc_path)
+
+
+# DDG: navigation files parsed by this process (worker)
+nav_cache = NavCache()
+
+
+def obs_types(header):
+    """
+    GPS observation types of a RINEX header: returns (version, list of types)
+    """
+    version = 2
+    types   = []
+    gps     = False
+
+    for line in header:
+        label = line[60:].strip()
+
+        if label == 'RINEX VERSION / TYPE':
+            version = int(float(line[0:9]))
+
+        elif label == '# / TYPES OF OBSERV':
+            types += line[6:60].split()
+
+        elif label == 'SYS / # / OBS TYPES':
+            if line[0] == 'G':
+                types  = line[7:60].split()
+                gps    = True
+            elif line[0] == ' ' and types and gps:
+                types += line[7:60].split()
+            else:
+                gps    = False
+
+    return version, types
+
+
+def code_columns(types):
+    l1 = next((types.index(t) for t in CODES_L1 if t in types), None)
+    l2 = next((types.index(t) for t in CODES_L2 if t in types), None)
+
+    if l1 is None:
+        raise pySPPException('No L1 pseudorange observations in RINEX file.')
+
+    return l1, l2
+
+
+def read_pseudoranges(header, lines, interval=SPP_INTERVAL):
+    """
+    read the GPS pseudoranges of the data lines of a RINEX file (any iterable: the data streamed by ReadRinex or an
+    open file), keeping one epoch every interval seconds. Returns the time of each observation (gps seconds), prn,
+    L1 and L2 pseudoranges (nan if not available)
+    """
+    version, types = obs_types(header)
+    l1, l2 = code_columns(types)
+
+    t   = []
+    prn = []
+    p1  = []
+    p2  = []
+
+    def field(line, column, start):
+        value = line[start + column * 16:start + column * 16 + 14].strip()
+        return float(value) if value else numpy.nan
+
+    lines = iter(lines)
+    last  = None
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+
+        if version >= 3:
+            if not line.startswith('>'):
+                continue
+            flag = int(line[31:32] or 0)
+            nsat = int(line[32:35])
+            if flag > 1:
+                for _ in range(nsat):
+                    next(lines, None)
+                continue
+
+            epoch = gps_seconds(int(line[2:6]), int(line[7:9]), int(line[10:12]), int(line[13:15]),
+                                int(line[16:18]), float(line[18:29]))
+            use   = last is None or epoch - last >= interval - 0.5
+
+            for _ in range(nsat):
+                sat = next(lines, '').rstrip('\r\n')
+                if use and sat[0:1] == 'G':
+                    t.append(epoch)
+                    prn.append(int(sat[1:3]))
+                    p1.append(field(sat, l1, 3))
+                    p2.append(field(sat, l2, 3) if l2 is not None else numpy.nan)
+        else:
+            try:
+                flag = int(line[28:29])
+                nsat = int(line[29:32])
+            except ValueError:
+                continue
+
+            if flag > 1:
+                for _ in range(nsat):
+                    next(lines, None)
+                continue
+
+            sats = line[32:68]
+            for _ in range((nsat - 1) // 12):
+                sats += next(lines, '')[32:68]
+
+            year  = int(line[1:3])
+            year += 2000 if year < 80 else 1900
+            epoch = gps_seconds(year, int(line[4:6]), int(line[7:9]), int(line[10:12]), int(line[13:15]),
+                                float(line[15:26]))
+            use   = last is None or epoch - last >= interval - 0.5
+
+            for s in range(nsat):
+                sat  = sats[s * 3:s * 3 + 3]
+                data = ''
+                for _ in range((len(types) + 4) // 5):
+                    data += next(lines, '').rstrip('\r\n').ljust(80)
+
+                if use and sat[0] in ('G', ' '):
+                    t.append(epoch)
+                    prn.append(int(sat[1:3]))
+                    p1.append(field(data, l1, 0))
+                    p2.append(field(data, l2, 0) if l2 is not None else numpy.nan)
+
+        if use:
+            last = epoch
+
+    return numpy.array(t), numpy.array(prn, dtype=int), numpy.array(p1), numpy.array(p2)
+
+
+def epoch_mean(values, epoch, count):
+    # mean of the values of each epoch (values is n or n x 3)
+    if values.ndim == 1:
+        return (numpy.bincount(epoch, values, minlength=count.size) / count)[epoch]
+
+    return numpy.column_stack([epoch_mean(values[:, i], epoch, count) for i in range(values.shape[1])])
+
+
+def solve(nav, t, prn, p1, p2, x0=None, elev_mask=10., max_iter=15):
+    """
+    least squares position from the pseudoranges. The receiver clock of each epoch is eliminated by removing the
+    mean of each epoch from the observations and the design matrix. The ionosphere-free combination is used where
+    both frequencies are available, the L1 observations are corrected with the broadcast ionosphere (if the
+    navigation file has the coefficients). Returns the ECEF coordinate, the rms of the residuals (m) and the number of
+    observations used
+    """
+    # ionosphere-free combination (the broadcast clocks refer to it, so TGD is removed), L1 otherwise
+    iono_free = ~numpy.isnan(p2)
+    pr = numpy.where(iono_free, (F1 ** 2 * p1 - F2 ** 2 * p2) / (F1 ** 2 - F2 ** 2), p1)
+
+    eph  = nav.select(prn, t)
+    keep = (eph >= 0) & ~numpy.isnan(pr) & (pr > 1.5e7) & (pr < 3e7)
+
+    x = numpy.zeros(3) if x0 is None or numpy.linalg.norm(x0) < 6e6 else numpy.array(x0, dtype=float)
+
+    rms  = None
+    used = keep.copy()
+
+    for it in range(max_iter):
+        idx = numpy.flatnonzero(used)
+        if idx.size < 4:
+            raise pySPPException('Not enough pseudorange observations to compute a position (%i).' % idx.size)
+
+        # transmission time and satellite positions (rotated to the reception frame)
+        tau = pr[idx] / C
+        sat, dts = nav.position(eph[idx], t[idx] - tau)
+        sat, dts = nav.position(eph[idx], t[idx] - tau - dts)
+        dts = dts + numpy.where(iono_free[idx], nav.tgd[eph[idx]], 0.)
+
+        theta = OMEGA_E * tau
+        sat   = numpy.column_stack((sat[:, 0] * numpy.cos(theta) + sat[:, 1] * numpy.sin(theta),
+                                    sat[:, 1] * numpy.cos(theta) - sat[:, 0] * numpy.sin(theta),
+                                    sat[:, 2]))
+
+        los = sat - x
+        rho = numpy.linalg.norm(los, axis=1)
+
+        model = rho - C * dts
+
+        on_surface = numpy.linalg.norm(x) > 6e6
+        if on_surface:
+            up    = x / numpy.linalg.norm(x)
+            elev  = numpy.arcsin(los @ up / rho)
+            # simple troposphere model (zenith delay 2.3 m)
+            model = model + 2.3 / (numpy.sin(numpy.maximum(elev, 0.05)) + 0.0121)
+
+            single = ~iono_free[idx]
+            if nav.ion_alpha is not None and single.any():
+                lat, lon, _ = ecef2lla(x)
+                lat, lon    = numpy.radians(lat[0]), numpy.radians(lon[0])
+                east  = numpy.array([-numpy.sin(lon), numpy.cos(lon), 0.])
+                north = numpy.array([-numpy.sin(lat) * numpy.cos(lon), -numpy.sin(lat) * numpy.sin(lon),
+                                     numpy.cos(lat)])
+                azim  = numpy.arctan2(los[single] @ east, los[single] @ north)
+
+                model[single] += klobuchar(nav.ion_alpha, nav.ion_beta, lat, lon, elev[single], azim, t[idx][single])
+
+        _, epoch, count = numpy.unique(t[idx], return_inverse=True, return_counts=True)
+
+        A = -los / rho[:, numpy.newaxis]
+        v = pr[idx] - model
+
+        # eliminate the receiver clocks
+        A = A - epoch_mean(A, epoch, count)
+        v = v - epoch_mean(v, epoch, count)
+
+        dx, _, _, _ = numpy.linalg.lstsq(A, v, rcond=None)
+        x = x + dx
+
+        if numpy.linalg.norm(dx) < 1e-3:
+            res = v - A @ dx
+            # degrees of freedom: one clock per epoch plus the coordinates
+            dof = idx.size - count.size - 3
+            rms = numpy.sqrt(numpy.sum(res ** 2) / dof) if dof > 0 else numpy.inf
+
+            mask = numpy.ones(idx.size, dtype=bool)
+            if on_surface:
+                mask &= elev >= numpy.radians(elev_mask)
+            # epochs with a single observation do not contribute (clock absorbs everything)
+            mask &= count[epoch] > 1
+            # DDG: remove outliers (bad pseudoranges or multipath), only once the coordinate is on the surface
+            if on_surface and dof > 0:
+                mask &= numpy.abs(res) <= max(4 * rms, 4 * SIGMA_CODE)
+
+            if mask.all():
+                break
+
+            used[idx[~mask]] = False
+    else:
+        raise pySPPException('The pseudorange adjustment did not converge after %i iterations.' % max_iter)
+
+    return x, rms, idx.size
+
+
+def single_point_position(header, lines, nav, x0=None, chi_limit=3, interval=SPP_INTERVAL):
+    """
+    approximate coordinate of a RINEX file (header lines and iterable of data lines) using the parsed broadcast
+    ephemeris nav. Raises pySPPException if the sqrt(chi**2/n) of the solution is larger than chi_limit
+    """
+    t, prn, p1, p2 = read_pseudoranges(header, lines, interval)
+
+    x, rms, n = solve(nav, t, prn, p1, p2, x0)
+
+    if not rms / SIGMA_CODE < chi_limit:
+        raise pySPPException('sqrt(chi**2/n) = %.3f using %i observations. LIMIT FOR CHI**2 was %i'
+                             % (rms / SIGMA_CODE, n, chi_limit))
+
+    return x, rms
+
+
+def read_rinex_lines(path):
+    """
+    return the header and an iterator over the data lines of a RINEX file (read lazily)
+    """
+    fileio = file_open(path)
+    header = []
+    for line in fileio:
+        header.append(line)
+        if line.strip().endswith('END OF HEADER'):
+            break
+
+    def data():
+        with fileio:
+            yield from fileio
+
+    return header, data()
@@ -72,6 +72,9 @@ class Station(object):
         self.Y            = None
         self.Z            = None
         self.otl_H        = None
+        # APRs precomputed for the processing dates (see precompute_apr)
+        self.apr_table    = {}
+        self.apr_floor    = None
 
         rs = cnn.query_float('SELECT * FROM stations WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\''
                              % (NetworkCode, StationCode), as_dict=True)
@@ -122,6 +125,36 @@ class Station(object):
         else:
             raise ValueError('Specified station %s.%s could not be found' % (NetworkCode, StationCode))
 
+    def precompute_apr(self, dates, sigma_h, sigma_v):
+        """
+        Evaluate the APRs of the station for all the processing dates with observations in a single call to
+        ETM.get_xyz_s_many so that the GAMIT session setup (StationInstance) becomes a lookup
+        :param dates: list of pyDate.Date objects being processed
+        :param sigma_h: horizontal sigma floor
+        :param sigma_v: vertical sigma floor
+        """
+        good_rinex = {d.mjd for d in self.good_rinex}
+        dates      = [d for d in dates if d.mjd in good_rinex]
+
+        self.apr_table = {}
+        self.apr_floor = (sigma_h, sigma_v)
+
+        if dates:
+            xyz, sig, window, source = self.etm.get_xyz_s_many(dates, sigma_h=sigma_h, sigma_v=sigma_v)
+
+            for i, date in enumerate(dates):
+                self.apr_table[date.mjd] = (xyz[:, [i]], sig[:, [i]], window[i], source[i])
+
+    def get_xyz_s(self, date, sigma_h, sigma_v):
+        """
+        Return the APR, sigmas, jump window and source of the coordinate for a date (same as ETM.get_xyz_s), from the
+        precomputed table if available
+        """
+        if self.apr_floor == (sigma_h, sigma_v) and date.mjd in self.apr_table:
+            return self.apr_table[date.mjd]
+
+        return self.etm.get_xyz_s(date.year, date.doy, sigma_h=sigma_h, sigma_v=sigma_v)
+
     def check_gamit_soln(self, cnn, project, date):
         """
         Function to check if a gamit solution exists for this station, project and date
@@ -166,10 +199,64 @@ class Station(object):
         return self
 
 
-class StationInstance(object):
+class StationInstanceBatch(object):
+    """
+    Prefetches, with one set-based query per table, the station information, the PPP solution and the RINEX file of
+    all the stations of a session-day. StationInstance takes its data from here instead of querying the database once
+    per station (and table). A single batch can be shared by all the sessions (sub-networks) of the same day
+    """
+    def __init__(self, cnn, archive, stations, date):
+
+        self.cnn     = cnn
+        self.archive = archive
+        self.date    = date
+
+        # unique station keys
+        keys = sorted(set((stn.NetworkCode, stn.StationCode) for stn in stations))
+
+        self.stninfo = {key: [] for key in keys}
+        self.ppp     = {}
+        self.rinex   = {}
+
+        if not keys:
+            return
+
+        in_list = ', '.join('(\'%s\', \'%s\')' % key for key in keys)
+
+        rs = cnn.query('SELECT * FROM stationinfo WHERE ("NetworkCode", "StationCode") IN (%s) '
+                       'ORDER BY "NetworkCode", "StationCode", "DateStart"' % in_list)
 
-    def __init__(self, cnn, archive, station, date, GamitConfig, is_tie=False):
+        for record in rs.dictresult():
+            self.stninfo[(record['NetworkCode'], record['StationCode'])].append(record)
 
+        rs = cnn.query_float('SELECT * FROM ppp_soln WHERE "Year" = %i AND "DOY" = %i AND '
+                             '("NetworkCode", "StationCode") IN (%s)' % (date.year, date.doy, in_list), as_dict=True)
+
+        for record in rs:
+            self.ppp.setdefault((record['NetworkCode'], record['StationCode']), record)
+
+        self.rinex = archive.get_rinex_proc_records(keys, date.year, date.doy)
+
+    def get_stationinfo(self, station):
+        return pyStationInfo.StationInfo(self.cnn, station.NetworkCode, station.StationCode, self.date,
+                                         records=self.stninfo.get((station.NetworkCode, station.StationCode), []))
+
+    def get_rinex_path(self, station):
+        record = self.rinex.get((station.NetworkCode, station.StationCode))
+
+        return self.archive.format_rinex_path(record) if record is not None else None
+
+    def get_ppp(self, station):
+        return self.ppp.get((station.NetworkCode, station.StationCode))
+
+
+class StationInstance(object):
+
+    def __init__(self, cnn, archive, station, date, GamitConfig, is_tie=False, batch=None):
+        """
+        :param batch: StationInstanceBatch with the prefetched information of this session-day. If None, the
+        information is retrieved from the database
+        """
         self.NetworkCode  = station.NetworkCode
         self.StationCode  = station.StationCode
         self.StationAlias = station.StationAlias
@@ -183,40 +270,34 @@ class StationInstance(object):
         # save in the station instance if it was intended as a tie station or not
         self.is_tie       = is_tie
 
+        if batch is None:
+            batch = StationInstanceBatch(cnn, archive, [station], date)
+
         # save the station information as text
+        stninfo = batch.get_stationinfo(station)
         try:
-            self.StationInfo = pyStationInfo.StationInfo(cnn,
-                                                         station.NetworkCode,
-                                                         station.StationCode, date).return_stninfo()
+            self.StationInfo = stninfo.return_stninfo()
         except pyStationInfo.pyStationInfoHeightCodeNotFound as e:
             tqdm.write(' -- WARNING: ' + str(e) + '. Antenna height will be used as is and GAMIT may produce a fatal.')
-            self.StationInfo = pyStationInfo.StationInfo(cnn,
-                                                         station.NetworkCode,
-                                                         station.StationCode,
-                                                         date).return_stninfo(no_dharp_translate=True)
+            self.StationInfo = stninfo.return_stninfo(no_dharp_translate=True)
 
         self.date         = date  # type: pyDate.Date
         self.Archive_path = GamitConfig.archive_path
 
         # get the APR and sigmas for this date (let get_xyz_s determine which side of the jump returns, if any)
         self.Apr, self.Sigmas, \
-            self.Window, self.source = station.etm.get_xyz_s(self.date.year, self.date.doy,
-                                                             sigma_h=float(GamitConfig.gamitopt['sigma_floor_h']),
-                                                             sigma_v=float(GamitConfig.gamitopt['sigma_floor_v']))
+            self.Window, self.source = station.get_xyz_s(self.date,
+                                                         sigma_h=float(GamitConfig.gamitopt['sigma_floor_h']),
+                                                         sigma_v=float(GamitConfig.gamitopt['sigma_floor_v']))
 
         # rinex file
-        self.ArchiveFile = archive.build_rinex_path(self.NetworkCode, self.StationCode,
-                                                    self.date.year, self.date.doy)
+        self.ArchiveFile = batch.get_rinex_path(station)
 
         # DDG: force RINEX 2 filenames even with RINEX 3 data
         self.filename = self.StationAlias + self.date.ddd() + '0.' + self.date.yyyy()[2:4] + 'd.Z'
 
         # save some information for debugging purposes
-        rs = cnn.query_float('SELECT * FROM ppp_soln WHERE "NetworkCode" = \'%s\' AND "StationCode" = \'%s\' AND '
-                             '"Year" = %s AND "DOY" = %s'
-                             % (self.NetworkCode, self.StationCode, self.date.yyyy(), self.date.ddd()), as_dict=True)
-
-        self.ppp = rs[0] if len(rs) > 0 else None
+        self.ppp = batch.get_ppp(station)
 
     def GetRinexFilename(self):
 
@@ -351,6 +432,13 @@ class StationCollection(list):
 
         return collection
 
+    def precompute_apr(self, dates, sigma_h, sigma_v):
+        """
+        precompute the APRs of all the stations in the collection for the processing dates (see Station.precompute_apr)
+        """
+        for stn in self:
+            stn.precompute_apr(dates, sigma_h, sigma_v)
+
     def get_active_coordinates(self, date):
         """
         obtain a numpy array of the coordinates for the active stations in the collection
@@ -3,11 +3,110 @@
 #import file_ops
 import os
 import re
+import gzip
+import mmap
+import subprocess
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+# deps
+import numpy
 
 # app
 from pgamit.Utils import get_norm_year_str, file_open
 
+# blocks loaded by snxFileParser.parse when no list of blocks is given
+DEFAULT_BLOCKS = ('SITE/ID', 'SOLUTION/STATISTICS', 'SOLUTION/ESTIMATE', 'SOLUTION/MATRIX_ESTIMATE')
+
+# start (+) and end (-) markers of the blocks, e.g. +SOLUTION/MATRIX_ESTIMATE L COVA
+BLOCK_PATTERN = re.compile(rb'^([+-])(\S+)[ \t]*([^\r\n]*)', re.M)
+
+# fixed-width fields (first and last + 1 columns) of the data lines of each block
+SITE_ID_COLUMNS  = {'code': (1, 5), 'domes': (9, 18)}
+ESTIMATE_COLUMNS = {'index': (1, 6), 'type': (7, 13), 'code': (14, 18), 'pt': (19, 21), 'epoch': (27, 39),
+                    'value': (47, 68), 'std': (69, 80)}
+MATRIX_COLUMNS   = {'para1': (1, 6), 'para2': (7, 12), 'value1': (13, 34), 'value2': (35, 56), 'value3': (57, 78)}
+
+
+def read_sinex(path):
+    """
+    return the contents of a SINEX file: a read-only memory map for uncompressed files (only the pages of the blocks
+    that are parsed are read from disk) or the decompressed bytes of .gz and .Z files
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+
+    elif path.endswith('.Z'):
+        # DDG: gzip can decompress unix compress files, python can't
+        return subprocess.run(['gzip', '-dc', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              check=True).stdout
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def fixed_width(lines, columns):
+    """
+    split fixed-width lines into columns
+    :param lines: list of lines (bytes)
+    :param columns: dictionary with the first and last + 1 column of each field
+    :return: dictionary with a numpy array of bytes per field (blank fields are empty)
+    """
+    width = max(end for _, end in columns.values())
+    chars = numpy.array(lines, dtype='S%i' % width).view('S1').reshape(len(lines), width)
+    # short lines are padded with nulls
+    chars[(chars == b'') | (chars == b'\r')] = b' '
+
+    fields = {}
+    for name, (start, end) in columns.items():
+        fields[name] = numpy.char.strip(numpy.ascontiguousarray(chars[:, start:end])
+                                        .view('S%i' % (end - start)).ravel())
+    return fields
+
+
+def to_float(field):
+    """
+    convert a field to float (blank values are nan)
+    """
+    return numpy.where(field == b'', b'nan', field).astype(float)
+
+
+class SinexMatrix:
+    """
+    symmetric matrix from a SOLUTION/MATRIX_ESTIMATE block stored as its packed lower triangle (row by row).
+    Parameters use the 1-based indices of the SINEX file. Elements not present in the block are nan
+    """
+
+    def __init__(self, n, kind='COVA'):
+        self.n      = n
+        self.kind   = kind
+        self.packed = numpy.full(n * (n + 1) // 2, numpy.nan)
+
+    @staticmethod
+    def packed_index(i, j):
+        # indices are 1-based, the matrix is symmetric
+        i, j = numpy.maximum(i, j) - 1, numpy.minimum(i, j) - 1
+        return i * (i + 1) // 2 + j
+
+    def set(self, i, j, values):
+        self.packed[self.packed_index(numpy.asarray(i), numpy.asarray(j))] = values
+
+    def get(self, i, j):
+        return self.packed[self.packed_index(numpy.asarray(i), numpy.asarray(j))]
+
+    def dense(self):
+        """
+        :return: the full n x n matrix (elements not present in the block are zero)
+        """
+        rows, cols = numpy.tril_indices(self.n)
+        matrix = numpy.zeros((self.n, self.n))
+        matrix[rows, cols] = numpy.nan_to_num(self.packed)
+        matrix[cols, rows] = matrix[rows, cols]
+        return matrix
+
 
 class StationData:
     
@@ -120,306 +219,236 @@ class snxFileParser:
         self.varianceFactor = 1
         self.observations   = 0
         self.unknowns       = 0
+
+        # contents of the file, blocks found (name -> title, first and last byte) and parsed data
+        self.data       = None
+        self.blocks     = {}
+        self.statistics = {}
+        self.estimates  = None
+        self.matrix     = None
         
         # iter protocol shit
         self.iterIndx = 0
         self.iterList = None    
-        
-    def parse(self):
-        
-        foundSolutionEstimate           = False
-        inSolutionEstimateSection       = False
-        inSolutionMatrixEstimateSection = False
-        isHeaderLine                    = False
-        
-        foundSiteId     = False
-        inSiteIdSection = False
-
-        dictID = {}
-        stn_ID = {}
-
-        # if there's a file to parse
-        if self.snxFilePath != None:
-            # flag to rezip at end
-            wasZipped     = False
-            wasCompressed = False
-            
-            # check for gzip
-            if self.snxFilePath[-2:] == "gz":
-                #file_ops.gunzip(self.snxFilePath)
-                self.snxFilePath = self.snxFilePath[0:-3]
-                wasZipped        = True
-            
-            # check for unix compression
-            elif self.snxFilePath[-1:] == "Z":
-                #file_ops.uncompress(self.snxFilePath)
-                self.snxFilePath = self.snxFilePath[0:-2]
-                wasCompressed    = True
-                
-            # open the file
-            try:
-                snxFileHandle = file_open(self.snxFilePath)
-            except:
-                print("snxFileParser ERROR:  Could not open file " + self.snxFilePath + " !!!") 
-                raise
-
-            with snxFileHandle:
-                #make pattern to match to snx organization ...
-                self.snxFileName = os.path.basename(self.snxFilePath)
-
-                # @todo optimize by pre-compiling regexes
-                orgPattern   = re.compile(r'^([a-zA-Z]+).*\.f?snx$')
-                orgMatch     = orgPattern.findall(self.snxFileName)
-                self.orgName = orgMatch[0].upper()
-
-                # make pattern to look for SiteId start tag
-                siteIdStartPattern = re.compile(r'^\+SITE\/ID$')
-
-                # make pattern to look for end of siteId section
-                siteIdEndPattern   = re.compile(r'^\-SITE\/ID$')
-
-                # make pattern to parse the siteId lines
-                # Example:
-                #
-                #     TROM  A 82397M001 P , USA                   18 56 18.0  69 39 45.9   135.4
-                #
-                siteIdPattern      = re.compile(r'^\s+(\w+)\s+\w\s+(\w+).*$')
-
-                # variance factor patther
-                # Example:
-                #
-                # VARIANCE FACTOR                    0.048618461936712
-                #
-                #
-                varianceFactorPattern = re.compile(r'^ VARIANCE FACTOR\s+([\d+]?\.\d+)$')
-                observationsPattern   = re.compile(r'^ NUMBER OF OBSERVATIONS\s+(\d+)$')
-                unknownsPattern       = re.compile(r'^ NUMBER OF UNKNOWNS\s+(\d+)$')
-
-                # Make pattern to look for solution estimate start tag
-                startSolutionEstimatePattern = re.compile(r'^\+SOLUTION\/ESTIMATE.*')
-
-                # make pattern to look for solution estimate end tag
-                endSolutionEstimatePattern = re.compile(r'^\-SOLUTION\/ESTIMATE.*')
-
-                # make pattern to look for the L COVA start tag (+SOLUTION/MATRIX_ESTIMATE L COVA)
-                startSolutionMatrixEstimate = re.compile(r'^\+SOLUTION\/MATRIX_ESTIMATE.*')
-
-                # make pattern to look for the L COVA end tag (-SOLUTION/MATRIX_ESTIMATE L COVA)
-                endSolutionMatrixEstimate = re.compile(r'^\-SOLUTION\/MATRIX_ESTIMATE.*')
-
-                # make pattern to look for station coordinates
-                # Example:
-                #
-                #   1 STAX   ALGO  A ---- 05:180:43200 m    2 .91812936331043008E+6 .2511266E-2
-                #
-                stationCoordinatePattern = re.compile(r'^\s+(\d+)+\s+STA(\w)\s+(\w+)\s+(\w).*\d+\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)$')
-
-                # make pattern to look for station velocities
-                # Example:
-                #
-                # 916 VELX   YAKA  A    1 00:001:00000 m/y  2 -.219615010076079E-01 0.13728E-03
-                #
-                stationVelocityPattern = re.compile(r'^\s+\d+\s+VEL(\w)\s+(\w+)\s+\w\s+....\s+(\d\d:\d\d\d).*\d+\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)$')
-
-                for line in snxFileHandle:
-
-                    if siteIdStartPattern.findall(line):
-                        inSiteIdSection = True
-                        continue
-
-                    elif siteIdEndPattern.findall(line):
-                        inSiteIdSection = False
-                        continue
-
-                    # check for solution estimate section
-                    elif startSolutionEstimatePattern.findall(line):
-                        inSolutionEstimateSection = True
-                        continue
-
-                    elif endSolutionEstimatePattern.findall(line):
-                        inSolutionEstimateSection = False
-                        continue
-
-                    elif startSolutionMatrixEstimate.findall(line):
-                        inSolutionMatrixEstimateSection = True
-                        continue
-
-                    elif endSolutionMatrixEstimate.findall(line):
-                        inSolutionMatrixEstimateSection = False
-                        break
-
-                    m = varianceFactorPattern.findall(line)
-                    if m:
-                        self.varianceFactor = float(m[0])                    
-
-                    m = unknownsPattern.findall(line)
-                    if m:
-                        self.unknowns = float(m[0])
-
-                    m = observationsPattern.findall(line)
-                    if m:
-                        self.observations = float(m[0])
-
-
-                    if inSiteIdSection:
-                        # parse the siteID line
-                        siteIdMatch = siteIdPattern.findall(line)
-
-                        # blab about it
-                        #print siteIdMatch
-
-                        # if the line does not contain a match then move along
-                        if not siteIdMatch:
-                            continue
-
-                        # extract the parsed info
-                        (stationName, domesNumber) = siteIdMatch[0]
-
-                        # make sure the name is upper case
-                        stationName = stationName.upper()
-
-                        # initialize station data if not seen this station before
-                        if not stationName in self.stationDict:
-                            self.stationDict[stationName] = StationData()
-
-                        self.stationDict[stationName].domesNumber = domesNumber
-
-                        #print "set domes number "+ domesNumber +" for station "+stationName
-
-
-                    # if in the solution estimate section
-                    if inSolutionEstimateSection:
-
-                        # check for station coordinate match
-                        stationCoordinateMatch = stationCoordinatePattern.findall(line)
-
-                        #print line
-                        #print stationCoordinateMatch
-
-                        # if match then store result                    
-                        if stationCoordinateMatch:
-                            (ID,
-                             coordID,
-                             stationName,
-                             pointCode,
-                             coord,
-                             sigCoord
-                             ) = stationCoordinateMatch[0]
-
-                            if pointCode != 'A': 
-                                os.sys.stderr.write('ignoring solution/estimate STA'+coordID \
-                                                    +' for station: '+stationName            \
-                                                    +', point code = '+pointCode             \
-                                                    +', file = '+ self.snxFileName           \
-                                                    +'\n'                                    \
-                                )
-                                continue
 
-                            # make sure station name is upper case 
-                            stationName = stationName.upper()
+    def index(self):
+        """
+        read the file and find the blocks without parsing them
+        """
+        path = self.snxFilePath
 
-                            # save the correspondance between the ID and the coordID and stationName
-                            dictID[ID] = coordID
-                            stn_ID[ID] = stationName
+        # DDG: compressed files are read directly. For backwards compatibility, if the compressed file does not exist,
+        # look for the uncompressed one
+        if path.endswith('.gz') or path.endswith('.Z'):
+            if not os.path.isfile(path):
+                path = os.path.splitext(path)[0]
+            self.snxFileName = os.path.basename(os.path.splitext(self.snxFilePath)[0])
 
-                            if not stationName in self.stationDict:
-                                self.stationDict[stationName] = StationData()
-
-                            if coordID == 'X':
-                                self.stationDict[stationName].X    = float(coord)
-                                self.stationDict[stationName].sigX = float(sigCoord)
-
-                            elif coordID == 'Y':
-                                self.stationDict[stationName].Y    = float(coord)
-                                self.stationDict[stationName].sigY = float(sigCoord)
-
-                            else:
-                                self.stationDict[stationName].Z    = float(coord)
-                                self.stationDict[stationName].sigZ = float(sigCoord)
-
-
-                        # check for station velocity match
-                        stationVelocityMatch = stationVelocityPattern.findall(line)
-
-                        if stationVelocityMatch:
-
-                            (             \
-                             coordID,     \
-                             stationName, \
-                             refEpoch,    \
-                             vel,         \
-                             sigVel       \
-                            ) = stationVelocityMatch[0]
-
-                            stationName = stationName.upper()
-
-                            # parse refEpoch String
-                            (year,doy) = refEpoch.split(':')
-
-                            # convert from string
-                            doy = float(doy)
-
-                            # normalize the year and convert to float
-                            year = float(get_norm_year_str(year))
-
-                            #compute fractional year to match matlab round off
-                            fractionalYear = year+((doy-1)/366.0)+ 0.001413
-
-                            # init if not already in dict
-                            if not stationName in self.stationDict:
-                                self.stationDict[stationName] = StationData()
-
-                            # set the reference epoch for the velocity    
-                            self.stationDict[stationName].refEpoch    =  fractionalYear
-
-                            if coordID == 'X':
-                                self.stationDict[stationName].velX    = float(vel)
-                                self.stationDict[stationName].sigVelX = float(sigVel)
+        try:
+            self.data = read_sinex(path)
+        except:
+            print("snxFileParser ERROR:  Could not open file " + path + " !!!")
+            raise
 
-                            elif coordID == 'Y':
-                                self.stationDict[stationName].velY    = float(vel)
-                                self.stationDict[stationName].sigVelY = float(sigVel)
+        # make pattern to match to snx organization ...
+        orgMatch     = re.findall(r'^([a-zA-Z]+).*\.f?snx$', self.snxFileName)
+        self.orgName = orgMatch[0].upper() if orgMatch else None
+
+        self.blocks = {}
+        current     = None
+        for m in BLOCK_PATTERN.finditer(self.data):
+            sign, name, title = m.group(1), m.group(2).decode(), m.group(3).decode().strip()
+            if sign == b'+':
+                current = (name, title, m.end() + 1)
+            elif current is not None and current[0] == name:
+                # only the first occurrence of each block is kept
+                self.blocks.setdefault(name, (current[1], current[2], m.start()))
+                current = None
 
-                            else:
-                                self.stationDict[stationName].velZ    = float(vel)
-                                self.stationDict[stationName].sigVelZ = float(sigVel)
+        return self
 
+    def block_lines(self, name):
+        """
+        :return: data lines (comments removed) of a block as a list of bytes
+        """
+        if name not in self.blocks:
+            return []
+
+        _, start, end = self.blocks[name]
+        return [line for line in self.data[start:end].split(b'\n') if line[:1] == b' ']
+
+    def parse(self, blocks=DEFAULT_BLOCKS):
+        """
+        parse the requested blocks of the SINEX file (see DEFAULT_BLOCKS). Coordinates, velocities and the station
+        covariances are stored in stationDict (StationData objects), the estimates in numpy arrays (see estimates) and
+        the covariance matrix as a packed triangle (see SinexMatrix)
+        :param blocks: names of the blocks to parse
+        :return: self
+        """
+        # if there's a file to parse
+        if self.snxFilePath is None:
+            return
 
-            # regzip the file is was .gz
-            #if wasZipped:
-                #file_ops.gzip(self.snxFilePath)
+        self.index()
 
-            # recompress the file if was .Z    
-            #if wasCompressed:
-                #file_ops.compress(self.snxFilePath)
+        try:
+            if 'SOLUTION/STATISTICS' in blocks:
+                self.parse_statistics()
 
-                    if inSolutionMatrixEstimateSection:
-                        matrixLine = line.split()
+            if 'SITE/ID' in blocks:
+                self.parse_site_id()
 
-                        ID1 = matrixLine[0]
+            if 'SOLUTION/ESTIMATE' in blocks:
+                self.parse_estimate()
 
-                        # check that the key is actually a station variance-covariance item
-                        if ID1 in list(stn_ID.keys()):
+                if 'SOLUTION/MATRIX_ESTIMATE' in blocks:
+                    self.parse_matrix()
+        finally:
+            # release the memory map
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+            self.data = None
 
-                            for i, ID2 in enumerate(range(len(matrixLine) - 2)):
-                                ID2 = str(int(matrixLine[1]) + i)
+        return self
 
-                                if stn_ID[ID1] == stn_ID[ID2] and dictID[ID1] != dictID[ID2]:
-                                    # we already have the variance, we want the covariance
-                                    if (dictID[ID1] == 'X' and dictID[ID2] == 'Y') or \
-                                       (dictID[ID1] == 'Y' and dictID[ID2] == 'X'):
-                                        self.stationDict[stn_ID[ID1]].sigXY = float(matrixLine[i+2])
+    def parse_statistics(self):
+        # Example:
+        #
+        # VARIANCE FACTOR                    0.048618461936712
+        #
+        for line in self.block_lines('SOLUTION/STATISTICS'):
+            label = line[1:31].decode(errors='ignore').strip()
+            try:
+                self.statistics[label] = float(line[31:].split()[0])
+            except (ValueError, IndexError):
+                continue
+
+        self.varianceFactor = self.statistics.get('VARIANCE FACTOR', self.varianceFactor)
+        self.observations   = self.statistics.get('NUMBER OF OBSERVATIONS', self.observations)
+        self.unknowns       = self.statistics.get('NUMBER OF UNKNOWNS', self.unknowns)
+
+    def parse_site_id(self):
+        # Example:
+        #
+        #     TROM  A 82397M001 P , USA                   18 56 18.0  69 39 45.9   135.4
+        #
+        lines = self.block_lines('SITE/ID')
+        if not lines:
+            return
+
+        fields = fixed_width(lines, SITE_ID_COLUMNS)
+        for code, domes in zip(fields['code'], fields['domes']):
+            domes = domes.decode(errors='ignore')
+            # stations without domes (---------) are skipped
+            if not domes.isalnum():
+                continue
+
+            stationName = code.decode(errors='ignore').upper()
+            self.stationDict.setdefault(stationName, StationData()).domesNumber = domes
+
+    def parse_estimate(self):
+        # Example:
+        #
+        #      1 STAX   ALGO  A    1 05:180:43200 m    2 .91812936331043008E+6 .2511266E-2
+        #    916 VELX   YAKA  A    1 00:001:00000 m/y  2 -.219615010076079E-01 0.13728E-03
+        #
+        lines = self.block_lines('SOLUTION/ESTIMATE')
+        if not lines:
+            return
 
-                                    elif (dictID[ID1] == 'X' and dictID[ID2] == 'Z') or \
-                                         (dictID[ID1] == 'Z' and dictID[ID2] == 'X'):
-                                        self.stationDict[stn_ID[ID1]].sigXZ = float(matrixLine[i + 2])
+        try:
+            fields = fixed_width(lines, ESTIMATE_COLUMNS)
+            index  = fields['index'].astype(int)
+            value  = to_float(fields['value'])
+            std    = to_float(fields['std'])
+        except ValueError:
+            # not a fixed-width file: split the lines using white spaces
+            tokens = [line.split() for line in lines]
+            fields = {'type' : numpy.array([t[1] for t in tokens]),
+                      'code' : numpy.array([t[2] for t in tokens]),
+                      'pt'   : numpy.array([t[3] for t in tokens]),
+                      'epoch': numpy.array([t[5] for t in tokens])}
+            index  = numpy.array([int(t[0]) for t in tokens])
+            value  = numpy.array([float(t[-2]) for t in tokens])
+            std    = numpy.array([float(t[-1]) for t in tokens])
+
+        self.estimates = {'index': index,
+                          'type' : numpy.char.decode(fields['type']),
+                          'code' : numpy.char.upper(numpy.char.decode(fields['code'])),
+                          'pt'   : numpy.char.decode(fields['pt']),
+                          'epoch': numpy.char.decode(fields['epoch']),
+                          'value': value,
+                          'std'  : std}
+
+        stations = numpy.isin(self.estimates['type'], ('STAX', 'STAY', 'STAZ', 'VELX', 'VELY', 'VELZ'))
+        for i in numpy.flatnonzero(stations & (self.estimates['pt'] != 'A')):
+            os.sys.stderr.write('ignoring solution/estimate ' + self.estimates['type'][i]
+                                + ' for station: ' + self.estimates['code'][i]
+                                + ', point code = ' + self.estimates['pt'][i]
+                                + ', file = ' + self.snxFileName + '\n')
+
+        for i in numpy.flatnonzero(stations & (self.estimates['pt'] == 'A')):
+            ptype   = self.estimates['type'][i]
+            coordID = ptype[3]
+            stnData = self.stationDict.setdefault(self.estimates['code'][i], StationData())
+
+            if ptype.startswith('STA'):
+                setattr(stnData, coordID, float(value[i]))
+                setattr(stnData, 'sig' + coordID, float(std[i]))
+            else:
+                # parse refEpoch String
+                (year, doy) = self.estimates['epoch'][i].split(':')[0:2]
+
+                # normalize the year and convert to float
+                year = float(get_norm_year_str(year))
+
+                # compute fractional year to match matlab round off
+                stnData.refEpoch = year + ((float(doy) - 1) / 366.0) + 0.001413
+
+                setattr(stnData, 'vel' + coordID, float(value[i]))
+                setattr(stnData, 'sigVel' + coordID, float(std[i]))
+
+    def parse_matrix(self):
+        lines = self.block_lines('SOLUTION/MATRIX_ESTIMATE')
+        if not lines or self.estimates is None:
+            return
+
+        title = self.blocks['SOLUTION/MATRIX_ESTIMATE'][0].split()
 
-                                    elif (dictID[ID1] == 'Y' and dictID[ID2] == 'Z') or \
-                                         (dictID[ID1] == 'Z' and dictID[ID2] == 'Y'):
-                                        self.stationDict[stn_ID[ID1]].sigYZ = float(matrixLine[i + 2])
+        try:
+            fields = fixed_width(lines, MATRIX_COLUMNS)
+            para1  = fields['para1'].astype(int)
+            para2  = fields['para2'].astype(int)
+            values = numpy.column_stack([to_float(fields['value%i' % k]) for k in (1, 2, 3)])
+        except ValueError:
+            tokens = [line.split() for line in lines]
+            para1  = numpy.array([int(t[0]) for t in tokens])
+            para2  = numpy.array([int(t[1]) for t in tokens])
+            values = numpy.array([[float(v) for v in t[2:5]] + [numpy.nan] * (5 - len(t)) for t in tokens])
+
+        n = int(max(self.estimates['index'].max(), para1.max(), para2.max()))
+        self.matrix = SinexMatrix(n, title[1] if len(title) > 1 else 'COVA')
+
+        # each line has up to three elements: (para1, para2), (para1, para2 + 1) and (para1, para2 + 2)
+        rows = numpy.repeat(para1, 3)
+        cols = (para2[:, numpy.newaxis] + numpy.arange(3)).ravel()
+        vals = values.ravel()
+        valid = ~numpy.isnan(vals) & (cols <= n)
+        self.matrix.set(rows[valid], cols[valid], vals[valid])
+
+        # covariances between the coordinates of each station
+        est  = self.estimates
+        keep = (est['pt'] == 'A') & numpy.isin(est['type'], ('STAX', 'STAY', 'STAZ'))
+        param = {(code, ptype[3]): idx for code, ptype, idx in zip(est['code'][keep], est['type'][keep],
+                                                                   est['index'][keep])}
+
+        for stationName, stnData in self.stationDict.items():
+            for a, b in (('X', 'Y'), ('X', 'Z'), ('Y', 'Z')):
+                if (stationName, a) in param and (stationName, b) in param:
+                    cov = self.matrix.get(param[(stationName, a)], param[(stationName, b)])
+                    if not numpy.isnan(cov):
+                        setattr(stnData, 'sig' + a + b, float(cov))
 
-            return self
-                            
     def Print(self,key=None,fid=None):
         
         if key != None and self.contains(key):
@@ -467,6 +496,200 @@ class snxFileParser:
             return None
 
 
+def open_sinex(path, mode='r', name=None):
+    """
+    open a SINEX file in text mode (compressed with gzip if the name ends in .gz)
+    :param name: name that decides the compression when different from path (e.g. a temporary file)
+    """
+    if (name if name else path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', errors='ignore')
+    return file_open(path, mode)
+
+
+class SinexTransformer:
+    """
+    one-pass rewrite of a SINEX file with constant memory: adds the parameters that are not in the file (e.g. the
+    tropospheric delays estimated by GAMIT) to the NUMBER OF UNKNOWNS, writes the statistics that glbtosnx does not
+    report, fills in the DOMES numbers missing in SITE/ID and removes unwanted blocks
+    """
+
+    def __init__(self, implicit_unknowns=None, statistics='', domes=None, drop_blocks=()):
+        """
+        :param implicit_unknowns: number of parameters to add to the NUMBER OF UNKNOWNS (None: do not modify)
+        :param statistics: text written to SOLUTION/STATISTICS after NUMBER OF UNKNOWNS and DEGREES OF FREEDOM
+        :param domes: dictionary station code (upper case) -> DOMES number
+        :param drop_blocks: names of the blocks to remove (e.g. SOLUTION/MATRIX_APRIORI)
+        """
+        self.implicit_unknowns = implicit_unknowns
+        self.statistics        = statistics
+        self.domes             = domes if domes else {}
+        self.drop_blocks       = set(drop_blocks)
+        # original and new number of unknowns
+        self.unknowns          = (None, None)
+
+    def transform(self, sinex, output=None):
+        """
+        :param sinex: input file (can be compressed with gzip)
+        :param output: output file (default: replace the input file)
+        :return: self
+        """
+        output = output if output else sinex
+        tmp    = os.path.join(os.path.dirname(os.path.abspath(output)),
+                              '.%s.%i.tmp' % (os.path.basename(output), os.getpid()))
+
+        observations = 0
+        block        = None
+        skip         = False
+
+        try:
+            with open_sinex(sinex) as src, open_sinex(tmp, 'w', output) as dst:
+                for line in src:
+                    if line[:1] in ('+', '-'):
+                        name  = line[1:].split()[0] if line[1:].split() else ''
+                        block = name if line[:1] == '+' else None
+                        if name in self.drop_blocks:
+                            # also skip the end marker
+                            skip = line[:1] == '+'
+                            continue
+
+                    if skip:
+                        continue
+
+                    if block == 'SOLUTION/STATISTICS' and line[:1] == ' ':
+                        label = line[1:31].strip()
+                        if label == 'NUMBER OF OBSERVATIONS':
+                            observations = int(float(line[31:].split()[0]))
+
+                        elif label == 'NUMBER OF UNKNOWNS' and self.implicit_unknowns is not None:
+                            unknowns      = int(float(line[31:].split()[0]))
+                            new_unknowns  = unknowns + self.implicit_unknowns
+                            self.unknowns = (unknowns, new_unknowns)
+                            dst.write(' NUMBER OF UNKNOWNS%22i\n'
+                                      ' NUMBER OF DEGREES OF FREEDOM%12i\n' % (new_unknowns,
+                                                                             observations - new_unknowns))
+                            dst.write(self.statistics)
+                            continue
+
+                    elif block == 'SITE/ID' and line[5:18] == '  A ---------' and line[1:5] in self.domes:
+                        # " BATF  A ---------"
+                        line = line[:9] + self.domes[line[1:5]] + line[18:]
+
+                    dst.write(line)
+
+            os.replace(tmp, output)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        return self
+
+
+class ImplicitUnknowns:
+    """
+    number of GAMIT parameters that are not in the SINEX files (two per station-day in gamit_soln and the zenith
+    delays in gamit_ztd), loaded for a whole time span with one query per table
+    """
+
+    def __init__(self, cnn, project, start, end):
+        """
+        :param start: pyDate.Date of the first day of the span
+        :param end: pyDate.Date of the last day of the span
+        """
+        rs = cnn.query('SELECT "Year", "DOY", "StationCode", count("Year") AS cc FROM gamit_soln '
+                       'WHERE "Project" = \'%s\' AND "FYear" BETWEEN %.4f AND %.4f '
+                       'GROUP BY "Year", "DOY", "StationCode"'
+                       % (project, start.first_epoch('fyear'), end.last_epoch('fyear'))).dictresult()
+
+        self.soln = {}
+        for r in rs:
+            self.soln.setdefault((int(r['Year']), int(r['DOY'])), {})[r['StationCode']] = int(r['cc'])
+
+        rs = cnn.query('SELECT "Year", "DOY", count("ZTD") AS cc FROM gamit_ztd '
+                       'WHERE "Date" BETWEEN \'%s\' AND \'%s\' GROUP BY "Year", "DOY"'
+                       % (start.first_epoch(), end.last_epoch())).dictresult()
+
+        self.ztd = {(int(r['Year']), int(r['DOY'])): int(r['cc']) for r in rs}
+
+    def get(self, stations, start, end):
+        """
+        :param stations: station codes (lower case) in the SINEX file
+        :return: the same numbers that process_sinex used to obtain with its queries: the station coordinate
+                 parameters and the zenith delays plus the station parameters (see update_sinex)
+        """
+        span     = ((start.year, start.doy), (end.year, end.doy))
+        stations = set(stations)
+
+        zg = 2 * sum(cc for day, counts in self.soln.items() if span[0] <= day <= span[1]
+                     for stn, cc in counts.items() if stn in stations)
+        zd = sum(cc for day, cc in self.ztd.items() if span[0] <= day <= span[1]) + zg
+
+        return zg, zd
+
+
+def sinex_summary(sinex):
+    """
+    :return: station codes (lower case), number of observations and number of unknowns of a SINEX file
+    """
+    snx = snxFileParser(sinex).parse(blocks=('SITE/ID', 'SOLUTION/STATISTICS', 'SOLUTION/ESTIMATE'))
+    return [stn.lower() for stn in snx.stationDict.keys()], snx.observations, snx.unknowns
+
+
+def transform_sinex(sinex, transformer):
+    return transformer.transform(sinex)
+
+
+def update_sinex(cnn, project, sinex_files, statistics='', drop_blocks=(), workers=None):
+    """
+    add the GAMIT parameters that are not in the SINEX files to the NUMBER OF UNKNOWNS and the DOMES numbers from the
+    stations table. The files are processed in parallel and the database is queried once for all of them
+    :param cnn: connection to the database
+    :param project: GAMIT project that produced the solutions
+    :param sinex_files: list of tuples (path to a SINEX file, [pyDate.Date start, pyDate.Date end])
+    :param statistics: text written to SOLUTION/STATISTICS after the number of unknowns (see SinexTransformer)
+    :param drop_blocks: names of the blocks to remove from the files
+    :param workers: number of processes (default: one per CPU)
+    :return: list of SinexTransformer objects, one per file
+    """
+    if not sinex_files:
+        return []
+
+    workers = min(len(sinex_files), workers if workers else os.cpu_count())
+
+    with ProcessPoolExecutor(workers) as pool:
+        summaries = list(pool.map(sinex_summary, [sinex for sinex, _ in sinex_files]))
+
+        start = min(dates[0] for _, dates in sinex_files)
+        end   = max(dates[1] for _, dates in sinex_files)
+
+        implicit = ImplicitUnknowns(cnn, project, start, end)
+
+        codes = sorted(set(stn for stations, _, _ in summaries for stn in stations))
+        domes = {}
+        if codes:
+            rs = cnn.query('SELECT "NetworkCode", "StationCode", dome FROM stations '
+                           'WHERE "StationCode" IN (\'%s\') '
+                           'ORDER BY "NetworkCode", "StationCode"' % '\',\''.join(codes))
+            # if a code exists in more than one network, the first DOMES is used
+            for stn in rs.dictresult():
+                if stn['dome'] is not None:
+                    domes.setdefault(stn['StationCode'].upper(), stn['dome'])
+
+        futures = []
+        for (sinex, dates), (stations, _, unknowns) in zip(sinex_files, summaries):
+            zg, zd = implicit.get(stations, dates[0], dates[1])
+
+            print(' >> %s: adding NUMBER OF UNKNOWNS: %i (previous value: %i) and DOMES'
+                  % (os.path.basename(sinex), zd, unknowns))
+
+            transformer = SinexTransformer(zg + zd, statistics,
+                                           {stn.upper(): domes[stn.upper()] for stn in stations
+                                            if stn.upper() in domes},
+                                           drop_blocks)
+            futures.append(pool.submit(transform_sinex, sinex, transformer))
+
+        return [future.result() for future in futures]
+
+
 class snxStationMerger:
     
     def __init__(self):
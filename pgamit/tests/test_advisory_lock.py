@@ -0,0 +1,78 @@
+# Created: October 2026
+
+import threading
+import time
+
+import pytest
+
+from ..dbConnection import (AdvisoryLock, LocalLockBackend, advisory_lock_key,
+                            dbErrLockTimeout)
+
+
+def test_lock_key_is_stable():
+    """Keys must be the same in every process (python's hash() is salted)"""
+
+    assert advisory_lock_key('???', 'igm1') == advisory_lock_key('???', 'igm1')
+    assert advisory_lock_key('???', 'igm1') != advisory_lock_key('???', 'igm0')
+    assert -2**63 <= advisory_lock_key('rms', 'igm1', 'igm10010.24d.Z') < 2**63
+
+
+def test_mutual_exclusion():
+    """Only one thread at a time can be inside the critical section"""
+
+    backend = LocalLockBackend()
+    inside = []
+    overlaps = []
+
+    def worker():
+        with AdvisoryLock(backend, '???', 'igm1'):
+            if inside:
+                overlaps.append(True)
+            inside.append(True)
+            time.sleep(0.01)
+            inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not overlaps
+
+
+def test_timeout():
+    """A lock held by another session raises dbErrLockTimeout after the timeout"""
+
+    backend = LocalLockBackend()
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with AdvisoryLock(backend, '???', 'igm1'):
+            acquired.set()
+            release.wait()
+
+    t = threading.Thread(target=holder)
+    t.start()
+    acquired.wait()
+
+    with pytest.raises(dbErrLockTimeout):
+        with AdvisoryLock(backend, '???', 'igm1', timeout=0.1):
+            pass
+
+    # a different key is not blocked
+    with AdvisoryLock(backend, '???', 'igm0', timeout=0.1):
+        pass
+
+    release.set()
+    t.join()
+
+
+def test_reentrant_for_same_session():
+    """Same as pg advisory locks, the session holding the lock can acquire it again"""
+
+    backend = LocalLockBackend()
+    with AdvisoryLock(backend, '???', 'igm1', timeout=0.1):
+        with AdvisoryLock(backend, '???', 'igm1', timeout=0.1):
+            pass
@@ -0,0 +1,90 @@
+# Created: October 2026
+
+import heapq
+import itertools
+import threading
+import types
+
+import pytest
+
+from ..pyJobServer import JobServer, CostQueue
+
+
+class SimulatedCluster:
+    """stand-in for dispy.JobCluster: keeps the jobs in the order in which they are sent to the cluster"""
+
+    def __init__(self):
+        self.ids  = itertools.count(1)
+        self.sent = []
+
+    def submit(self, *args):
+        job = types.SimpleNamespace(id=next(self.ids), args=args)
+        self.sent.append(job)
+        return job
+
+    def submit_node(self, node, *args):
+        return self.submit(*args)
+
+
+def make_server(cpus, window):
+    server = JobServer.__new__(JobServer)
+    server.run_parallel   = True
+    server.run_local      = False
+    server.callback       = None
+    server.pool_functions = {}
+    server.close          = False
+    server.cluster        = SimulatedCluster()
+    server.nodes          = [types.SimpleNamespace(ip_addr='10.0.0.1', name='node', avail_cpus=cpus)]
+    server.jobs           = []
+    server.job_node       = {}
+    server.node_load      = {}
+    server.affinity_nodes = {}
+    server.affinity_stats = {}
+    server.cost_queue     = CostQueue(window)
+    server.cpus_changed   = threading.Condition()
+    return server
+
+
+def simulate(durations, cpus, window, use_cost=True):
+    """
+    run jobs with the given durations in a simulated cluster (all jobs submitted at time 0) and return the makespan
+    """
+    server = make_server(cpus, window)
+
+    for i, duration in enumerate(durations):
+        server.submit(i, cost=duration if use_cost else 0)
+
+    clock   = 0.
+    started = 0
+    running = []
+    while started < len(durations) or running:
+        # jobs sent to the cluster start running immediately
+        for job in server.cluster.sent[started:]:
+            heapq.heappush(running, (clock + durations[job.args[0]], job.id, job))
+            started += 1
+
+        clock, _, job = heapq.heappop(running)
+        server.release_job(job)
+
+    return clock
+
+
+def test_cost_queue_window():
+    queue = CostQueue(window=2)
+    for i, cost in enumerate([1, 5, 9, 7, 8]):
+        queue.push(cost, i)
+
+    order = [queue.pop()[1] for _ in range(5)]
+    # jobs 0 and 1 can only be overtaken twice
+    assert order == [2, 4, 0, 1, 3]
+
+
+@pytest.mark.parametrize('window', [5, 50])
+def test_longest_first_shortens_tail(window):
+    # many small sessions and a few big ones at the end of the submission order
+    durations = [1.] * 40 + [10.] * 4
+
+    # FIFO: the big sessions start when all the small ones are done
+    assert simulate(durations, cpus=8, window=window, use_cost=False) == 15.
+    # the first jobs go out while the cluster is idle, the big ones are sent as soon as CPUs are released
+    assert simulate(durations, cpus=8, window=window) == 11.
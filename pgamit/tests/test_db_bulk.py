@@ -0,0 +1,72 @@
+# Created: October 2026
+
+import psycopg2
+import pytest
+
+from ..dbConnection import Cnn, dbErrInsert, dbErrUpdate
+
+
+class FakeCursor:
+    """ records the statements sent to the server, failing the ones that contain fail_on """
+    connection = type('FakeConnection', (), {'encoding': 'UTF8'})
+
+    def __init__(self, fail_on=None):
+        self.fail_on    = fail_on
+        self.statements = []
+
+    def mogrify(self, template, args):
+        return template % tuple(repr(a).encode() for a in args)
+
+    def execute(self, query, values=None):
+        query = query.decode() if isinstance(query, bytes) else query
+        self.statements.append(query)
+        if self.fail_on and self.fail_on in query:
+            raise psycopg2.errors.UniqueViolation('duplicate key value')
+
+
+def make_cnn(fail_on=None):
+    cnn = Cnn.__new__(Cnn)
+    cnn.cursor             = FakeCursor(fail_on)
+    cnn.active_transaction = False
+    cnn.columns_cache      = {}
+    return cnn
+
+
+def otl_rows(n):
+    return [{'NetworkCode': 'net', 'StationCode': 's%03i' % i, 'Harpos_coeff_otl': 'otl %i' % i} for i in range(n)]
+
+
+def test_update_many_single_statement():
+    cnn = make_cnn()
+    cnn.update_many('stations', otl_rows(250), ('NetworkCode', 'StationCode'))
+
+    begin, update, commit = cnn.cursor.statements
+    assert (begin, commit) == ('BEGIN TRANSACTION', 'COMMIT')
+    assert update.count("'otl ") == 250
+
+
+def test_update_many_rolls_back():
+    cnn = make_cnn(fail_on="'otl 249'")
+    with pytest.raises(dbErrUpdate):
+        cnn.update_many('stations', otl_rows(250), ('NetworkCode', 'StationCode'))
+
+    # nothing committed before the failure
+    assert cnn.cursor.statements[0] == 'BEGIN TRANSACTION' and cnn.cursor.statements[-1] == 'ROLLBACK'
+    assert len(cnn.cursor.statements) == 3 and 'COMMIT' not in cnn.cursor.statements
+
+
+def test_insert_many_all_or_nothing():
+    rows = [{'NetworkCode': 'net', 'StationCode': 's%03i' % i, 'Filename': 'f%03i' % i} for i in range(150)]
+
+    cnn = make_cnn()
+    cnn.columns_cache['ppp_soln'] = ['NetworkCode', 'StationCode']
+    cnn.insert_many('ppp_soln', rows)
+    assert len(cnn.cursor.statements) == 3 and cnn.cursor.statements[1].count("'net'") == 150
+    # keys that are not columns are ignored
+    assert 'Filename' not in cnn.cursor.statements[1]
+
+    cnn = make_cnn(fail_on="'s149'")
+    cnn.columns_cache['ppp_soln'] = ['NetworkCode', 'StationCode']
+    with pytest.raises(dbErrInsert):
+        cnn.insert_many('ppp_soln', rows)
+    assert cnn.cursor.statements[-1] == 'ROLLBACK' and 'COMMIT' not in cnn.cursor.statements
@@ -0,0 +1,106 @@
+# Created: October 2026
+
+import itertools
+import threading
+import types
+
+from .. import pyJobServer
+from ..pyJobServer import CostQueue, JobServer
+
+dispy = pyJobServer.dispy
+
+
+class FakeCluster:
+    """ stand-in for dispy.JobCluster: jobs run when submitted, their callbacks when wait is called """
+    ids = itertools.count(1)
+
+    def __init__(self, function, nodes, depends, callback, cluster_status, **kwargs):
+        self.function  = function
+        self.callback  = callback
+        self.accepting = True
+        self.submitted = []
+
+    def run(self, node, args):
+        job = dispy.DispyJob(None, args, ())
+        job.id     = next(self.ids)
+        job.status = dispy.DispyJob.Finished
+        job.result = self.function(*args)
+        self.submitted.append((node, job))
+        return job
+
+    def submit(self, *args):
+        return self.run(None, args)
+
+    def submit_node(self, node, *args):
+        return self.run(node, args) if self.accepting else None
+
+    def print_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def wait(self):
+        # dispy runs the callbacks in its own thread, after the job is submitted
+        for _, job in self.submitted:
+            if self.callback:
+                self.callback(job)
+
+
+def double(x):
+    return 2 * x
+
+
+def make_server(monkeypatch):
+    monkeypatch.setattr(dispy, 'JobCluster', FakeCluster)
+    monkeypatch.setattr(dispy.httpd, 'DispyHTTPServer', lambda cluster, poll_sec: None)
+    # dispy sends the pool functions to the nodes as dependencies
+    monkeypatch.setattr(pyJobServer, 'double', double, raising=False)
+
+    server = JobServer.__new__(JobServer)
+    server.nodes          = [types.SimpleNamespace(ip_addr='10.0.0.1', name='node1', avail_cpus=2)]
+    server.run_parallel   = True
+    server.run_local      = False
+    server.delay          = 0
+    server.ip_address     = None
+    server.cpus_changed   = threading.Condition()
+    server.cost_queue     = CostQueue()
+    server.affinity_nodes = {}
+    server.affinity_stats = {}
+    server.node_load      = {}
+    server.job_node       = {}
+    server.startup_times  = {'discovery': 0., 'clusters': []}
+    server.pool_functions = {}
+    server.warm_up        = ()
+    server.jobs           = []
+    server.close          = False
+    server.pending_callbacks = set()
+    return server
+
+
+def test_pool_phase_callback(monkeypatch):
+    server = make_server(monkeypatch)
+    server.create_pool([double])
+    assert server.cluster.callback is not None
+
+    results = []
+    server.create_cluster(double, callback=lambda job: results.append(job.result))
+    server.submit(21)
+    assert server.pending_callbacks
+    server.cluster.wait()
+
+    assert results == [42]
+    assert not server.pending_callbacks
+
+
+def test_submit_node_refused(monkeypatch):
+    server = make_server(monkeypatch)
+    server.create_cluster(double, callback=lambda job: None)
+    server.cluster.accepting = False
+
+    job = server.submit_async(21, affinity='day1')
+
+    # the job went through cluster.submit instead
+    assert job is not None and server.cluster.submitted == [(None, job)]
+    assert None not in server.jobs
+    assert not server.job_node
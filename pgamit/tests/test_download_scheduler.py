@@ -0,0 +1,117 @@
+# Created: October 2026
+
+import os
+import queue
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from com.DownloadSources import NOT_LISTED, DownloadScheduler, File, Msg, Source, Station
+from ..pyDate import Date
+
+MJD = Date(year=2020, doy=10).mjd
+
+
+def doy(i):
+    return Date(mjd=MJD + i).doy
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """ local stand-in for a data server: every transfer takes a while and the
+    server keeps count of the transfers running at the same time """
+    root = tmp_path / 'server'
+    os.makedirs(root / 'data')
+    for i in range(0, 12, 2):
+        (root / 'data' / ('2020%03d.txt' % doy(i))).write_text('rinex %d' % i)
+
+    class Handler(SimpleHTTPRequestHandler):
+        lock    = threading.Lock()
+        active  = 0
+        peak    = 0
+        served  = []
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(root), **kwargs)
+
+        def do_GET(self):
+            cls = type(self)
+            with cls.lock:
+                cls.active += 1
+                cls.peak = max(cls.peak, cls.active)
+                cls.served.append(self.path)
+            time.sleep(0.1)
+            try:
+                super().do_GET()
+            finally:
+                with cls.lock:
+                    cls.active -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(tmp_path, server, sessions, max_downloads, files_qty):
+    src = Source(server_id=1, protocol='http', fqdn='127.0.0.1:%d' % server.server_port,
+                 username=None, password=None, path='/data/${year}${doy}.txt', format=None)
+    stations = {0: Station(stationID='tst.stn1', NetworkCode='tst', StationCode='stn1', Marker=0,
+                           CountryCode='ARG', sources=[src], abspath_station_dir=str(tmp_path))}
+
+    inbox = queue.Queue()
+
+    def on_download_result(server_id, session, error, elapsed_time=0, size=0, timeout=None):
+        inbox.put(Msg.DOWNLOAD_RESULT(server_id, session, elapsed_time, size, error))
+        return True
+
+    def on_client_stopped(server_id, session):
+        inbox.put(Msg.CLIENT_STOPPED(server_id, session))
+
+    scheduler = DownloadScheduler(stations, on_download_result, on_client_stopped, sessions, max_downloads)
+
+    # oldest first, as the worst case for the ordering
+    for i in range(files_qty):
+        scheduler.queue(File.from_params(stations, stn_idx=0, date_mjd=MJD + i, src_idx=0))
+
+    results = {}
+    while len(results) < files_qty:
+        msg = inbox.get(timeout=30)
+        assert isinstance(msg, Msg.DOWNLOAD_RESULT)
+        f = scheduler.download_finished(msg.server_id, msg.session)
+        results[f.date_mjd] = msg.error
+        scheduler.dispatch()
+
+    scheduler.finish()
+    return scheduler, results
+
+
+def test_sessions_per_server(tmp_path, http_server):
+    scheduler, results = run(tmp_path, http_server, sessions=3, max_downloads=8, files_qty=12)
+
+    assert len(scheduler.servers[1].clients) == 3
+    assert http_server.RequestHandlerClass.peak == 3
+
+    # the odd days do not exist in the server: the directory was listed once and they were never requested
+    assert [mjd - MJD for mjd, error in sorted(results.items()) if not error] == list(range(0, 12, 2))
+    assert all(results[MJD + i] == NOT_LISTED for i in range(1, 12, 2))
+    assert sorted(http_server.RequestHandlerClass.served) == ['/data/'] + ['/data/2020%03d.txt' % doy(i)
+                                                                         for i in range(0, 12, 2)]
+    assert (tmp_path / ('2020%03d.txt' % doy(4))).read_text() == 'rinex 4'
+
+
+def test_global_limit_and_priority(tmp_path, http_server):
+    scheduler, results = run(tmp_path, http_server, sessions=4, max_downloads=1, files_qty=6)
+
+    assert http_server.RequestHandlerClass.peak == 1
+    assert len(scheduler.servers[1].clients) == 1
+
+    # the first file queued starts right away (listing the directory), then the most recent days go first
+    served = [os.path.basename(p) for p in http_server.RequestHandlerClass.served]
+    assert served == [''] + ['2020%03d.txt' % doy(i) for i in (0, 4, 2)]
@@ -0,0 +1,90 @@
+# Created: October 2026
+
+import types
+
+import numpy as np
+import pytest
+
+from .. import pyDate
+from ..pyETM import ETM, GENERIC_JUMP, ANTENNA_CHANGE
+
+
+def make_etm(with_model=True, fast=False):
+    """Build a minimal ETM by hand with the attributes used by get_xyz_s (no database needed)"""
+
+    rng = np.random.default_rng(42)
+
+    etm = ETM.__new__(ETM)
+
+    # daily solutions with a gap, from 2020-001 to 2020-100
+    mjd = np.array([pyDate.Date(year=2020, doy=d).mjd for d in range(1, 101) if not 40 <= d < 50])
+    # dense time vector used to evaluate the model
+    ts_mjd = np.arange(pyDate.Date(year=2019, doy=300).mjd, pyDate.Date(year=2020, doy=150).mjd)
+
+    etm.soln = types.SimpleNamespace(mjd=mjd,
+                                     ts=np.array([pyDate.Date(mjd=m).fyear for m in ts_mjd]),
+                                     auto_x=np.array([2000000.0]),
+                                     auto_y=np.array([-5000000.0]),
+                                     auto_z=np.array([-3000000.0]),
+                                     lat=np.array([-28.2]),
+                                     lon=np.array([-68.2]),
+                                     stack_name='ppp')
+
+    etm.L = np.array([2000000.0, -5000000.0, -3000000.0])[:, np.newaxis] + rng.normal(0, 0.01, (3, mjd.size))
+    etm.R = np.abs(rng.normal(0, 0.003, (3, mjd.size)))
+    etm.F = np.ones((3, mjd.size), dtype=bool)
+    # some filtered observations
+    etm.F[:, 5] = False
+    etm.F[1, 17] = False
+
+    if with_model:
+        etm.A  = True
+        etm.As = np.column_stack((np.ones(ts_mjd.size), etm.soln.ts - 2020))
+        etm.C  = rng.normal(0, 0.01, (3, 2))
+        etm.factor = np.array([0.002, 0.002, 0.005])
+    else:
+        etm.A  = None
+        etm.As = None
+
+    velocity = 0.3 if fast else 0.01
+    etm.Linear = types.SimpleNamespace(p=types.SimpleNamespace(params=np.array([[0, velocity],
+                                                                                [0, 0.0],
+                                                                                [0, 0.0]])))
+
+    def jump(year, doy, jump_type, size, fit=True):
+        return types.SimpleNamespace(date=pyDate.Date(year=year, doy=doy),
+                                     fit=fit,
+                                     p=types.SimpleNamespace(jump_type=jump_type,
+                                                             params=np.array([[size], [0.0], [0.0]])))
+
+    etm.Jumps = types.SimpleNamespace(table=[jump(2020, 20, GENERIC_JUMP, 0.05),
+                                             jump(2020, 30, ANTENNA_CHANGE, 0.01),
+                                             jump(2020, 60, GENERIC_JUMP, 0.05, fit=False)])
+    return etm
+
+
+@pytest.mark.parametrize(("with_model", "fast", "force_model"),
+                         [[True, False, False],
+                          [True, True, False],
+                          [True, False, True],
+                          [False, False, False]])
+def test_many_matches_single(with_model, fast, force_model):
+    """get_xyz_s_many must return exactly what get_xyz_s returns date by date"""
+
+    etm = make_etm(with_model, fast)
+    # dates with good, filtered and missing solutions, jumps and dates outside the solution span
+    dates = [pyDate.Date(year=2020, doy=d) for d in range(1, 121, 1)]
+
+    xyz, sig, window, source = etm.get_xyz_s_many(dates, sigma_h=0.1, sigma_v=0.15, force_model=force_model)
+
+    assert xyz.shape == (3, len(dates))
+    assert sig.shape == (3, len(dates))
+
+    for i, date in enumerate(dates):
+        s_xyz, s_sig, s_window, s_source = etm.get_xyz_s(date.year, date.doy, sigma_h=0.1, sigma_v=0.15,
+                                                         force_model=force_model)
+
+        np.testing.assert_allclose(xyz[:, [i]], s_xyz, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(sig[:, [i]], s_sig, rtol=0, atol=1e-9)
+        assert window[i] == s_window
+        assert source[i] == s_source
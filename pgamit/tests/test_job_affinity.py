@@ -0,0 +1,55 @@
+# Created: October 2026
+
+import types
+
+from ..pyJobServer import JobServer
+
+
+def make_server(cpus):
+    server = JobServer.__new__(JobServer)
+    server.nodes          = [types.SimpleNamespace(ip_addr='10.0.0.%i' % i, name='node%i' % i, avail_cpus=c)
+                             for i, c in enumerate(cpus)]
+    server.affinity_nodes = {}
+    server.node_load      = {}
+    server.affinity_stats = {}
+    # no dispy cluster to close
+    server.run_parallel   = True
+    server.run_local      = False
+    server.callback       = None
+    server.close          = False
+    return server
+
+
+def run(server, affinity):
+    node = server.select_node(affinity)
+    server.node_load[node.ip_addr] = server.node_load.get(node.ip_addr, 0) + 1
+    return node.name
+
+
+def test_same_key_goes_to_same_node():
+    server = make_server([2, 2])
+
+    assert run(server, 'day1') == 'node0'
+    # different key: load balance to the idle node
+    assert run(server, 'day2') == 'node1'
+    # same keys: back to the nodes that already have the data
+    assert run(server, 'day1') == 'node0'
+    assert run(server, 'day2') == 'node1'
+
+    assert server.affinity_stats['10.0.0.0'] == {'name': 'node0', 'hits': 1, 'misses': 1}
+    assert server.affinity_stats['10.0.0.1'] == {'name': 'node1', 'hits': 1, 'misses': 1}
+    assert 'hit rate  50.0%' in server.affinity_report()
+
+
+def test_busy_node_spills_to_free_node():
+    server = make_server([1, 2])
+
+    assert run(server, 'day1') == 'node0'
+    # node0 is full: use a free node rather than leaving CPUs idle
+    assert run(server, 'day1') == 'node1'
+    assert run(server, 'day1') == 'node1'
+    # the whole cluster is busy: queue where the key was seen
+    run(server, 'day1')
+    assert run(server, 'day2') in ('node0', 'node1')
+    assert sum(s['hits'] for s in server.affinity_stats.values()) == 2
+    assert sum(s['misses'] for s in server.affinity_stats.values()) == 3
@@ -0,0 +1,86 @@
+# Created: October 2026
+
+import ftplib
+import os
+
+from ..proto_download import ListingCache
+
+
+class FakeServer:
+    """ list_dir with the contract of IProtocol.list_dir, counting the round-trips """
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.calls   = []
+
+    def list_dir(self, server_path):
+        folder = os.path.dirname(server_path)
+        self.calls.append(folder)
+        if folder not in self.folders:
+            raise ftplib.error_perm('550 CWD failed: no such directory')
+        return self.folders[folder]
+
+
+def test_listed_once():
+    server = FakeServer({'/pub/2020/010': {'brdc0100.20n.Z', 'igs21000.sp3.Z'},
+                         '/pub/2020/011': '<a href="../">..</a><a href="igs21001.sp3.Z">igs21001.sp3.Z</a>'})
+    cache  = ListingCache('ftp://server')
+
+    assert cache.available(server.list_dir, '/pub/2020/010/brdc0100.20n.Z') is True
+    assert cache.available(server.list_dir, '/pub/2020/010/brdc0100.20n.gz') is False
+    assert cache.available(server.list_dir, '/pub/2020/011/igs21001.sp3.Z') is True
+    assert cache.available(server.list_dir, '/pub/2020/012/igs21002.sp3.Z') is False
+    assert cache.available(server.list_dir, '/pub/2020/012/brdc0120.20n.Z') is False
+
+    assert server.calls == ['/pub/2020/010', '/pub/2020/011', '/pub/2020/012']
+
+
+def test_unknown_availability():
+    def list_dir(server_path):
+        raise ConnectionResetError('connection lost')
+
+    cache = ListingCache('ftp://server')
+    assert cache.available(list_dir, '/pub/brdc0100.20n.Z') is None
+    # html pages that are not a directory index
+    assert cache.available(lambda path: '<html>Forbidden</html>', '/other/brdc0100.20n.Z') is None
+    assert cache.available(lambda path: '<a href="/login">brdc0100.20n.Z</a>', '/login/brdc0100.20n.Z') is None
+
+
+def test_autoindex():
+    assert ListingCache.parse('<title>Index of /pub/2020/010</title><a href="brdc0100.20n.Z">b</a>') == \
+           {'brdc0100.20n.Z'}
+    # an empty folder
+    assert ListingCache.parse('<title>Directory listing for /pub/</title><ul></ul>') == set()
+
+
+def test_unrecognized_not_saved(tmp_path):
+    calls = []
+
+    def list_dir(server_path):
+        calls.append(server_path)
+        return '<html><a href="/home">Home</a></html>'
+
+    assert ListingCache('https://server', str(tmp_path)).listing(list_dir, '/pub/2020/010') is None
+    assert os.listdir(tmp_path) == []
+    assert ListingCache('https://server', str(tmp_path)).listing(list_dir, '/pub/2020/010') is None
+    assert len(calls) == 2
+
+
+def test_persisted_listings(tmp_path):
+    server = FakeServer({'/pub/2020/010': {'brdc0100.20n.Z'}})
+
+    assert ListingCache('ftp://server', str(tmp_path)).listing(server.list_dir, '/pub/2020/010') == {'brdc0100.20n.Z'}
+    # the next run reuses the saved listing
+    assert ListingCache('ftp://server', str(tmp_path)).listing(server.list_dir, '/pub/2020/010') == {'brdc0100.20n.Z'}
+    assert len(server.calls) == 1
+
+    # other servers do not share it
+    ListingCache('ftp://other', str(tmp_path)).listing(server.list_dir, '/pub/2020/010')
+    assert len(server.calls) == 2
+
+    # expired listings are fetched again and purged
+    ListingCache('ftp://server', str(tmp_path), ttl=0).listing(server.list_dir, '/pub/2020/010')
+    assert len(server.calls) == 3
+
+    ListingCache.purge(str(tmp_path), ttl=-1)
+    assert os.listdir(tmp_path) == []
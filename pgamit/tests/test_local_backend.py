@@ -0,0 +1,96 @@
+# Created: October 2026
+
+import os
+import types
+
+import pytest
+
+from .. import pyJobServer
+
+
+def square(x):
+    if x < 0:
+        raise ValueError('negative input %i' % x)
+    return x, x * x, os.getpid()
+
+
+@pytest.fixture
+def job_server(monkeypatch):
+    # the node test needs a database and the archive
+    monkeypatch.setattr(pyJobServer, 'test_node', lambda **kwargs: ' -- local: Test passed!')
+
+    config = types.SimpleNamespace(run_parallel=False, run_local=True, local_cpus=2, cluster_delay=90,
+                                   options={'ip_address': None})
+    return pyJobServer.JobServer(config)
+
+
+def test_local_pool_runs_jobs(job_server):
+    results    = {}
+    exceptions = []
+    updates    = []
+
+    def callback(job):
+        if job.exception:
+            exceptions.append(job.exception)
+        else:
+            results[job.result[0]] = job.result[1:]
+
+    progress = types.SimpleNamespace(update=lambda: updates.append(1))
+
+    job_server.create_cluster(square, callback=callback, progress_bar=progress, modules=('numpy',))
+    assert job_server.total_cpus() == 2
+
+    for x in range(10):
+        job_server.submit(x)
+    job_server.submit_async(-1)
+    # jobs with a cost go through the cost queue
+    job_server.submit(11, cost=5.)
+
+    job_server.wait()
+    job_server.close_cluster()
+
+    assert {x: r[0] for x, r in results.items()} == {x: x * x for x in list(range(10)) + [11]}
+    # jobs ran in the worker processes, not here
+    assert os.getpid() not in {r[1] for r in results.values()}
+    assert len(exceptions) == 1 and 'ValueError: negative input -1' in exceptions[0]
+    assert len(updates) == 12
+    assert not job_server.jobs
+
+
+def count_calls(x):
+    # the counter lives in the worker and survives between jobs and phases of the pool
+    calls = pyJobServer.warm('calls', lambda: [0])
+    calls[0] += 1
+    return os.getpid(), calls[0]
+
+
+def count_calls_again(x):
+    return count_calls(x)
+
+
+def test_pool_is_reused_between_phases(job_server):
+    results = []
+
+    job_server.create_pool((count_calls, count_calls_again))
+    executor = job_server.executor
+
+    for function in (count_calls, count_calls_again):
+        job_server.create_cluster(function, callback=lambda job: results.append(job.result))
+        for x in range(6):
+            job_server.submit(x)
+        job_server.wait()
+        job_server.close_cluster()
+
+    # same workers: the second phase did not start a new pool and the counters kept growing
+    assert job_server.executor is executor
+    assert len(results) == 12
+    per_worker = {}
+    for pid, count in results:
+        per_worker.setdefault(pid, []).append(count)
+    assert sum(max(counts) for counts in per_worker.values()) == 12
+
+    # a function that was not registered replaces the pool
+    job_server.create_cluster(square)
+    assert not job_server.pool_functions
+    assert job_server.executor is not executor
+    job_server.close_cluster()
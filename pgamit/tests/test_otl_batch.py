@@ -0,0 +1,33 @@
+# Created: October 2026
+
+import os
+import stat
+
+from ..pyOTL import calculate_otl_coeffs
+
+
+def test_chunk_shares_one_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # stand-in for grdtab: writes harpos.<station> (fails for station bad1) and logs the working directory
+    grdtab = tmp_path / 'grdtab'
+    grdtab.write_text('#!/bin/sh\n'
+                      'pwd >> %s\n'
+                      'if [ "$4" = "bad1" ]; then echo "FATAL" > GAMIT.fatal; exit 0; fi\n'
+                      'echo "HARPOS $4 $1 $2 $3" > harpos.$4\n'
+                      'echo "status" > GAMIT.status\n' % (tmp_path / 'calls.log'))
+    grdtab.chmod(grdtab.stat().st_mode | stat.S_IEXEC)
+
+    stations = [{'NetworkCode': 'net', 'StationCode': code, 'auto_x': i, 'auto_y': 2 * i, 'auto_z': 3 * i}
+                for i, code in enumerate(('aaa1', 'bad1', 'ccc1'))]
+
+    coefficients, errors = calculate_otl_coeffs(stations, str(grdtab), str(tmp_path / 'otl.grid'))
+
+    assert [c['StationCode'] for c in coefficients] == ['aaa1', 'ccc1']
+    assert coefficients[1]['Harpos_coeff_otl'].strip() == 'HARPOS ccc1 2 4 6'
+    assert len(errors) == 1 and 'bad1' in errors[0]
+
+    # grdtab ran three times in the same folder, which is removed at the end
+    folders = set(open(tmp_path / 'calls.log').read().split())
+    assert len(folders) == 1
+    assert not os.path.exists(folders.pop())
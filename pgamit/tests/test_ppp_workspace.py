@@ -0,0 +1,70 @@
+# Created: October 2026
+
+import os
+
+from .. import pyPPP
+from ..pyDate import Date
+from ..pyPPP import PPPWorkspace
+
+
+def make_workspace(root, doy, orbit_type=('igs{WWWWD}',)):
+    return PPPWorkspace({'ppp_path': '/ppp'}, Date(year=2020, doy=doy), orbit_type, pyPPP.OBSERV_CODE_PHASE,
+                        'igs14.atx', True, root=str(root))
+
+
+def test_products_staged_once(tmp_path):
+    staged = []
+
+    def stage(path):
+        staged.append(path)
+        os.makedirs(os.path.join(path, 'orbits'))
+        open(os.path.join(path, 'orbits', 'igs21000.sp3'), 'w').close()
+        return {'files': ['orbits'], 'eop_file': 'dummy.eop'}
+
+    first  = make_workspace(tmp_path, 10)
+    second = make_workspace(tmp_path, 10)
+
+    assert first.acquire(stage) == second.acquire(stage)
+    assert len(staged) == 1
+    assert first.path == second.path
+
+    # still in use by the second run
+    first.release()
+    assert os.path.isfile(os.path.join(second.path, 'orbits', 'igs21000.sp3'))
+    second.release()
+    assert os.listdir(os.path.join(second.path, 'refs')) == []
+
+    # a different orbit type does not share the workspace
+    assert make_workspace(tmp_path, 10, ('cod{WWWWD}',)).path != first.path
+
+
+def test_idle_workspaces_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(pyPPP, 'PPP_WORKSPACES_KEPT', 1)
+
+    def stage(path):
+        return {'files': []}
+
+    old = make_workspace(tmp_path, 1)
+    old.acquire(stage)
+    old.release()
+    os.utime(old.path, (0, 0))
+
+    # a run that died without releasing its workspace does not keep it alive
+    dead = make_workspace(tmp_path, 2)
+    dead.acquire(stage)
+    os.rename(dead.ref, os.path.join(os.path.dirname(dead.ref), '999999999_dead'))
+    dead.ref = None
+    os.utime(dead.path, (1, 1))
+
+    busy = make_workspace(tmp_path, 3)
+    busy.acquire(stage)
+
+    new = make_workspace(tmp_path, 4)
+    new.acquire(stage)
+    new.release()
+
+    assert not os.path.exists(old.path)
+    assert not os.path.exists(dead.path)
+    assert os.path.exists(busy.path)
+    assert os.path.exists(new.path)
+    busy.release()
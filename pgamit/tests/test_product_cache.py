@@ -0,0 +1,91 @@
+# Created: October 2026
+
+import gzip
+import os
+
+from .. import pyDate
+from .. import pyProducts
+from ..pyProducts import ProductCache, ProductIndex, ProductMemory, GetSp3Orbits, GetBrdcOrbits
+
+
+SP3TYPE = 'IGS[0-9]R03FIN_{YYYYDDD}0000_{PER}_{INT}_'
+
+
+def make_archive(tmp_path, date):
+    archive = tmp_path / 'orbits' / str(date.gpsWeek)
+    archive.mkdir(parents=True)
+    sp3 = ('#dP2020  1  1  0  0  0.00000000      96 ORBIT IGS20 HLM  IGS\n' + 'x' * 5000).encode()
+    with gzip.open(archive / ('IGS0R03FIN_%s0000_01D_15M_ORB.SP3.gz' % date.yyyyddd(space=False)), 'wb') as f:
+        f.write(sp3)
+    with gzip.open(archive / ('brdc%s0.%sn.gz' % (date.ddd(), str(date.year)[2:])), 'wb') as f:
+        f.write(b'broadcast')
+    return str(tmp_path / 'orbits' / '$gpsweek'), sp3
+
+
+def test_products_are_fetched_once(tmp_path):
+    date = pyDate.Date(year=2020, doy=1)
+    archive, sp3 = make_archive(tmp_path, date)
+    cache = ProductCache(str(tmp_path / 'cache'))
+
+    paths = []
+    for session in ('s1', 's2'):
+        copyto = tmp_path / session
+        copyto.mkdir()
+        orbit = GetSp3Orbits(archive, date, [SP3TYPE], str(copyto), no_cleanup=True, cache=cache)
+        assert orbit.RF == 'IGS20'
+        assert open(orbit.sp3_path, 'rb').read() == sp3
+        paths.append(orbit.sp3_path)
+
+    # both sessions share the same cached (uncompressed) file
+    assert os.path.samefile(*paths)
+    assert os.path.samefile(paths[0], cache.get(os.path.join(archive.replace('$gpsweek', str(date.gpsWeek)),
+                            'IGS0R03FIN_%s0000_01D_15M_ORB.SP3.gz' % date.yyyyddd(space=False))))
+
+
+def test_eviction_and_prefetch(tmp_path):
+    date = pyDate.Date(year=2020, doy=1)
+    archive, sp3 = make_archive(tmp_path, date)
+    # budget smaller than the sp3 file: only the last product fetched remains in the cache
+    cache = ProductCache(str(tmp_path / 'cache'), max_size_gb=1000 / 1024 ** 3)
+
+    cache.prefetch([date, date + 1], archive, [SP3TYPE], archive)
+
+    files = [f for _, _, fs in os.walk(cache.path) for f in fs if not f.endswith('.lock')]
+    assert files == ['brdc0010.20n']
+
+    # products linked before the eviction are still valid
+    copyto = tmp_path / 'session'
+    copyto.mkdir()
+    brdc = GetBrdcOrbits(archive, date, str(copyto), no_cleanup=True, cache=cache)
+    assert open(brdc.brdc_path, 'rb').read() == b'broadcast'
+
+
+def test_index_and_memory_without_cache(tmp_path, monkeypatch):
+    date = pyDate.Date(year=2020, doy=1)
+    archive, sp3 = make_archive(tmp_path, date)
+    index  = ProductIndex()
+    memory = ProductMemory()
+    monkeypatch.setattr(pyProducts, 'product_index', index)
+    monkeypatch.setattr(pyProducts, 'product_memory', memory)
+
+    decompressed = []
+    decompress   = memory.decompress
+    monkeypatch.setattr(memory, 'decompress', lambda source: decompressed.append(source) or decompress(source))
+
+    for session in ('s1', 's2'):
+        copyto = tmp_path / session
+        copyto.mkdir()
+        orbit = GetSp3Orbits(archive, date, [SP3TYPE], str(copyto), no_cleanup=True)
+        assert open(orbit.sp3_path, 'rb').read() == sp3
+
+    # the folder was listed and the product decompressed only once
+    assert len(index.folders) == 1
+    assert len(decompressed) == 1
+
+    # a new file in the folder invalidates the listing
+    folder = archive.replace('$gpsweek', str(date.gpsWeek))
+    brdc   = 'brdc%s0.%sn' % ((date + 1).ddd(), str(date.year)[2:])
+    assert index.find(folder, brdc) is None
+    open(os.path.join(folder, brdc), 'w').close()
+    os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns + 1))
+    assert index.find(folder, brdc) == os.path.join(folder, brdc)
@@ -0,0 +1,36 @@
+# Created: October 2026
+
+from ..pyRinex import RinexFingerprint
+
+DATA = [' 20  1 10  0  0  0.0000000  0  2G05G07',
+        '  20000000.000   20000001.000',
+        '  21000000.000   21000001.000',
+        ' 20  1 10  0  0 30.0000000  0  1G05',
+        '  20000100.000   20000101.000',
+        ' 20  1 10  0 15  0.0000000  0  1G05',
+        '  20000200.000   20000201.000']
+
+
+def digest(header, data):
+    fp = RinexFingerprint()
+    for line in header + data:
+        fp(line + '\n')
+    return fp.hexdigest()
+
+
+def header(marker, program):
+    return ['     2.11           OBSERVATION DATA    G (GPS)             RINEX VERSION / TYPE',
+            '%-20s%-40sPGM / RUN BY / DATE' % (program, ''),
+            '%-60sMARKER NAME' % marker,
+            '                                                            END OF HEADER']
+
+
+def test_archived_copy_matches():
+    # the archive normalizes the header, the observations are the same
+    assert digest(header('STN1', 'teqc'), DATA) == digest(header('stn1', 'pgamit'), [l + '   ' for l in DATA])
+    assert digest(header('STN1', 'teqc'), DATA) != digest(header('STN1', 'teqc'), DATA[:-1] + ['  20000200.001'])
+
+
+def test_no_round_epochs():
+    # epochs at 00:00:30 only: nothing to fingerprint
+    assert digest(header('STN1', 'teqc'), DATA[3:5]) is None
@@ -0,0 +1,165 @@
+# Created: October 2026
+
+import gzip
+
+import numpy as np
+import pytest
+
+from ..snxParse import snxFileParser
+
+
+def write_sinex(path, n_stations=50, seed=0, split=False):
+    """write a GLOBK-like SINEX with coordinates, velocities for the first station and a full L COVA matrix"""
+    rng      = np.random.default_rng(seed)
+    names    = ['S%03i' % i for i in range(n_stations)]
+    xyz      = rng.normal(0, 6e6, (n_stations, 3))
+    sig      = rng.uniform(1e-3, 1e-2, (n_stations, 3))
+
+    params = []
+    for i, name in enumerate(names):
+        for k, c in enumerate('XYZ'):
+            params.append(('STA' + c, name, xyz[i, k], sig[i, k]))
+    params.append(('VELX', names[0], -0.0219615, 0.00013))
+
+    n    = len(params)
+    cov  = rng.normal(0, 1e-6, (n, n))
+    cov  = cov @ cov.T
+
+    lines = ['%=SNX 2.02 MIT 20:001:00000 MIT 20:001:00000 20:001:86399 P 00151 2 S',
+             '+SOLUTION/STATISTICS',
+             '*_STATISTICAL PARAMETER________ __VALUE(S)____________',
+             ' NUMBER OF OBSERVATIONS         %22i' % 123456,
+             ' NUMBER OF UNKNOWNS             %22i' % n,
+             ' VARIANCE FACTOR                %22.15f' % 0.048618461936712,
+             '-SOLUTION/STATISTICS',
+             '+SITE/ID',
+             '*CODE PT __DOMES__ T _STATION DESCRIPTION__ APPROX_LON_ APPROX_LAT_ _APP_H_']
+    for i, name in enumerate(names):
+        lines.append(' %4s  A %9s P %-22s' % (name, '%05iM001' % i if i % 2 else '-' * 9, 'test'))
+    lines += ['-SITE/ID', '+SOLUTION/ESTIMATE',
+              '*INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___']
+    for i, (ptype, name, value, std) in enumerate(params):
+        fmt = ' %i %s %s A 1 %s %s 2 %.14E %.5E' if split else ' %5i %-6s %-4s %2s %4s %12s %-4s %1s %21.14E %11.5E'
+        args = (i + 1, ptype, name, 'A', '1', '20:001:43200', 'm', '2', value, std) if not split else \
+               (i + 1, ptype, name, '20:001:43200', 'm', value, std)
+        lines.append(fmt % args)
+    lines += ['-SOLUTION/ESTIMATE', '+SOLUTION/MATRIX_ESTIMATE L COVA',
+              '*PARA1 PARA2 ____PARA2+0__________ ____PARA2+1__________ ____PARA2+2__________']
+    for i in range(n):
+        for j in range(0, i + 1, 3):
+            values = ' '.join('%21.14E' % cov[i, k] for k in range(j, min(j + 3, i + 1)))
+            lines.append(' %5i %5i %s' % (i + 1, j + 1, values))
+    lines += ['-SOLUTION/MATRIX_ESTIMATE L COVA', '%ENDSNX']
+
+    data = ('\n'.join(lines) + '\n').encode()
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    return names, xyz, sig, cov
+
+
+@pytest.mark.parametrize(('filename', 'split'), [('igs20001.snx', False),
+                                                 ('igs20001.snx.gz', False),
+                                                 ('igs20001.snx', True)])
+def test_parse(tmp_path, filename, split):
+    path = str(tmp_path / filename)
+    names, xyz, sig, cov = write_sinex(path, split=split)
+
+    snx = snxFileParser(path).parse()
+
+    assert snx.orgName == 'IGS'
+    assert snx.varianceFactor == pytest.approx(0.048618461936712)
+    assert snx.observations == 123456 and snx.unknowns == 151
+    assert sorted(snx.stationDict) == names
+    assert snx.matrix.n == 151
+    np.testing.assert_allclose(snx.matrix.dense(), cov, rtol=1e-12)
+
+    for i, name in enumerate(names):
+        stn = snx.get(name)
+        np.testing.assert_allclose([stn.X, stn.Y, stn.Z], xyz[i], rtol=1e-13)
+        np.testing.assert_allclose([stn.sigX, stn.sigY, stn.sigZ], sig[i], rtol=1e-5)
+        np.testing.assert_allclose([stn.sigXY, stn.sigXZ, stn.sigYZ],
+                                   [cov[3 * i, 3 * i + 1], cov[3 * i, 3 * i + 2], cov[3 * i + 1, 3 * i + 2]],
+                                   rtol=1e-12)
+        assert stn.domesNumber == ('%05iM001' % i if i % 2 else None)
+
+    assert snx.get(names[0]).velX == pytest.approx(-0.0219615)
+    assert snx.get(names[0]).refEpoch == pytest.approx(2020.001413)
+
+
+def test_selective_blocks(tmp_path):
+    path = str(tmp_path / 'igs20001.snx')
+    names, _, _, _ = write_sinex(path)
+
+    snx = snxFileParser(path).parse(blocks=('SOLUTION/STATISTICS', 'SOLUTION/ESTIMATE'))
+
+    assert 'SOLUTION/MATRIX_ESTIMATE' in snx.blocks
+    assert snx.matrix is None
+    assert sorted(snx.stationDict) == names
+    assert snx.get(names[0]).sigXY is None and snx.get(names[1]).domesNumber is None
+
+
+class FakeCnn:
+    """answers the queries of update_sinex"""
+
+    def query(self, sql):
+        if 'FROM gamit_soln' in sql:
+            rows = [{'Year': 2020, 'DOY': doy, 'StationCode': stn, 'cc': 1}
+                    for doy in (1, 2) for stn in ('s000', 's001', 'xxxx')]
+        elif 'FROM gamit_ztd' in sql:
+            rows = [{'Year': 2020, 'DOY': 1, 'cc': 24}, {'Year': 2020, 'DOY': 2, 'cc': 12}]
+        else:
+            rows = [{'NetworkCode': 'aaa', 'StationCode': 's000', 'dome': None},
+                    {'NetworkCode': 'bbb', 'StationCode': 's000', 'dome': '11111M001'},
+                    {'NetworkCode': 'ccc', 'StationCode': 's000', 'dome': '22222M001'}]
+        return type('rs', (), {'dictresult': lambda _: rows})()
+
+
+def test_update_sinex(tmp_path):
+    from .. import pyDate
+    from ..snxParse import update_sinex
+
+    day1, day2 = pyDate.Date(year=2020, doy=1), pyDate.Date(year=2020, doy=2)
+    files = []
+    for name, dates in (('igs20001.snx', [day1, day1]), ('igs2000w.snx', [day1, day2])):
+        path = str(tmp_path / name)
+        write_sinex(path, n_stations=4)
+        files.append((path, dates))
+
+    results = update_sinex(FakeCnn(), 'test', files, ' SAMPLING INTERVAL (SECONDS)           30\n',
+                           drop_blocks=('SOLUTION/MATRIX_ESTIMATE',), workers=2)
+
+    # two station coordinates per station-day plus the zenith delays (counted as in the original queries)
+    assert results[0].unknowns == (13, 13 + 4 + (24 + 4))
+    assert results[1].unknowns == (13, 13 + 8 + (36 + 8))
+
+    with open(files[0][0]) as f:
+        text = f.read()
+    assert ' NUMBER OF UNKNOWNS%22i\n NUMBER OF DEGREES OF FREEDOM%12i\n SAMPLING INTERVAL' % (45, 123456 - 45) \
+           in text
+    assert ' S000  A 11111M001 P' in text and 'MATRIX_ESTIMATE' not in text
+
+    snx = snxFileParser(files[0][0]).parse()
+    assert snx.unknowns == 45 and snx.matrix is None
+    assert snx.get('S000').domesNumber == '11111M001'
+
+
+def test_update_sinex_gz(tmp_path):
+    from .. import pyDate
+    from ..snxParse import update_sinex
+
+    path = str(tmp_path / 'igs20001.snx')
+    write_sinex(path, n_stations=4)
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+        dst.write(src.read())
+
+    day = pyDate.Date(year=2020, doy=1)
+    update_sinex(FakeCnn(), 'test', [(path + '.gz', [day, day])], '', workers=1)
+
+    # still compressed after the rewrite
+    with gzip.open(path + '.gz', 'rt') as f:
+        assert ' NUMBER OF UNKNOWNS%22i\n' % 45 in f.read()
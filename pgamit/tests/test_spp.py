@@ -0,0 +1,155 @@
+# Created: October 2026
+
+import numpy as np
+import pytest
+
+from .. import pySPP
+from ..pySPP import NavCache, single_point_position, gps_seconds
+
+# GPS week 2086, day 3 (2020-01-01)
+WEEK = 2086
+TOE  = 3 * 86400. + 7200.
+XYZ  = np.array([2297292.91, 1016894.94, -5843939.62])
+CLK  = 1e-4
+
+
+def label(text, record):
+    return '%-60s%s\n' % (text, record)
+
+
+def nav_float(value):
+    return ('%19.12E' % value).replace('E', 'D')
+
+
+# broadcast ionosphere of a typical navigation file
+ION_ALPHA = (0.1676e-07, 0.2235e-07, -0.1192e-06, -0.1192e-06)
+ION_BETA  = (0.1208e+06, 0.1310e+06, -0.1310e+06, -0.1966e+06)
+
+
+def make_nav(ionosphere=False):
+    lines = [label('     2.10           N: GPS NAV DATA', 'RINEX VERSION / TYPE')]
+    if ionosphere:
+        lines.append(label('  ' + ''.join('%12.4E' % v for v in ION_ALPHA).replace('E', 'D'), 'ION ALPHA'))
+        lines.append(label('  ' + ''.join('%12.4E' % v for v in ION_BETA).replace('E', 'D'), 'ION BETA'))
+    lines.append(label('', 'END OF HEADER'))
+
+    prn = 1
+    for plane in range(6):
+        for slot in range(4):
+            values = [1e-5 * prn, 1e-12, 0.,
+                      prn, 10., 4.5e-9, np.radians(90 * slot + 15 * plane),
+                      1e-6, 0.01, 5e-6, 5153.7,
+                      TOE, 1e-7, np.radians(60 * plane), -1e-7,
+                      0.96, 200., 0.5, -8e-9,
+                      1e-10, 1., WEEK, 0.,
+                      2., 0., 0., prn]
+            lines.append('%2i 20 01 01 02 00 0.0' % prn + ''.join(nav_float(v) for v in values[0:3]) + '\n')
+            for i in range(3, 27, 4):
+                lines.append('   ' + ''.join(nav_float(v) for v in values[i:i + 4]) + '\n')
+            lines.append('   ' + nav_float(TOE) + nav_float(4.) + '\n')
+            prn += 1
+
+    return ''.join(lines)
+
+
+def simulate(nav, epochs, ionosphere=False):
+    """exact pseudoranges (same model as pySPP.solve) of the satellites above 15 degrees"""
+    obs = []
+    up  = XYZ / np.linalg.norm(XYZ)
+    lat, lon = np.radians(-66.8765400174), np.radians(23.876539914)
+    east     = np.array([-np.sin(lon), np.cos(lon), 0.])
+    north    = np.array([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)])
+    for t in epochs:
+        for prn in range(1, 25):
+            eph = nav.select(np.array([prn]), np.array([t]))
+            p   = 2e7
+            for _ in range(10):
+                sat, dts = nav.position(eph, np.array([t - p / pySPP.C]))
+                sat, dts = nav.position(eph, np.array([t - p / pySPP.C]) - dts)
+                theta = pySPP.OMEGA_E * p / pySPP.C
+                sat   = np.array([sat[0, 0] * np.cos(theta) + sat[0, 1] * np.sin(theta),
+                                  sat[0, 1] * np.cos(theta) - sat[0, 0] * np.sin(theta),
+                                  sat[0, 2]])
+                rho   = np.linalg.norm(sat - XYZ)
+                elev  = np.arcsin((sat - XYZ) @ up / rho)
+                p     = rho + pySPP.C * (CLK - dts[0]) + 2.3 / (np.sin(elev) + 0.0121)
+                if ionosphere:
+                    azim = np.arctan2((sat - XYZ) @ east, (sat - XYZ) @ north)
+                    p   += pySPP.klobuchar(np.array(ION_ALPHA), np.array(ION_BETA), lat, lon,
+                                           np.array([elev]), np.array([azim]), np.array([t]))[0]
+            if elev > np.radians(15):
+                obs.append((t, prn, p))
+    return obs
+
+
+def write_obs(obs, version, types=None):
+    types  = types or (('C1', 'P1', 'P2', 'L1') if version == 2 else ('C1C', 'C1W', 'C2W', 'L1C'))
+    header = [label('     %4.2f           OBSERVATION DATA    G (GPS)' % version, 'RINEX VERSION / TYPE')]
+    if version == 2:
+        header.append(label('%6i' % len(types) + ''.join('%6s' % t for t in types), '# / TYPES OF OBSERV'))
+    else:
+        header.append(label('G  %3i' % len(types) + ''.join(' %3s' % t for t in types), 'SYS / # / OBS TYPES'))
+    header.append(label('', 'END OF HEADER'))
+
+    data   = []
+    epochs = sorted({t for t, _, _ in obs})
+    for t in epochs:
+        sats = [(prn, p) for e, prn, p in obs if e == t]
+        sod  = t - gps_seconds(2020, 1, 1, 0, 0, 0)
+        hh, mm, ss = int(sod // 3600), int(sod % 3600 // 60), sod % 60
+        fields = lambda p: ''.join('%14.3f  ' % p if t[0] in 'CP' else ' ' * 16 for t in types)
+        if version == 2:
+            ids = ''.join('G%02i' % prn for prn, _ in sats)
+            data.append(' 20  1  1 %2i %2i%11.7f  0%3i' % (hh, mm, ss, len(sats)) + ids[0:36] + '\n')
+            for i in range(36, len(ids), 36):
+                data.append(' ' * 32 + ids[i:i + 36] + '\n')
+            data += [fields(p).rstrip() + '\n' for _, p in sats]
+        else:
+            data.append('> 2020 01 01 %2i %2i%11.7f  0%3i\n' % (hh, mm, ss, len(sats)))
+            data += ['G%02i' % prn + fields(p).rstrip() + '\n' for prn, p in sats]
+
+    return header, data
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_single_point_position(tmp_path, version):
+    path = tmp_path / 'brdc0010.20n'
+    path.write_text(make_nav())
+
+    cache = NavCache()
+    nav   = cache.get(str(path))
+    assert cache.get(str(path)) is nav
+    assert nav.prn.size == 24
+
+    epochs = [gps_seconds(2020, 1, 1, 0, 0, 0) + s for s in range(0, 2 * 3600, 300)]
+    header, data = write_obs(simulate(nav, epochs), version)
+
+    xyz, rms = single_point_position(header, data, nav)
+
+    np.testing.assert_allclose(xyz, XYZ, atol=0.05)
+    assert rms < 0.05
+
+    # a wrong navigation file (or observations) is rejected by the chi**2 test
+    header, data = write_obs([(t, prn, p + (50. if prn % 2 else 0.)) for t, prn, p in simulate(nav, epochs[:10])],
+                             version)
+    with pytest.raises(pySPP.pySPPException):
+        single_point_position(header, data, nav, chi_limit=1)
+
+
+def test_single_frequency(tmp_path):
+    path = tmp_path / 'brdc0010.20n'
+    path.write_text(make_nav(ionosphere=True))
+
+    nav = NavCache().get(str(path))
+    np.testing.assert_allclose(nav.ion_beta, ION_BETA)
+
+    # L1 only receiver: the observations include the broadcast ionospheric delay
+    epochs = [gps_seconds(2020, 1, 1, 0, 0, 0) + s for s in range(0, 2 * 3600, 300)]
+    obs    = simulate(nav, epochs, ionosphere=True)
+    assert min(p - q for (_, _, p), (_, _, q) in zip(obs, simulate(nav, epochs))) > 1.
+
+    header, data = write_obs(obs, 2, types=('C1', 'L1'))
+    xyz, rms = single_point_position(header, data, nav)
+
+    np.testing.assert_allclose(xyz, XYZ, atol=0.05)
+    assert rms < 0.05
@@ -0,0 +1,99 @@
+# Created: October 2026
+
+import random
+
+import pytest
+
+from .. import pyPPP
+from ..pyPPP import StationIndex, PPPSpatialCheck, haversine
+
+
+def make_stations(n=2000, seed=1):
+    rng = random.Random(seed)
+    stations = []
+    for i in range(n):
+        stations.append({'NetworkCode': '???' if i % 10 == 0 else 'net',
+                         'StationCode': 's%03x' % i,
+                         'lat': rng.uniform(-90, 90),
+                         'lon': rng.uniform(-180, 180),
+                         'max_dist': rng.choice([None, 1000., 50000.])})
+    # clusters of stations a few meters apart and a station without coordinates
+    for i in range(20):
+        stations.append({'NetworkCode': 'net', 'StationCode': 'c%03i' % i, 'lat': -34.5 + i * 1e-5,
+                         'lon': -58.5, 'max_dist': None})
+    stations.append({'NetworkCode': 'net', 'StationCode': 'none', 'lat': None, 'lon': None, 'max_dist': None})
+    return stations
+
+
+class FakeCnn:
+    """answers the queries of StationIndex.get"""
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.options  = {'hostname': 'test', 'database': 'test'}
+        self.changes  = 0
+        self.queries  = 0
+
+    def query(self, sql):
+        if 'pg_stat_user_tables' in sql:
+            rows = [{'changes': self.changes}]
+        else:
+            self.queries += 1
+            rows = [s for s in self.stations if 'not like' not in sql or not s['NetworkCode'].startswith('?')]
+        return type('rs', (), {'dictresult': lambda _: rows})()
+
+
+def brute_force(stations, lat, lon):
+    result = [dict(s, distance=haversine(lat, lon, s['lat'], s['lon'])) for s in stations if s['lat'] is not None]
+    return sorted(result, key=lambda s: s['distance'])
+
+
+@pytest.mark.parametrize('use_scipy', [True, False])
+def test_index_matches_brute_force(monkeypatch, use_scipy):
+    if not use_scipy:
+        monkeypatch.setattr(pyPPP, 'cKDTree', None)
+
+    stations = make_stations()
+    index    = StationIndex(stations)
+    assert isinstance(index.tree, pyPPP.KDTree) != use_scipy
+
+    rng = random.Random(2)
+    points = [(s['lat'] + rng.uniform(-0.3, 0.3), s['lon']) for s in stations[:200:7] + stations[-21:-1]]
+    points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(50)]
+
+    for lat, lon in points:
+        expected = brute_force(stations, lat, lon)
+
+        within = index.within_max_dist(lat, lon)
+        assert [s['StationCode'] for s in within] == \
+               [s['StationCode'] for s in expected if s['distance'] < (s['max_dist'] or 20)]
+
+        nearest = index.nearest(lat, lon, 5)
+        assert [s['distance'] for s in nearest] == pytest.approx([s['distance'] for s in expected[:5]])
+
+
+def test_verify_spatial_coherence_uses_index():
+    StationIndex.invalidate()
+    stations = make_stations()
+    cnn      = FakeCnn(stations)
+
+    # on top of c005, the other stations of the cluster are 1.1 m apart
+    check = PPPSpatialCheck([-34.5 + 5e-5], [-58.5], [0])
+    result, match, _ = check.verify_spatial_coherence(cnn, 'c005')
+    assert result and [s['StationCode'] for s in match] == ['c005']
+
+    # ambiguous: all the stations of the cluster within 20 m, closest first
+    result, match, _ = check.verify_spatial_coherence(cnn, 'xxxx')
+    assert not result and len(match) == 20 and match[0]['StationCode'] == 'c005'
+
+    # nowhere near a station: closest stations, excluding the ??? networks
+    result, match, closest = PPPSpatialCheck([0.], [0.], [0]).verify_spatial_coherence(cnn, 'xxxx', n_closest=3)
+    assert not result and not match and len(closest) == 3
+    assert not any(s['NetworkCode'].startswith('?') for s in closest)
+
+    # the index is only reloaded when the stations table changes
+    assert cnn.queries == 1
+    cnn.changes += 1
+    PPPSpatialCheck([0.], [0.], [0]).verify_spatial_coherence(cnn, 'xxxx')
+    assert cnn.queries == 2
+    StationIndex.invalidate()
@@ -0,0 +1,91 @@
+# Created: October 2026
+
+import os
+
+from ..pyGamitTask import TablesCache
+
+
+def test_tables_are_linked_from_cache(tmp_path):
+    """two sessions linking the same tables share a single cached copy"""
+
+    source = tmp_path / 'gg' / 'tables'
+    source.mkdir(parents=True)
+    (source / 'luntab.2020.J2000').write_bytes(b'lunar table' * 1000)
+    (source / 'otl.grid').write_bytes(b'ocean loading' * 1000)
+
+    cache = TablesCache(str(tmp_path / 'cache'))
+
+    sessions = []
+    for name in ('sess1', 'sess2'):
+        tables = tmp_path / name / 'tables'
+        tables.mkdir(parents=True)
+        os.symlink(source / 'luntab.2020.J2000', tables / 'luntab.')
+        os.symlink(source / 'otl.grid', tables / 'otl.grid')
+        os.symlink(tmp_path / 'missing', tables / 'dangling')
+        (tables / 'station.info').write_text('per session file')
+        sessions.append((tables, cache.materialize(str(tables))))
+
+    # first session populates the cache, the second only links
+    assert sessions[0][1] == (0, 2)
+    assert sessions[1][1] == (2, 0)
+
+    t1, t2 = sessions[0][0], sessions[1][0]
+    for name in ('luntab.', 'otl.grid'):
+        assert not os.path.islink(t1 / name)
+        assert os.path.samefile(t1 / name, t2 / name)
+    assert (t1 / 'luntab.').read_bytes() == b'lunar table' * 1000
+
+    # untouched entries
+    assert os.path.islink(t1 / 'dangling')
+    assert (t1 / 'station.info').read_text() == 'per session file'
+
+    # a change in the source table produces a new cache entry
+    (source / 'otl.grid').write_bytes(b'updated grid')
+    os.utime(source / 'otl.grid', ns=(0, 10 ** 9))
+    tables = tmp_path / 'sess3' / 'tables'
+    tables.mkdir(parents=True)
+    os.symlink(source / 'otl.grid', tables / 'otl.grid')
+    assert cache.materialize(str(tables)) == (0, 1)
+    assert (tables / 'otl.grid').read_bytes() == b'updated grid'
+
+
+def link_tables(tmp_path, session, source, names):
+    tables = tmp_path / session / 'tables'
+    tables.mkdir(parents=True)
+    for name in names:
+        os.symlink(source / name, tables / name)
+    return tables
+
+
+def test_eviction_and_modified_tables(tmp_path):
+    source = tmp_path / 'gg' / 'tables'
+    source.mkdir(parents=True)
+    for i, name in enumerate(('soltab.', 'luntab.', 'otl.grid')):
+        (source / name).write_bytes(name.encode() * 100)
+        os.utime(source / name, ns=(0, (i + 1) * 10 ** 9))
+
+    # room for two tables
+    cache = TablesCache(str(tmp_path / 'cache'), max_size_gb=1700 / 1024 ** 3)
+
+    t1 = link_tables(tmp_path, 'sess1', source, ['soltab.'])
+    assert cache.materialize(str(t1)) == (0, 1)
+    assert (t1 / 'soltab.').stat().st_mode & 0o222 == 0
+    # last used a long time ago
+    index = tmp_path / 'cache' / 'index'
+    os.utime(index / os.listdir(index)[0], (0, 0))
+
+    t2 = link_tables(tmp_path, 'sess2', source, ['luntab.', 'otl.grid'])
+    assert cache.materialize(str(t2)) == (0, 2)
+
+    # soltab was the least recently used table
+    assert len(os.listdir(tmp_path / 'cache' / 'files')) == 2
+    assert len(os.listdir(tmp_path / 'cache' / 'index')) == 2
+    # the session that linked it still has the table
+    assert (t1 / 'soltab.').read_bytes() == b'soltab.' * 100
+
+    # a table written in place through a link is not handed to other sessions
+    os.chmod(t2 / 'otl.grid', 0o644)
+    (t2 / 'otl.grid').write_bytes(b'garbage')
+    t3 = link_tables(tmp_path, 'sess3', source, ['otl.grid'])
+    assert cache.materialize(str(t3)) == (0, 1)
+    assert (t3 / 'otl.grid').read_bytes() == b'otl.grid' * 100